@@ -0,0 +1,220 @@
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from server import BenchConfig, start_server
+
+# Roda process_posts de ponta a ponta contra o servidor local e mede itens/s, MB/s,
+# pico de memória e tempo até o primeiro byte de mídia.
+#
+#   python bench/bench_posts.py --posts 500 --latency 0.02 --bandwidth 5 --error-rate 0.05
+
+MB = 1024 * 1024
+
+def peak_rss_mb():
+    if resource is None:
+        return None, None
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / MB
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / MB
+    return round(own, 1), round(children, 1)
+
+def parse_env(values):
+    env = {}
+    for value in values:
+        key, _, val = value.partition("=")
+        env[key] = val
+    return env
+
+def bench_scraper():
+    from source.scraper import PrivacyScraper
+
+    scraper = PrivacyScraper()
+    # Sem navegador: o servidor local aceita qualquer token
+    scraper.token_v1 = scraper.token_v2 = "bench"
+    return scraper
+
+def run_worker_process(queue_path):
+    # Worker do modo distribuído, subido pelo próprio bench com o ambiente do servidor local
+    from source.jobs import JobQueue, run_worker
+    from source.media import MediaDownloader, open_manifest
+
+    scraper = bench_scraper()
+    manifest = open_manifest()
+    job_queue = JobQueue(queue_path)
+    try:
+        run_worker(scraper, MediaDownloader(scraper.scraper), manifest, job_queue, idle_timeout=0)
+    finally:
+        job_queue.close()
+        manifest.close()
+        scraper.close()
+
+def run_distributed(scraper, profiles, media_type, manifest, workers):
+    from source.jobs import JobQueue, run_coordinator
+
+    job_queue = JobQueue()
+    # Marca o coordenador como ativo antes dos workers subirem, senão eles acham a fila vazia e saem
+    job_queue.coordinator_alive()
+    command = [sys.executable, os.path.abspath(__file__), "--worker-queue", os.path.abspath(job_queue.path)]
+    env = dict(os.environ, TQDM_DISABLE="1")
+    processes = [subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL) for _ in range(workers)]
+    try:
+        return run_coordinator(scraper, profiles, media_type, manifest, job_queue)
+    finally:
+        for process in processes:
+            process.wait()
+        job_queue.close()
+
+def run_once(server, profiles, media_type, workdir, engine="sync", queue_workers=0):
+    from source import async_engine
+    from source.media import MediaDownloader, open_manifest, process_posts
+    from source.scheduler import process_profiles
+
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    server.stats.reset()
+
+    scraper = bench_scraper()
+    media_downloader = MediaDownloader(scraper.scraper)
+    manifest = open_manifest()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        if queue_workers:
+            results = run_distributed(scraper, profiles, media_type, manifest, queue_workers)
+        elif engine == "async":
+            results = async_engine.run_profiles(scraper, media_downloader, profiles, media_type, manifest)
+        elif len(profiles) == 1:
+            results = [process_posts(scraper, media_downloader, profiles[0], media_type, manifest=manifest)]
+        else:
+            results = process_profiles(scraper, media_downloader, profiles, media_type, manifest)
+    finally:
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        manifest.close()
+        scraper.close()
+
+    stats = server.stats
+    downloaded = sum(r["downloaded"] for r in results)
+    failed = sum(r["failed"] for r in results)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        # Inclui as threads do servidor local, que roda no mesmo processo
+        "cpu_s": round(cpu, 3),
+        "downloaded": downloaded,
+        "failed": failed,
+        "items_per_s": round(downloaded / elapsed, 2) if elapsed else None,
+        "mb_per_s": round(stats.media_bytes / MB / elapsed, 2) if elapsed else None,
+        "media_mb": round(stats.media_bytes / MB, 2),
+        "ttfb_s": round(stats.first_media_byte - start, 3) if stats.first_media_byte else None,
+        "requests": stats.requests,
+        "injected_errors": stats.errors,
+        "injected_drops": stats.drops,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de process_posts contra um servidor local")
+    parser.add_argument("--profiles", type=int, default=1)
+    parser.add_argument("--posts", type=int, default=200, help="posts por perfil")
+    parser.add_argument("--media-type", choices=("1", "2", "3"), default="3", help="1 fotos, 2 vídeos, 3 ambos")
+    parser.add_argument("--video-ratio", type=float, default=0.2)
+    parser.add_argument("--video-mode", choices=("mp4", "hls", "mixed"), default="mp4")
+    parser.add_argument("--image-kb", type=int, default=300)
+    parser.add_argument("--video-mb", type=float, default=4)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--sample-segment", help="arquivo .ts real servido como cada segmento (necessário para o ffmpeg converter)")
+    parser.add_argument("--no-encrypt", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.0, help="atraso por requisição em segundos")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="banda por conexão em MB/s (0 = sem limite)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de requisições de mídia respondidas com 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fração de respostas de mídia cortadas no meio")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--engine", choices=("sync", "async"), default="sync", help="motor de download usado na rodada")
+    parser.add_argument("--queue-workers", type=int, default=0, metavar="N", help="roda em modo coordinator com N processos worker")
+    parser.add_argument("--worker-queue", help=argparse.SUPPRESS)
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR", help="variáveis repassadas ao scraper (ex.: IMAGE_WORKERS=8)")
+    parser.add_argument("--workdir", help="pasta de trabalho (padrão: temporária)")
+    parser.add_argument("--metrics", action="store_true", help="coleta métricas por fase e inclui no resultado")
+    parser.add_argument("--json", action="store_true", help="imprime só o resultado em JSON")
+    args = parser.parse_args()
+    if args.worker_queue:
+        run_worker_process(args.worker_queue)
+        return
+
+    config = BenchConfig(
+        profiles=args.profiles, posts=args.posts, video_ratio=args.video_ratio, video_mode=args.video_mode,
+        image_size=args.image_kb * 1024, video_size=int(args.video_mb * MB), segments=args.segments,
+        latency=args.latency, bandwidth=args.bandwidth * MB, error_rate=args.error_rate,
+        drop_rate=args.drop_rate, encrypt=not args.no_encrypt, sample_segment=args.sample_segment,
+    )
+    server = start_server(config)
+
+    # As URLs e opções do scraper são lidas no import, então o ambiente vem antes
+    os.environ.update({
+        "PRIVACY_BASE_URL": server.url,
+        "PRIVACY_SERVICE_URL": f"{server.url}/service",
+        "RETRY_BASE_DELAY": "0.05",
+        "RETRY_MAX_DELAY": "0.5",
+        "DEBUG": "False",
+        "METRICS": str(args.metrics),
+    })
+    os.environ.update(parse_env(args.env))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="privacy-bench-")
+    runs = []
+    try:
+        # Com --json a saída padrão fica reservada para o resultado
+        with contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext():
+            for i in range(args.repeat):
+                # Cada rodada começa sem manifest nem store, senão tudo seria pulado
+                runs.append(run_once(server, config.profiles, args.media_type, os.path.join(workdir, f"run{i}"), args.engine, args.queue_workers))
+    finally:
+        os.chdir(ROOT)
+        server.shutdown()
+
+    own_rss, children_rss = peak_rss_mb()
+    from source import metrics
+    summary = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "workdir", "worker_queue")},
+        "runs": runs,
+        "median_items_per_s": statistics.median(r["items_per_s"] or 0 for r in runs),
+        "median_mb_per_s": statistics.median(r["mb_per_s"] or 0 for r in runs),
+        "median_ttfb_s": statistics.median(r["ttfb_s"] or 0 for r in runs),
+        "peak_rss_mb": own_rss,
+        "peak_rss_children_mb": children_rss,
+        "workdir": workdir,
+    }
+    if metrics.ENABLED:
+        summary["metrics"] = metrics.snapshot()
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print()
+    for i, r in enumerate(runs):
+        print(f"Rodada {i}: {r['downloaded']} baixados, {r['failed']} falhas em {r['elapsed_s']}s (CPU {r['cpu_s']}s) | "
+              f"{r['items_per_s']} itens/s | {r['mb_per_s']} MB/s | TTFB {r['ttfb_s']}s | "
+              f"{r['requests']} requisições ({r['injected_errors']} erros, {r['injected_drops']} cortes)")
+    print(f"Mediana: {summary['median_items_per_s']} itens/s | {summary['median_mb_per_s']} MB/s | TTFB {summary['median_ttfb_s']}s")
+    print(f"Pico de memória: {own_rss} MB (processos filhos: {children_rss} MB)")
+    if metrics.ENABLED:
+        print(metrics.format_summary())
+
+if __name__ == "__main__":
+    main()
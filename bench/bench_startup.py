@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Mede o tempo de partida: cada cenário roda num processo novo, várias vezes, e reporta a
+# mediana. Também confere que as dependências pesadas não foram importadas sem necessidade.
+#
+#   python bench/bench_startup.py --repeat 10
+#   python bench/bench_startup.py --binary dist/privacy_scraper/privacy_scraper.exe
+
+HEAVY_MODULES = ("playwright", "bs4", "ffmpeg", "aiohttp", "inquirer", "cryptography")
+
+# Importa o que uma execução batch sem navegador e sem ffmpeg importa antes do primeiro download
+BATCH_IMPORTS = """
+import json, sys, time
+start = time.perf_counter()
+import main
+main.apply_environment({})
+from source import metrics
+from source.media import MediaDownloader, open_manifest
+from source.scheduler import process_profiles
+from source.scraper import PrivacyScraper
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_s": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def run(command):
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} falhou: {result.stderr.strip()}")
+    return elapsed, result.stdout
+
+def measure(command, repeat):
+    runs = [run(command) for _ in range(repeat)]
+    return runs, round(statistics.median(elapsed for elapsed, _ in runs), 4)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do tempo de partida do main.py")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--binary", help="executável empacotado pelo PyInstaller, medido com --help")
+    parser.add_argument("--json", action="store_true", help="imprime só o resultado em JSON")
+    args = parser.parse_args()
+
+    results = {}
+    _, results["python_s"] = measure([sys.executable, "-c", "pass"], args.repeat)
+    _, results["help_s"] = measure([sys.executable, "main.py", "--help"], args.repeat)
+    runs, results["batch_imports_s"] = measure([sys.executable, "-c", BATCH_IMPORTS], args.repeat)
+    report = json.loads(runs[-1][1])
+    results["batch_imports_in_process_s"] = round(report["import_s"], 4)
+    results["heavy_modules_loaded"] = report["loaded"]
+    if args.binary:
+        _, results["binary_help_s"] = measure([os.path.abspath(args.binary), "--help"], args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Interpretador vazio:   {results['python_s']:.3f}s")
+    print(f"main.py --help:        {results['help_s']:.3f}s")
+    print(f"Imports do modo batch: {results['batch_imports_s']:.3f}s ({results['batch_imports_in_process_s']:.3f}s dentro do processo)")
+    if args.binary:
+        print(f"Executável --help:     {results['binary_help_s']:.3f}s")
+    loaded = results["heavy_modules_loaded"]
+    print(f"Dependências pesadas importadas: {', '.join(loaded) if loaded else 'nenhuma'}")
+
+if __name__ == "__main__":
+    main()
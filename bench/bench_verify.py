@@ -0,0 +1,88 @@
+import argparse
+import contextlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Gera uma biblioteca sintética (JPEGs e MP4s com estrutura válida, uma fração corrompida)
+# e mede a verificação a frio e a segunda passada, que deve sair quase toda do cache.
+#
+#   python bench/bench_verify.py --files 20000 --workers 8
+
+def box(box_type, body):
+    return struct.pack(">I", 8 + len(body)) + box_type + body
+
+def jpeg_bytes(size):
+    # SOI, APP0 e SOS seguidos dos dados comprimidos com os FF escapados, como num JPEG real
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    sos = b"\xff\xda" + struct.pack(">H", 8) + b"\x01\x01\x00\x00\x3f\x00"
+    return b"\xff\xd8" + app0 + sos + os.urandom(size).replace(b"\xff", b"\xff\x00") + b"\xff\xd9"
+
+def build_library(root, profiles, files, size, broken_ratio):
+    mp4 = box(b"ftyp", b"isom" * 4) + box(b"moov", os.urandom(256)) + box(b"mdat", os.urandom(size))
+    jpeg = jpeg_bytes(size)
+    # Motion photo: o vídeo vai anexado depois do EOI e o arquivo continua íntegro
+    motion = jpeg_bytes(size // 2) + mp4[:size // 2]
+    broken = 0
+    for p in range(profiles):
+        for folder in ("fotos", "videos"):
+            os.makedirs(os.path.join(root, f"perfil{p}", folder), exist_ok=True)
+        for i in range(files // profiles):
+            video = i % 5 == 0
+            data = mp4 if video else (motion if i % 5 == 1 else jpeg)
+            if (i * 7919) % 1000 < broken_ratio * 1000:
+                data = data[:len(data) // 2]
+                broken += 1
+            folder, ext = ("videos", "mp4") if video else ("fotos", "jpg")
+            with open(os.path.join(root, f"perfil{p}", folder, f"2024-01-01_00-00-00_m{p}x{i}.{ext}"), "wb") as f:
+                f.write(data)
+    return broken
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do modo --verify")
+    parser.add_argument("--profiles", type=int, default=4)
+    parser.add_argument("--files", type=int, default=5000, help="arquivos no total")
+    parser.add_argument("--kb", type=int, default=64, help="tamanho de cada arquivo")
+    parser.add_argument("--broken-ratio", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, help="processos da verificação (padrão: CPUs)")
+    parser.add_argument("--workdir", help="pasta de trabalho (padrão: temporária)")
+    parser.add_argument("--json", action="store_true", help="imprime só o resultado em JSON")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="privacy-verify-")
+    os.chdir(workdir)
+    os.environ.update({"DOWNLOAD_DIR": "downloads", "CACHE_DIR": ".cache", "DEBUG": "False"})
+    expected = build_library("downloads", args.profiles, args.files, args.kb * 1024, args.broken_ratio)
+
+    from source.verify import verify_library
+
+    results = {"files": args.files, "expected_broken": expected, "workdir": workdir}
+    for label in ("cold", "cached"):
+        start = time.perf_counter()
+        # A lista de arquivos quebrados vai para a saída de erro, como no main.py
+        with contextlib.redirect_stdout(sys.stderr):
+            report = verify_library(workers=args.workers)
+        elapsed = time.perf_counter() - start
+        results[label] = {
+            "elapsed_s": round(elapsed, 3),
+            "files_per_s": round(report["checked"] / elapsed, 1) if elapsed else None,
+            "from_cache": report["cached"],
+            "broken": sum(len(r["broken"]) for r in report["profiles"]),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for label in ("cold", "cached"):
+        r = results[label]
+        print(f"{label}: {r['elapsed_s']}s | {r['files_per_s']} arquivos/s | {r['from_cache']} do cache | {r['broken']} quebrados")
+    print(f"Esperados {expected} quebrados em {args.files} arquivos")
+
+if __name__ == "__main__":
+    main()
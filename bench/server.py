@@ -0,0 +1,325 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+# Servidor local que imita os endpoints usados pelo scraper: PartialPosts, Mosaico,
+# UserFollowing, token de vídeo, playlists HLS, chaves AES-128, segmentos .ts e MP4 direto.
+
+PAGE_SIZE = 50
+SEGMENT_DURATION = 4
+WRITE_CHUNK = 16 * 1024
+MEDIA_PATHS = ("/cdn/", "/video/")
+
+def media_id(profile, index):
+    return hashlib.sha1(f"{profile}-{index}".encode()).hexdigest()[:24]
+
+def payload(name, size):
+    # Conteúdo determinístico por nome, para que o ETag se repita entre execuções
+    seed = hashlib.sha256(name.encode()).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+def pkcs7(data):
+    pad = 16 - len(data) % 16
+    return data + bytes([pad]) * pad
+
+class BenchConfig:
+    def __init__(self, profiles=1, posts=200, video_ratio=0.2, video_mode="mp4",
+                 image_size=300 * 1024, video_size=4 * 1024 * 1024, segments=8,
+                 latency=0.0, bandwidth=0.0, error_rate=0.0, drop_rate=0.0,
+                 encrypt=True, sample_segment=None, seed=1):
+        self.profiles = [f"perfil{i}" for i in range(profiles)]
+        self.posts = posts
+        self.video_ratio = video_ratio
+        self.video_mode = video_mode
+        self.image_size = image_size
+        self.video_size = video_size
+        self.segments = segments
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.encrypt = encrypt and Cipher is not None
+        self.sample_segment = sample_segment
+        self.seed = seed
+
+class BenchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.drops = 0
+        self.media_bytes = 0
+        self.first_media_byte = None
+
+    def count(self, errors=0):
+        with self.lock:
+            self.requests += 1
+            self.errors += errors
+
+    def dropped(self):
+        with self.lock:
+            self.drops += 1
+
+    def sent(self, nbytes, media):
+        with self.lock:
+            if media:
+                self.media_bytes += nbytes
+                if self.first_media_byte is None:
+                    self.first_media_byte = time.perf_counter()
+
+    def reset(self):
+        with self.lock:
+            self.requests = self.errors = self.drops = self.media_bytes = 0
+            self.first_media_byte = None
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        super().__init__((host, port), BenchHandler)
+        self.config = config
+        self.stats = BenchStats()
+        self.random = random.Random(config.seed)
+        self.random_lock = threading.Lock()
+        self.posts = {profile: self.build_posts(profile) for profile in config.profiles}
+        self.keys = {}
+        self.segment_sample = None
+        if config.sample_segment:
+            with open(config.sample_segment, "rb") as f:
+                self.segment_sample = f.read()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self, rate):
+        if rate <= 0:
+            return False
+        with self.random_lock:
+            return self.random.random() < rate
+
+    def build_posts(self, profile):
+        now = datetime(2025, 1, 1)
+        videos_every = round(1 / self.config.video_ratio) if self.config.video_ratio else 0
+        posts = []
+        for i in range(self.config.posts):
+            mid = media_id(profile, i)
+            is_video = videos_every and i % videos_every == 0
+            if not is_video:
+                url = f"/cdn/{mid}.jpg"
+            elif self.config.video_mode == "hls" or (self.config.video_mode == "mixed" and i % 2):
+                url = f"/video/{mid}/hls/master.m3u8"
+            else:
+                url = f"/video/{mid}/video.mp4"
+            posts.append({
+                "postDate": (now - timedelta(hours=i)).strftime("%d/%m/%Y %H:%M:%S"),
+                "files": [{"isLocked": False, "type": "video" if is_video else "image", "url": url, "mediaId": mid}],
+            })
+        return posts
+
+    def key_for(self, mid):
+        with self.random_lock:
+            return self.keys.setdefault(mid, hashlib.md5(mid.encode()).digest())
+
+    def segment(self, mid, seq):
+        data = self.segment_sample or payload(f"{mid}-{seq}", self.config.video_size // self.config.segments)
+        if not self.config.encrypt:
+            return data
+        encryptor = Cipher(algorithms.AES(self.key_for(mid)), modes.CBC(seq.to_bytes(16, "big"))).encryptor()
+        return encryptor.update(pkcs7(data)) + encryptor.finalize()
+
+class BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        self.handle_request()
+
+    def handle_request(self):
+        server = self.server
+        config = server.config
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        media = parsed.path.startswith(MEDIA_PATHS)
+
+        if config.latency:
+            time.sleep(config.latency)
+        if media and server.roll(config.error_rate):
+            server.stats.count(errors=1)
+            return self.reply(503, b"", headers={"Retry-After": "0"})
+        server.stats.count()
+
+        route = self.route(parsed.path, query)
+        if route is None:
+            return self.reply(404, b"")
+        status, body, content_type = route
+        self.reply(status, body, content_type, media=media)
+
+    def route(self, path, query):
+        server = self.server
+        if path == "/Profile" and query.get("handler") == ["PartialPosts"]:
+            posts = server.posts.get(query["nomePerfil"][0], [])
+            skip = int(query.get("skip", ["0"])[0])
+            take = int(query.get("take", [str(PAGE_SIZE)])[0])
+            items = [self.absolute_post(post) for post in posts[skip:skip + take]]
+            return 200, json.dumps({"mosaicItems": items}).encode(), "application/json"
+
+        match = re.fullmatch(r"/profile/([^/]+)/Mosaico", path)
+        if match:
+            profile = match.group(1)
+            posts = server.posts.get(profile, [])
+            videos = sum(1 for post in posts if post["files"][0]["type"] == "video")
+            html = (
+                f'<html><body><a class="filter-button selected" href="/profile/{profile}/Mosaico">{len(posts)} postagens</a>'
+                f'<a class="filter-button" href="/profile/{profile}/Fotos">{len(posts) - videos} fotos</a>'
+                f'<a class="filter-button" href="/profile/{profile}/Videos">{videos} vídeos</a></body></html>'
+            )
+            return 200, html.encode(), "text/html; charset=utf-8"
+
+        if path == "/service/profile/UserFollowing":
+            page = int(query.get("page", ["0"])[0])
+            limit = int(query.get("limit", ["30"])[0])
+            names = server.config.profiles[page * limit:(page + 1) * limit]
+            return 200, json.dumps([{"profileName": name} for name in names]).encode(), "application/json"
+
+        if path == "/service/media/video/token":
+            file_id = json.loads(self.body or b"{}").get("file_id", "")
+            return 200, json.dumps({"content": f"token-{file_id}"}).encode(), "application/json"
+
+        match = re.fullmatch(r"/cdn/([0-9a-f]+)\.jpg", path)
+        if match:
+            return 200, payload(match.group(1), server.config.image_size), "image/jpeg"
+
+        match = re.fullmatch(r"/video/([0-9a-f]+)/video\.mp4", path)
+        if match:
+            return 200, payload(match.group(1), server.config.video_size), "video/mp4"
+
+        match = re.fullmatch(r"/video/([0-9a-f]+)/hls/(.+)", path)
+        if match:
+            return self.hls(match.group(1), match.group(2))
+        return None
+
+    def hls(self, mid, name):
+        server = self.server
+        config = server.config
+        if name == "master.m3u8":
+            body = (
+                "#EXTM3U\n"
+                "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\nlow/index.m3u8\n"
+                "#EXT-X-STREAM-INF:BANDWIDTH=4000000,RESOLUTION=1920x1080\nhigh/index.m3u8\n"
+            )
+            return 200, body.encode(), "application/vnd.apple.mpegurl"
+        match = re.fullmatch(r"(low|high)/index\.m3u8", name)
+        if match:
+            lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{SEGMENT_DURATION}", "#EXT-X-MEDIA-SEQUENCE:0"]
+            if config.encrypt:
+                lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="{server.url}/video/{mid}/hls/{match.group(1)}/key.bin"')
+            for seq in range(config.segments):
+                lines += [f"#EXTINF:{SEGMENT_DURATION}.0,", f"segment{seq}.ts"]
+            lines.append("#EXT-X-ENDLIST")
+            return 200, "\n".join(lines).encode(), "application/vnd.apple.mpegurl"
+        if name.endswith("key.bin"):
+            return 200, server.key_for(mid), "application/octet-stream"
+        match = re.fullmatch(r"(?:low|high)/segment(\d+)\.ts", name)
+        if match:
+            return 200, server.segment(mid, int(match.group(1))), "video/mp2t"
+        return None
+
+    def absolute_post(self, post):
+        files = [dict(f, url=self.server.url + f["url"]) for f in post["files"]]
+        return dict(post, files=files)
+
+    def reply(self, status, body, content_type="application/octet-stream", headers=None, media=False):
+        server = self.server
+        config = server.config
+        start = 0
+        end = len(body) - 1
+        range_header = self.headers.get("Range")
+        if status == 200 and range_header and media:
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header.strip())
+            if match:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), end)
+                if start >= len(body):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(body)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+
+        data = body[start:end + 1]
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if media and status in (200, 206):
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", f'"{hashlib.md5(body).hexdigest()}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        drop_at = len(data) // 2 if media and data and server.roll(config.drop_rate) else None
+        limit = drop_at if drop_at is not None else len(data)
+        view = memoryview(data)
+        sent = 0
+        started = time.perf_counter()
+        try:
+            while sent < limit:
+                chunk = view[sent:min(sent + WRITE_CHUNK, limit)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                server.stats.sent(len(chunk), media)
+                if config.bandwidth:
+                    # Banda por conexão em bytes/s
+                    ahead = sent / config.bandwidth - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        if drop_at is not None:
+            server.stats.dropped()
+            self.close_connection = True
+
+def start_server(config, host="127.0.0.1", port=0):
+    server = BenchServer(config, host, port)
+    thread = threading.Thread(target=server.serve_forever, name="bench-server", daemon=True)
+    thread.start()
+    return server
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API do Privacy")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profiles", type=int, default=1)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--video-mode", choices=("mp4", "hls", "mixed"), default="mp4")
+    args = parser.parse_args()
+    server = BenchServer(BenchConfig(profiles=args.profiles, posts=args.posts, video_mode=args.video_mode), port=args.port)
+    print(f"Servindo em {server.url} (PRIVACY_BASE_URL={server.url} PRIVACY_SERVICE_URL={server.url}/service)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
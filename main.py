@@ -1,63 +1,417 @@
-from source.scraper import PrivacyScraper
-from source.media import MediaDownloader, download_and_process_video, process_posts
-import inquirer
+import argparse
+import contextlib
+import importlib.util
+import json
+import multiprocessing
 import os
+import sys
+import time
 
-DOWNLOAD_DIR = "downloads"
+# Os módulos do source (e as dependências pesadas: Playwright, aiohttp, ffmpeg) só são
+# importados dentro de main(), depois do .env e dos argumentos aplicados no ambiente
 
-def main():
-    scraper = PrivacyScraper()
+MEDIA_TYPES = {
+    "1": "1", "fotos": "1", "photos": "1",
+    "2": "2", "videos": "2", "vídeos": "2",
+    "3": "3", "todos": "3", "all": "3",
+}
+SYNC_MODES = ("full", "incremental")
+ROLES = ("local", "coordinator", "worker")
 
-    if scraper.login():
-        media_downloader = MediaDownloader(scraper.scraper)
-        profiles = sorted(scraper.get_profiles(), key=lambda p: p.lower())
-
-        if profiles:
-            profile_choices = [("[SELECIONAR TODOS]", "__ALL__")] + [(p.lower(), p) for p in profiles]
-            questions = [
-                inquirer.Checkbox(
-                    'profiles',
-                    message="Selecione os perfis para baixar (use espaço para marcar)",
-                    choices=profile_choices,
-                )
-            ]
-            answers = inquirer.prompt(questions)
-            selected_profiles = answers.get('profiles', [])
-
-            if "__ALL__" in selected_profiles:
-                selected_profiles = profiles
-
-            if not selected_profiles:
-                print("Nenhum perfil selecionado. Encerrando.")
-                return
-
-            media_question = [
-                inquirer.List(
-                    'media_type',
-                    message="Escolha o tipo de mídia para download",
-                    choices=[
-                        ("Todos", "3"),
-                        ("Fotos", "1"),
-                        ("Vídeos", "2")
-                    ]
-                )
+# Opções que viram variáveis de ambiente antes dos módulos do source serem importados,
+# já que eles leem a configuração no import
+ENV_OPTIONS = {
+    "output": "DOWNLOAD_DIR",
+    "mode": "SYNC_MODE",
+    "profile_workers": "PROFILE_WORKERS",
+    "image_workers": "IMAGE_WORKERS",
+    "video_workers": "VIDEO_WORKERS",
+    "segment_workers": "SEGMENT_WORKERS",
+    "conversion_workers": "CONVERSION_WORKERS",
+    "max_bandwidth_mbps": "MAX_BANDWIDTH_MBPS",
+    "queue": "JOB_QUEUE",
+    "role": "ROLE",
+    "verify_workers": "VERIFY_WORKERS",
+}
+
+# Exit codes do modo batch
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_ERROR = 2
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Downloader de mídias do Privacy. Sem --profiles, pergunta tudo de forma interativa."
+    )
+    parser.add_argument("--config", help="arquivo JSON com as mesmas opções (os argumentos têm prioridade)")
+    parser.add_argument("--profiles", nargs="+", metavar="PERFIL", help="perfis a baixar ('all' para todos); ativa o modo batch")
+    parser.add_argument("--media-type", help="fotos, videos ou todos (ou 1, 2, 3)")
+    parser.add_argument("--mode", choices=SYNC_MODES, help="completo ou apenas posts novos")
+    parser.add_argument("--output", help="pasta raiz dos downloads (padrão: downloads)")
+    parser.add_argument("--engine", choices=("sync", "async"), help="motor de download: threads (sync) ou asyncio/aiohttp (async)")
+    parser.add_argument("--profile-workers", type=int, help="perfis processados ao mesmo tempo")
+    parser.add_argument("--image-workers", type=int)
+    parser.add_argument("--video-workers", type=int)
+    parser.add_argument("--segment-workers", type=int)
+    parser.add_argument("--conversion-workers", type=int)
+    parser.add_argument("--max-bandwidth-mbps", type=float)
+    parser.add_argument("--role", choices=ROLES, help="local (padrão), coordinator (enfileira os posts) ou worker (baixa jobs da fila)")
+    parser.add_argument("--queue", metavar="ARQUIVO", help="fila de jobs SQLite compartilhada (padrão: <output>/jobs.db)")
+    parser.add_argument("--spawn-workers", type=int, metavar="N", help="no coordinator, sobe N workers locais")
+    parser.add_argument("--verify", action="store_true", default=None, help="confere os arquivos já baixados (sem login) e lista os quebrados")
+    parser.add_argument("--repair", action="store_true", default=None, help="como --verify, mas apaga os quebrados e as sobras e deixa os quebrados para baixar de novo")
+    parser.add_argument("--verify-workers", type=int, help="processos usados na verificação")
+    parser.add_argument("--summary", metavar="ARQUIVO", help="grava o resumo JSON neste arquivo em vez da saída padrão")
+    return parser
+
+def parse_args(argv=None):
+    return build_parser().parse_args(argv)
+
+def config_types(action):
+    if isinstance(action, argparse._StoreTrueAction):
+        return (bool,)
+    if action.type is int:
+        return (int,)
+    if action.type is float:
+        return (int, float)
+    if action.nargs == "+":
+        return (list, str)
+    # O tipo de mídia também aceita o número do menu (1, 2 ou 3)
+    return (str, int) if action.dest == "media_type" else (str,)
+
+def validate_config(config):
+    # O arquivo passa pelas mesmas regras dos argumentos. Uma chave desconhecida (um
+    # "profile" digitado errado) jogaria a execução agendada nos prompts interativos, e um
+    # tipo errado só estouraria no import do source, fora do tratamento de erro.
+    actions = {action.dest: action for action in build_parser()._actions if action.dest not in ("help", "config")}
+    for key, value in config.items():
+        if key == "env":
+            if not isinstance(value, dict) or not all(isinstance(v, (str, int, float, bool)) for v in value.values()):
+                raise ValueError("'env' deve ser um objeto JSON com valores simples")
+            continue
+        action = actions.get(key)
+        if action is None:
+            raise ValueError(f"opção desconhecida no arquivo de configuração: {key}")
+        if value is None:
+            continue
+        expected = config_types(action)
+        if not isinstance(value, expected) or (isinstance(value, bool) and bool not in expected):
+            raise ValueError(f"valor inválido para {key}: {value!r}")
+        if isinstance(value, list) and not all(isinstance(item, str) for item in value):
+            raise ValueError(f"valor inválido para {key}: {value!r}")
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("o arquivo de configuração deve conter um objeto JSON")
+    config = {key.replace("-", "_"): value for key, value in config.items()}
+    validate_config(config)
+    return config
+
+def resolve_options(args):
+    # Prioridade: argumentos > arquivo de configuração > variáveis de ambiente (.env)
+    config = load_config(args.config) if args.config else {}
+    options = dict(config)
+    for key, value in vars(args).items():
+        if value is not None and key != "config":
+            options[key] = value
+
+    profiles = options.get("profiles")
+    if isinstance(profiles, str):
+        profiles = [p.strip() for p in profiles.split(",") if p.strip()]
+    options["profiles"] = profiles
+
+    if options.get("media_type") is not None:
+        media_type = MEDIA_TYPES.get(str(options["media_type"]).lower())
+        if not media_type:
+            raise ValueError(f"tipo de mídia inválido: {options['media_type']}")
+        options["media_type"] = media_type
+    if options.get("mode") is not None and options["mode"] not in SYNC_MODES:
+        raise ValueError(f"modo inválido: {options['mode']}")
+
+    options["role"] = options.get("role") or os.getenv("ROLE", "local").lower()
+    if options["role"] not in ROLES:
+        raise ValueError(f"papel inválido: {options['role']}")
+
+    engine = os.getenv("ENGINE", "sync").lower()
+    options["engine"] = options.get("engine") or (engine if engine in ("sync", "async") else "sync")
+    if options["engine"] not in ("sync", "async"):
+        raise ValueError(f"motor inválido: {options['engine']}")
+    return options
+
+def apply_environment(options):
+    # O "env" do arquivo vem antes das opções, para não passar por cima dos argumentos
+    for name, value in (options.get("env") or {}).items():
+        os.environ[name] = str(value)
+    for key, name in ENV_OPTIONS.items():
+        if options.get(key) is not None:
+            os.environ[name] = str(options[key])
+    # O store de deduplicação acompanha a pasta de saída, a não ser que tenha sido fixado
+    if options.get("output") is not None and "STORE_DIR" not in os.environ:
+        os.environ["STORE_DIR"] = os.path.join(options["output"], ".store")
+
+def ask_options(profiles, default_mode):
+    import inquirer
+
+    profile_choices = [("[SELECIONAR TODOS]", "__ALL__")] + [(p.lower(), p) for p in profiles]
+    questions = [
+        inquirer.Checkbox(
+            'profiles',
+            message="Selecione os perfis para baixar (use espaço para marcar)",
+            choices=profile_choices,
+        )
+    ]
+    answers = inquirer.prompt(questions)
+    selected_profiles = answers.get('profiles', [])
+
+    if "__ALL__" in selected_profiles:
+        selected_profiles = profiles
+
+    if not selected_profiles:
+        print("Nenhum perfil selecionado. Encerrando.")
+        return None
+
+    media_question = [
+        inquirer.List(
+            'media_type',
+            message="Escolha o tipo de mídia para download",
+            choices=[
+                ("Todos", "3"),
+                ("Fotos", "1"),
+                ("Vídeos", "2")
             ]
-            media_type_answer = inquirer.prompt(media_question)
-            media_type = media_type_answer.get('media_type')
+        )
+    ]
+    media_type_answer = inquirer.prompt(media_question)
+    media_type = media_type_answer.get('media_type')
 
-            if media_type not in ["1", "2", "3"]:
-                print("Tipo de mídia inválido. Encerrando.")
-                return
+    if media_type not in ["1", "2", "3"]:
+        print("Tipo de mídia inválido. Encerrando.")
+        return None
 
-            for profile in selected_profiles:
-                print(f"\n[PROCESSANDO PERFIL]: {profile}")
-                process_posts(scraper, media_downloader, profile, media_type)
+    sync_question = [
+        inquirer.List(
+            'sync_mode',
+            message="Escolha o modo de sincronização",
+            choices=[
+                ("Completo (percorre todos os posts)", "full"),
+                ("Incremental (apenas posts novos)", "incremental")
+            ],
+            default=default_mode
+        )
+    ]
+    sync_answer = inquirer.prompt(sync_question)
+    return selected_profiles, media_type, sync_answer.get('sync_mode')
 
-        else:
-            print("Nenhum perfil encontrado.")
-        scraper.close()
+def select_profiles(requested, available):
+    # Nomes comparados sem diferenciar maiúsculas; 'all' seleciona todos os perfis assinados
+    if any(p.lower() in ("all", "todos") for p in requested):
+        return available, []
+    by_name = {p.lower(): p for p in available}
+    selected = [by_name[p.lower()] for p in requested if p.lower() in by_name]
+    missing = [p for p in requested if p.lower() not in by_name]
+    return selected, missing
+
+def build_summary(status, options, started_at, results=None, missing=None, error=None):
+    results = results or []
+    summary = {
+        "status": status,
+        "engine": options.get("engine"),
+        "media_type": options.get("media_type"),
+        "mode": options.get("mode"),
+        "output": os.getenv("DOWNLOAD_DIR", "downloads"),
+        "elapsed_s": round(time.time() - started_at, 3),
+        "downloaded": sum(r.get("downloaded", 0) for r in results),
+        "failed": sum(r.get("failed", 0) for r in results),
+        "profiles": results + [{"profile": p, "error": "perfil não encontrado"} for p in missing or []],
+    }
+    if error:
+        summary["error"] = error
+    return summary
+
+def write_summary(summary, path=None):
+    data = json.dumps(summary, ensure_ascii=False, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
     else:
-        print("Falha no login.")
+        print(data)
+
+def worker_main(args, options, started_at):
+    # Papel worker: sem listagem de perfis, só consome a fila até ela esvaziar
+    from source import metrics
+    from source.jobs import JobQueue, run_worker
+    from source.media import MediaDownloader, open_manifest
+    from source.scraper import PrivacyScraper
+
+    output = contextlib.redirect_stdout(sys.stderr) if not args.summary else contextlib.nullcontext()
+    scraper = PrivacyScraper()
+    try:
+        with output:
+            if not scraper.login():
+                print("Falha no login.")
+                write_summary(build_summary("error", options, started_at, error="falha no login"), args.summary)
+                return EXIT_ERROR
+
+            manifest = open_manifest()
+            job_queue = JobQueue()
+            exporter = metrics.start_exporter()
+            try:
+                result = run_worker(scraper, MediaDownloader(scraper.scraper), manifest, job_queue)
+            finally:
+                job_queue.close()
+                manifest.close()
+                metrics_summary = metrics.finish(exporter)
+                if metrics_summary:
+                    print(metrics_summary)
+    finally:
+        scraper.close()
+
+    summary = build_summary("partial" if result["failed"] else "ok", options, started_at)
+    summary.update(result)
+    if metrics.ENABLED:
+        summary["metrics"] = metrics.snapshot()
+    write_summary(summary, args.summary)
+    return EXIT_FAILURES if result["failed"] else EXIT_OK
+
+def verify_main(args, options, started_at):
+    # Verificação e reparo trabalham só no disco e no manifesto, sem login
+    from source.verify import verify_library
+
+    profiles = options["profiles"]
+    if profiles and any(p.lower() in ("all", "todos") for p in profiles):
+        profiles = None
+    repair = bool(options.get("repair"))
+    with contextlib.redirect_stdout(sys.stderr) if not args.summary else contextlib.nullcontext():
+        report = verify_library(profiles, repair=repair)
+
+    broken = sum(len(r["broken"]) for r in report["profiles"])
+    orphans = sum(len(r["orphans"]) for r in report["profiles"])
+    unchecked = sum(len(r["unchecked"]) for r in report["profiles"])
+    # Depois do reparo só resta baixar de novo os truncados; os inválidos, que o reparo
+    # não apaga, continuam sendo falha. Formato desconhecido não conta como problema.
+    remaining = broken - sum(r["requeued"] for r in report["profiles"]) if repair else broken
+    failed = bool(remaining or (orphans and not repair))
+    summary = {
+        "status": "partial" if failed else "ok",
+        "mode": "repair" if repair else "verify",
+        "output": os.getenv("DOWNLOAD_DIR", "downloads"),
+        "elapsed_s": round(time.time() - started_at, 3),
+        "checked": report["checked"],
+        "cached": report["cached"],
+        "broken": broken,
+        "unchecked": unchecked,
+        "orphans": orphans,
+        "profiles": report["profiles"],
+    }
+    if repair:
+        summary["requeued"] = sum(r["requeued"] for r in report["profiles"])
+    write_summary(summary, args.summary)
+    return EXIT_FAILURES if failed else EXIT_OK
+
+def main(argv=None):
+    args = parse_args(argv)
+    started_at = time.time()
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    try:
+        options = resolve_options(args)
+    except (OSError, ValueError) as e:
+        print(f"Configuração inválida: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    apply_environment(options)
+    if options.get("verify") or options.get("repair"):
+        return verify_main(args, options, started_at)
+    role = options["role"]
+    if role == "worker":
+        return worker_main(args, options, started_at)
+    batch = bool(options["profiles"])
+
+    from source import metrics
+    from source.media import SYNC_MODE, MediaDownloader, open_manifest
+    from source.scraper import PrivacyScraper
+
+    if options["engine"] == "async" and importlib.util.find_spec("aiohttp") is None:
+        print("Pacote 'aiohttp' não instalado, usando o motor sync.", file=sys.stderr)
+        options["engine"] = "sync"
+
+    if batch:
+        options["media_type"] = options.get("media_type") or "3"
+        options["mode"] = options.get("mode") or SYNC_MODE
+
+    # No modo batch a saída padrão fica reservada para o resumo JSON
+    output = contextlib.redirect_stdout(sys.stderr) if batch and not args.summary else contextlib.nullcontext()
+    scraper = PrivacyScraper()
+    results, missing = [], []
+    try:
+        with output:
+            if not scraper.login():
+                print("Falha no login.")
+                if batch:
+                    write_summary(build_summary("error", options, started_at, error="falha no login"), args.summary)
+                return EXIT_ERROR
+
+            media_downloader = MediaDownloader(scraper.scraper)
+            profiles = sorted(scraper.get_profiles(), key=lambda p: p.lower())
+            if not profiles:
+                print("Nenhum perfil encontrado.")
+                if batch:
+                    write_summary(build_summary("error", options, started_at, missing=options["profiles"], error="nenhum perfil encontrado"), args.summary)
+                return EXIT_ERROR
+
+            if batch:
+                selected_profiles, missing = select_profiles(options["profiles"], profiles)
+                for profile in missing:
+                    print(f"[AVISO] Perfil não encontrado entre as assinaturas: {profile}")
+                media_type = options["media_type"]
+            else:
+                answers = ask_options(profiles, SYNC_MODE)
+                if not answers:
+                    return EXIT_OK
+                selected_profiles, media_type, options["mode"] = answers
+                options["media_type"] = media_type
+            incremental = options["mode"] == "incremental"
+
+            if selected_profiles:
+                manifest = open_manifest()
+                exporter = metrics.start_exporter()
+                try:
+                    if role == "coordinator":
+                        from source.jobs import JobQueue, run_coordinator
+
+                        job_queue = JobQueue()
+                        try:
+                            results = run_coordinator(scraper, selected_profiles, media_type, manifest, job_queue, incremental=incremental, workers=options.get("spawn_workers") or 0)
+                        finally:
+                            job_queue.close()
+                    elif options["engine"] == "async":
+                        from source import async_engine
+
+                        results = async_engine.run_profiles(scraper, media_downloader, selected_profiles, media_type, manifest, incremental=incremental)
+                    else:
+                        from source.scheduler import process_profiles
+
+                        results = process_profiles(scraper, media_downloader, selected_profiles, media_type, manifest, incremental=incremental)
+                finally:
+                    manifest.close()
+                    metrics_summary = metrics.finish(exporter)
+                    if metrics_summary:
+                        print(metrics_summary)
+    finally:
+        scraper.close()
+
+    if not batch:
+        return EXIT_OK
+
+    failed = missing or any(r.get("error") or r.get("failed") for r in results)
+    summary = build_summary("partial" if failed else "ok", options, started_at, results, missing)
+    if metrics.ENABLED:
+        summary["metrics"] = metrics.snapshot()
+    write_summary(summary, args.summary)
+    return EXIT_FAILURES if failed else EXIT_OK
 
 if __name__ == "__main__":
-    main()
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -20,6 +20,8 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
+# onedir (exclude_binaries + COLLECT): o executável não extrai nada para uma pasta temporária
+# a cada execução, e sem UPX as DLLs não precisam ser descompactadas ao carregar
 exe = EXE(
     pyz,
     a.scripts,
@@ -29,7 +31,7 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,
     console=True,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -42,7 +44,7 @@ coll = COLLECT(
     a.binaries,
     a.datas,
     strip=False,
-    upx=True,
+    upx=False,
     upx_exclude=[],
     name='privacy_scraper',
 )
@@ -0,0 +1,687 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import time
+from http.cookies import SimpleCookie
+from tqdm import tqdm
+from source import hls, metrics, network
+from source.dedup import get_content_store, remote_key
+from source.download import MAX_CHUNK_SIZE, PREALLOC_SUFFIX, bandwidth_limiter, finalize, parse_content_range, part_offset
+from source.images import TOO_LARGE_STATUS, image_variants
+from source.log import log_debug
+from source.media import (
+    DOWNLOAD_DIR, HIGH_WATER_MARK_FORMAT, PAGE_PREFETCH, PAGE_SIZE, SEGMENT_RETRIES, STREAM_REMUX, SYNC_MODE,
+    DownloadProgress, apply_refreshed_counts, best_variant_url, content_headers, download_and_process_video,
+    format_post_date, key_headers, media_filename, media_type_total, page_is_older_than, parse_post_date, record_result, skip_known_media, store_output,
+)
+from source.network import RETRY_ATTEMPTS, RETRY_MAX_DELAY, RETRY_STATUS, THROTTLE_STATUS
+from source.scheduler import PROFILE_WORKERS
+from source.scraper import VIDEO_TOKEN_URL, custom_headers, image_headers, media_count_url, parse_media_counts, posts_url
+from source.stream import STREAM_WINDOW, can_stream, decrypt_segment, remux_output
+from source.tokens import TOKEN_EXPIRED_STATUS, VIDEO_TOKEN_EXP, VIDEO_TOKEN_MARGIN, load_tokens, save_tokens, video_file_id
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+
+# Motor alternativo com asyncio: um event loop, um pool de conexões aiohttp e semáforos
+# por host e por tipo de mídia no lugar das threads. Login, manifesto, store e a conversão
+# com pasta temporária continuam síncronos e rodam em threads quando bloqueiam.
+
+ASYNC_CONNECTIONS = int(os.getenv("ASYNC_CONNECTIONS", "100"))
+ASYNC_IMAGE_CONCURRENCY = int(os.getenv("ASYNC_IMAGE_CONCURRENCY", "32"))
+ASYNC_VIDEO_CONCURRENCY = int(os.getenv("ASYNC_VIDEO_CONCURRENCY", "4"))
+ASYNC_SEGMENT_CONCURRENCY = int(os.getenv("ASYNC_SEGMENT_CONCURRENCY", "16"))
+ASYNC_READ_TIMEOUT = float(os.getenv("ASYNC_READ_TIMEOUT", "60"))
+
+if aiohttp:
+    ASYNC_TRANSIENT_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+def part_digest(part_filename):
+    # Hash do que já está no .part, para a retomada continuar com os bytes novos
+    digest = hashlib.sha256()
+    with open(part_filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest
+
+def retry_delay(attempt, response=None):
+    if response is not None and response.status in THROTTLE_STATUS:
+        retry_after = network.parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, RETRY_MAX_DELAY)
+    return network.retry_delay(attempt)
+
+def expected_length(response, offset):
+    if response.status == 206:
+        return parse_content_range(response.headers.get("Content-Range"))[1]
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    return offset + response.content_length if response.content_length is not None else None
+
+class AsyncTokenHolder:
+    def __init__(self, content, refresh=None):
+        self.content = content
+        self.refresh_fn = refresh
+        self.lock = asyncio.Lock()
+
+    async def refresh(self, stale_content):
+        async with self.lock:
+            if self.content == stale_content and self.refresh_fn:
+                content = await self.refresh_fn()
+                if content:
+                    self.content = content
+        return self.content
+
+class AsyncTokenCache:
+    # Mesmo arquivo de cache do VideoTokenCache; pedidos do mesmo file_id aguardam a mesma task
+    def __init__(self, engine, exp=None):
+        self.engine = engine
+        self.exp = exp or VIDEO_TOKEN_EXP
+        self.tokens = load_tokens()
+        self.pending = {}
+
+    def _cached(self, file_id):
+        entry = self.tokens.get(file_id)
+        if entry and entry[1] - VIDEO_TOKEN_MARGIN > time.time():
+            return entry[0]
+        return None
+
+    async def _fetch(self, file_id):
+        requested_at = time.time()
+        try:
+            with metrics.timer("token"):
+                content = await self.engine.get_video_token(file_id, self.exp)
+        finally:
+            self.pending.pop(file_id, None)
+        if content:
+            self.tokens[file_id] = (content, requested_at + self.exp)
+        return content
+
+    def _task_for(self, file_id):
+        task = self.pending.get(file_id)
+        if task is None:
+            task = self.pending[file_id] = asyncio.ensure_future(self._fetch(file_id))
+        return task
+
+    async def get(self, file_id):
+        return self._cached(file_id) or await self._task_for(file_id)
+
+    def prefetch(self, file_ids):
+        for file_id in file_ids:
+            if not self._cached(file_id):
+                self._task_for(file_id)
+
+    async def refresh(self, file_id):
+        metrics.inc("token_refreshes")
+        self.invalidate(file_id)
+        return await self.get(file_id)
+
+    def invalidate(self, file_id):
+        self.tokens.pop(file_id, None)
+
+    async def close(self):
+        if self.pending:
+            await asyncio.gather(*self.pending.values(), return_exceptions=True)
+        save_tokens(self.tokens)
+
+class AsyncEngine:
+    # As mesmas operações do PrivacyScraper/MediaDownloader (listar posts, token, playlist,
+    # segmentos, imagens), em corrotinas. Usa a sessão (cookies, user agent e tokens) do
+    # PrivacyScraper já logado.
+    def __init__(self, scraper, media_downloader):
+        self.scraper = scraper
+        self.media_downloader = media_downloader
+        self.session = None
+        self.host_conditions = {}
+        self.limits = {
+            "image": asyncio.Semaphore(ASYNC_IMAGE_CONCURRENCY),
+            "video": asyncio.Semaphore(ASYNC_VIDEO_CONCURRENCY),
+            "segment": asyncio.Semaphore(ASYNC_SEGMENT_CONCURRENCY),
+        }
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=ASYNC_CONNECTIONS)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=ASYNC_READ_TIMEOUT)
+        user_agent = self.scraper.scraper.headers.get("User-Agent")
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=timeout, cookie_jar=aiohttp.CookieJar(unsafe=True),
+            headers={"User-Agent": user_agent} if user_agent else None,
+        )
+        self.load_cookies()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def load_cookies(self):
+        # Copia os cookies da sessão síncrona mantendo o domínio de cada um
+        for cookie in self.scraper.scraper.cookies:
+            domain = (cookie.domain or "").lstrip(".")
+            if not domain:
+                continue
+            morsel = SimpleCookie()
+            morsel[cookie.name] = cookie.value
+            morsel[cookie.name]["domain"] = cookie.domain
+            morsel[cookie.name]["path"] = cookie.path or "/"
+            self.session.cookie_jar.update_cookies(morsel, URL(f"https://{domain}/"))
+
+    @contextlib.asynccontextmanager
+    async def host_slot(self, url):
+        # O mesmo AdaptiveLimiter (AIMD por host) do motor sync; a espera por vaga fica no
+        # loop, numa Condition por host, em vez de bloquear uma thread
+        limiter = network.limiter_for(url)
+        condition = self.host_conditions.get(limiter)
+        if condition is None:
+            condition = self.host_conditions[limiter] = asyncio.Condition()
+        async with condition:
+            await condition.wait_for(limiter.try_acquire)
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+            async with condition:
+                condition.notify()
+
+    async def request(self, method, url, headers=None, json_body=None):
+        # Mesmas regras do network.send: retentativa em erros de conexão e status transitórios
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                async with self.host_slot(url) as limiter:
+                    async with self.session.request(method, url, headers=headers, json=json_body) as response:
+                        if response.status in THROTTLE_STATUS:
+                            metrics.inc("throttled")
+                            limiter.on_throttle()
+                        elif response.status < 500:
+                            limiter.on_success()
+                        if response.status not in RETRY_STATUS or attempt == RETRY_ATTEMPTS:
+                            body = await response.read()
+                            return response.status, body
+                        delay = retry_delay(attempt, response)
+            except ASYNC_TRANSIENT_ERRORS as e:
+                network.limiter_for(url).on_throttle()
+                if attempt == RETRY_ATTEMPTS:
+                    raise
+                delay = retry_delay(attempt)
+                log_debug("[REDE] %s em %s, tentativa %d/%d", e.__class__.__name__, url, attempt, RETRY_ATTEMPTS)
+            metrics.inc("retries")
+            await asyncio.sleep(delay)
+
+    async def api_request(self, method, url, extra_headers=None, json_body=None):
+        token = self.scraper.token_v2
+        headers = {"Authorization": f"Bearer {token}", "Referer": "https://privacy.com.br/", **(extra_headers or {})}
+        log_debug("%s para: %s", method, url)
+        status, body = await self.request(method, url, headers, json_body)
+        if status in (401, 403) and await asyncio.to_thread(self.scraper.refresh_login, token):
+            self.load_cookies()
+            headers["Authorization"] = f"Bearer {self.scraper.token_v2}"
+            status, body = await self.request(method, url, headers, json_body)
+        return body.decode("utf-8", errors="replace")
+
+    async def get_total_media_count(self, profile_name):
+        with metrics.timer("media_count"):
+            html = await self.api_request("GET", media_count_url(profile_name), custom_headers)
+        counts = parse_media_counts(html, profile_name)
+        await asyncio.to_thread(self.scraper.media_counts.put, profile_name, counts)
+        return counts
+
+    async def get_posts(self, profile_name, skip=0):
+        log_debug("Buscando posts para %s, skip=%d", profile_name, skip)
+        return json.loads(await self.api_request("GET", posts_url(profile_name, skip)))
+
+    async def get_video_token(self, file_id, exp=3600):
+        log_debug("Solicitando token de vídeo para %s", file_id)
+        response = await self.api_request("POST", VIDEO_TOKEN_URL, custom_headers, {'exp': exp, 'file_id': file_id})
+        try:
+            return json.loads(response).get("content")
+        except Exception as e:
+            log_debug(f"[ERRO] Resposta inválida ao solicitar token de vídeo ({file_id}): {e}")
+            return None
+
+    async def fetch_bytes(self, url, headers):
+        try:
+            status, body = await self.request("GET", url, headers)
+        except ASYNC_TRANSIENT_ERRORS as e:
+            log_debug(f"[ERRO] Falha ao baixar {url}: {e}")
+            return None, None
+        if status != 200 and not (status == 206 and "Range" in headers):
+            log_debug(f"[ERRO] Falha ao baixar {url}: Status {status}")
+            return None, status
+        wait = bandwidth_limiter.reserve(len(body))
+        if wait:
+            await asyncio.sleep(wait)
+        metrics.inc("bytes", len(body))
+        return body, status
+
+    async def fetch_text(self, url, token_content):
+        data, _ = await self.fetch_bytes(url, content_headers(url, token_content))
+        return data.decode('utf-8', errors='replace') if data is not None else None
+
+    async def fetch_key(self, url, token_content):
+        # Usa o mesmo cache de chaves por URI do fluxo síncrono
+        data = hls.key_cache.get(url)
+        if data is not None:
+            metrics.inc("key_cache_hits")
+            return data
+        with metrics.timer("key"):
+            data, _ = await self.fetch_bytes(url, key_headers(url, token_content))
+        if data:
+            hls.key_cache.put(url, data)
+        return data
+
+    async def fetch_playlist(self, url, token_content):
+        content = await self.fetch_text(url, token_content)
+        return hls.parse_media(url, content) if content is not None else None
+
+    async def load_video_playlist(self, file, token_content):
+        with metrics.timer("master_playlist"):
+            content = await self.fetch_text(file["url"], token_content)
+        if content is None:
+            return None
+        if not hls.is_master(content):
+            return hls.parse_media(file["url"], content)
+        best_quality_url = best_variant_url(file["url"], content)
+        return await self.fetch_playlist(best_quality_url, token_content) if best_quality_url else None
+
+    async def fetch_segment(self, url, token, byterange=None):
+        with metrics.timer("segment"):
+            for attempt in range(1, SEGMENT_RETRIES + 1):
+                token_content = token.content
+                headers = content_headers(url, token_content)
+                if byterange:
+                    length, offset = byterange
+                    headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+                async with self.limits["segment"]:
+                    data, status_code = await self.fetch_bytes(url, headers)
+                if byterange and status_code == 200 and data is not None:
+                    data = data[offset:offset + length]
+                if data is not None:
+                    return data
+                # As falhas transitórias já foram retentadas no request; só o token expirado repete
+                if status_code not in TOKEN_EXPIRED_STATUS or attempt == SEGMENT_RETRIES:
+                    return None
+                await token.refresh(token_content)
+        return None
+
+    async def download_to_file(self, url, filename, headers=None, store=None, resume=True):
+        # Equivalente ao download_to_file síncrono: .part, retomada com Range, conferência
+        # do tamanho e ContentStore. Retorna (sucesso, status HTTP).
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        part_filename = f"{filename}.part"
+        if not resume:
+            for leftover in (part_filename, f"{part_filename}{PREALLOC_SUFFIX}"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                success, status_code, retryable, retry_after = await self.download_once(url, filename, part_filename, headers, store)
+            except ASYNC_TRANSIENT_ERRORS as e:
+                log_debug(f"[REDE] Conexão interrompida baixando {url}: {e}")
+                success, status_code, retryable, retry_after = False, None, True, None
+            if success or not retryable or attempt == RETRY_ATTEMPTS:
+                return success, status_code
+            metrics.inc("retries" if status_code in RETRY_STATUS else "resumes")
+            # Retry-After de um 429/503 vale como no network.send
+            delay = min(retry_after, RETRY_MAX_DELAY) if retry_after is not None else retry_delay(attempt)
+            await asyncio.sleep(delay)
+        return False, None
+
+    async def download_once(self, url, filename, part_filename, headers, store=None):
+        offset = part_offset(part_filename)
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+
+        async with self.host_slot(url) as limiter:
+            async with self.session.get(url, headers=request_headers) as response:
+                if response.status in RETRY_STATUS:
+                    retry_after = None
+                    if response.status in THROTTLE_STATUS:
+                        metrics.inc("throttled")
+                        limiter.on_throttle()
+                        retry_after = network.parse_retry_after(response.headers.get("Retry-After"))
+                    return False, response.status, True, retry_after
+                if response.status < 500:
+                    limiter.on_success()
+                if response.status == 416 and offset:
+                    _, total = parse_content_range(response.headers.get("Content-Range"))
+                    if total == offset:
+                        # Sem digest, o store calcula o hash do arquivo inteiro: fica fora do loop
+                        await asyncio.to_thread(finalize, part_filename, filename, store)
+                        return True, 200, False, None
+                    os.remove(part_filename)
+                    return False, response.status, True, None
+                if response.status == 206 and offset:
+                    start, _ = parse_content_range(response.headers.get("Content-Range"))
+                    if start != offset:
+                        os.remove(part_filename)
+                        return False, response.status, True, None
+                    mode = 'ab'
+                elif response.status == 200:
+                    offset = 0
+                    mode = 'wb'
+                else:
+                    return False, response.status, False, None
+
+                expected = expected_length(response, offset)
+                key = remote_key(response, expected) if store else None
+                if mode == 'wb' and store:
+                    known = await asyncio.to_thread(store.lookup_remote, key)
+                    if known:
+                        await asyncio.to_thread(store.link, known, filename)
+                        metrics.inc("dedup_skipped")
+                        return True, 200, False, None
+
+                digest = None
+                if store:
+                    digest = await asyncio.to_thread(part_digest, part_filename) if mode == 'ab' else hashlib.sha256()
+
+                written = 0
+                try:
+                    with open(part_filename, mode) as f:
+                        async for chunk in response.content.iter_chunked(MAX_CHUNK_SIZE):
+                            f.write(chunk)
+                            written += len(chunk)
+                            if digest is not None:
+                                digest.update(chunk)
+                            wait = bandwidth_limiter.reserve(len(chunk))
+                            if wait:
+                                await asyncio.sleep(wait)
+                finally:
+                    metrics.inc("bytes", written)
+
+        size = offset + written
+        if expected is not None and size != expected:
+            log_debug(f"[ERRO] Download incompleto de {url}: {size}/{expected} bytes, mantendo {part_filename}")
+            return False, response.status, True, None
+
+        await asyncio.to_thread(finalize, part_filename, filename, store, digest.hexdigest() if digest is not None else None, key)
+        return True, 200, False, None
+
+    async def download_image(self, url, filename):
+        for index, (height, final_url) in enumerate(image_variants(url)):
+            # Como no motor sync: ao trocar de variante o .part da anterior é descartado
+            success, status_code = await self.download_to_file(final_url, filename, image_headers, get_content_store(), resume=index == 0)
+            if success:
+                return True
+            if status_code != TOO_LARGE_STATUS:
+                log_debug(f"[SAFE] Erro {status_code} ao baixar: {final_url}")
+                return False
+            metrics.inc("image_downsized")
+        return False
+
+    async def stream_hls_to_mp4(self, playlist, output_filename, token):
+        reason = can_stream(playlist)
+        if reason:
+            log_debug(f"[STREAM] Playlist não suportada no modo streaming ({reason}): {playlist.url}")
+            return False
+
+        keys = {}
+        for key in playlist.keys:
+            key_bytes = await self.fetch_key(key.uri, token.content)
+            if not key_bytes:
+                return False
+            keys[key.uri] = key_bytes
+        segments = playlist.segments
+
+        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+        part_file = f"{output_filename}.part"
+        process = await asyncio.create_subprocess_exec(*remux_output(part_file).compile(), stdin=asyncio.subprocess.PIPE)
+
+        # Segmentos em paralelo dentro da janela, escritos no stdin do ffmpeg em ordem
+        tasks = {}
+        success = False
+        try:
+            for index, segment in enumerate(segments):
+                for ahead in range(index, min(index + STREAM_WINDOW, len(segments))):
+                    if ahead not in tasks:
+                        tasks[ahead] = asyncio.ensure_future(self.fetch_segment(segments[ahead].url, token, segments[ahead].byterange))
+                data = await tasks.pop(index)
+                if data is None:
+                    log_debug(f"[STREAM] Falha ao baixar segmento: {segment.url}")
+                    break
+                if segment.key:
+                    data = decrypt_segment(data, keys[segment.key.uri], segment.key.iv_for(segment.sequence))
+                process.stdin.write(data)
+                await process.stdin.drain()
+            else:
+                success = True
+        except (BrokenPipeError, ConnectionResetError) as e:
+            log_debug(f"[STREAM] ffmpeg encerrou durante o streaming de {playlist.url}: {e}")
+        except ValueError as e:
+            log_debug(f"[STREAM] Segmento inválido em {playlist.url}: {e}")
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        try:
+            process.stdin.close()
+        except Exception:
+            pass
+        if not success:
+            process.kill()
+        returncode = await process.wait()
+        if success and returncode == 0:
+            os.replace(part_file, output_filename)
+            return True
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        return False
+
+    async def download_video(self, profile_name, file, output_filename, token_cache):
+        file_id = video_file_id(file["url"])
+        token_content = await token_cache.get(file_id)
+        if not token_content:
+            log_debug(f"[ERRO] Falha ao extrair token de vídeo ({file['mediaId']})")
+            return False
+
+        if ".mp4" in file["url"].lower():
+            headers = {"referer": "https://privacy.com.br/", "Content": token_content}
+            with metrics.timer("video_mp4"):
+                success, _ = await self.download_to_file(file["url"], output_filename, headers, get_content_store())
+            return success
+
+        playlist = await self.load_video_playlist(file, token_content)
+        if playlist is None:
+            return False
+
+        token = AsyncTokenHolder(token_content, lambda: token_cache.refresh(file_id))
+        if STREAM_REMUX:
+            with metrics.timer("stream_remux"):
+                if await self.stream_hls_to_mp4(playlist, output_filename, token):
+                    return True
+
+        # Fallback: o fluxo síncrono com pasta temporária, numa thread
+        loop = asyncio.get_running_loop()
+
+        def refresh_token():
+            return asyncio.run_coroutine_threadsafe(token_cache.refresh(file_id), loop).result()
+
+        return await asyncio.to_thread(
+            download_and_process_video, self.scraper, self.media_downloader, profile_name, file, token.content,
+            output_filename=output_filename, refresh_token=refresh_token, stream=False, playlist=playlist
+        )
+
+async def image_task(engine, manifest, profile_name, media_id, file_url, filename, progress):
+    downloaded = False
+    try:
+        # A vaga é pega e devolvida dentro da task: cancelada antes de começar, ela não
+        # leva a vaga junto
+        async with engine.limits["image"]:
+            with metrics.timer("image"):
+                await engine.download_image(file_url, filename)
+        downloaded = os.path.exists(filename)
+    except Exception as e:
+        log_debug(f"[ERRO] Falha ao baixar imagem {filename}: {e}")
+    finally:
+        await asyncio.to_thread(record_result, manifest, media_id, profile_name, "image", filename, downloaded)
+        progress.advance(downloaded, failed=not downloaded)
+
+async def video_task(engine, manifest, token_cache, profile_name, file, output_filename, progress):
+    downloaded = False
+    try:
+        async with engine.limits["video"]:
+            success = await engine.download_video(profile_name, file, output_filename, token_cache)
+            downloaded = bool(success) and os.path.exists(output_filename)
+            if downloaded:
+                try:
+                    await asyncio.to_thread(store_output, output_filename)
+                except Exception as e:
+                    log_debug(f"[DEDUP] Falha ao registrar {output_filename} no store: {e}")
+    except Exception as e:
+        log_debug(f"[ERRO] Falha ao baixar vídeo {file['mediaId']}: {e}")
+    finally:
+        if not downloaded:
+            token_cache.invalidate(video_file_id(file["url"]))
+        await asyncio.to_thread(record_result, manifest, file["mediaId"], profile_name, "video", output_filename, downloaded)
+        progress.advance(downloaded, failed=not downloaded)
+
+async def fetch_pages(engine, profile_name, high_water_mark, pages):
+    # Produtor das páginas de posts, à frente dos downloads como o PageFetcher
+    skip = 0
+    try:
+        while True:
+            with metrics.timer("listing"):
+                posts = await engine.get_posts(profile_name, skip)
+            items = posts.get("mosaicItems")
+            if not items or (high_water_mark and page_is_older_than(items, high_water_mark)):
+                break
+            await pages.put(items)
+            skip += PAGE_SIZE
+            if len(items) < PAGE_SIZE:
+                break
+    except Exception as e:
+        log_debug(f"[ERRO] Falha ao listar posts de {profile_name} (skip={skip}): {e}")
+        await pages.put(e)
+    finally:
+        await pages.put(None)
+
+async def process_posts_async(engine, profile_name, media_type, manifest, token_cache, incremental=None, position=None):
+    # Mesma regra do process_posts: contagens do cache liberam a listagem e são relidas em paralelo
+    counts = engine.scraper.cached_media_count(profile_name)
+    refresh = None
+    if counts is None:
+        counts = await engine.get_total_media_count(profile_name)
+    else:
+        refresh = asyncio.ensure_future(engine.get_total_media_count(profile_name))
+    total, total_photos, total_videos = counts
+    origin = " (cache, atualizando)" if refresh else ""
+    tqdm.write(f"[{profile_name}] Total de mídias: {total} (Fotos: {total_photos}, Vídeos: {total_videos}){origin}")
+    os.makedirs(f"{DOWNLOAD_DIR}/{profile_name}/fotos", exist_ok=True)
+    os.makedirs(f"{DOWNLOAD_DIR}/{profile_name}/videos", exist_ok=True)
+    progress_total = media_type_total(media_type, counts)
+
+    if incremental is None:
+        incremental = SYNC_MODE == "incremental"
+    high_water_mark = await asyncio.to_thread(manifest.get_high_water_mark, profile_name, media_type) if incremental else None
+    if high_water_mark:
+        tqdm.write(f"[{profile_name}] [INCREMENTAL] Buscando apenas posts posteriores a {high_water_mark}")
+    newest_post_date = None
+
+    pages = asyncio.Queue(maxsize=PAGE_PREFETCH)
+    producer = asyncio.ensure_future(fetch_pages(engine, profile_name, high_water_mark, pages))
+    # Tasks em andamento por tipo. A listagem só cria uma task nova quando há menos que o
+    # limite de concorrência daquele tipo, para não correr à frente dos downloads.
+    pending = {"image": set(), "video": set()}
+    bounds = {"image": ASYNC_IMAGE_CONCURRENCY, "video": ASYNC_VIDEO_CONCURRENCY}
+
+    async def wait_for_room(kind):
+        while len(pending[kind]) >= bounds[kind]:
+            await asyncio.wait(pending[kind], return_when=asyncio.FIRST_COMPLETED)
+
+    with tqdm(total=progress_total, desc=f"Baixando mídias de {profile_name}", unit="mídia", position=position) as pbar:
+        progress = DownloadProgress(pbar)
+        if refresh:
+            refresh.add_done_callback(lambda task: apply_refreshed_counts(pbar, media_type, task))
+        try:
+            while True:
+                items = await pages.get()
+                if items is None:
+                    break
+                if isinstance(items, Exception):
+                    raise items
+                for item in items:
+                    post_date = parse_post_date(item.get("postDate"))
+                    formatted_date = format_post_date(post_date)
+                    if post_date and (newest_post_date is None or post_date > newest_post_date):
+                        newest_post_date = post_date
+
+                    for file in item.get("files", []):
+                        if file["isLocked"]:
+                            continue
+                        file_type = file["type"]
+                        media_id = file["mediaId"]
+
+                        if file_type == "image" and media_type in ["1", "3"]:
+                            filename = media_filename(profile_name, file_type, formatted_date, media_id)
+                            if await asyncio.to_thread(skip_known_media, manifest, progress, media_id, profile_name, file_type, filename):
+                                continue
+                            await wait_for_room(file_type)
+                            task = asyncio.ensure_future(image_task(engine, manifest, profile_name, media_id, file["url"], filename, progress))
+                        elif file_type == "video" and media_type in ["2", "3"]:
+                            output_filename = media_filename(profile_name, file_type, formatted_date, media_id)
+                            if await asyncio.to_thread(skip_known_media, manifest, progress, media_id, profile_name, file_type, output_filename):
+                                continue
+                            token_cache.prefetch([video_file_id(file["url"])])
+                            await wait_for_room(file_type)
+                            task = asyncio.ensure_future(video_task(engine, manifest, token_cache, profile_name, file, output_filename, progress))
+                        else:
+                            continue
+                        pending[file_type].add(task)
+                        task.add_done_callback(pending[file_type].discard)
+        finally:
+            producer.cancel()
+            tasks = pending["image"] | pending["video"]
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if refresh:
+                await asyncio.gather(refresh, return_exceptions=True)
+                apply_refreshed_counts(pbar, media_type, refresh)
+        progress_total = pbar.total
+
+    if newest_post_date and progress.failed_count == 0:
+        mark = newest_post_date.strftime(HIGH_WATER_MARK_FORMAT)
+        if not high_water_mark or mark > high_water_mark:
+            await asyncio.to_thread(manifest.set_high_water_mark, profile_name, media_type, mark)
+
+    tqdm.write(f"[RESUMO] {profile_name}: {progress.downloaded_count}/{progress_total} arquivos novos baixados, {progress.failed_count} falhas")
+    return {
+        "profile": profile_name,
+        "total": progress_total,
+        "downloaded": progress.downloaded_count,
+        "failed": progress.failed_count,
+    }
+
+async def process_profiles_async(scraper, media_downloader, profiles, media_type, manifest, incremental=None, profile_workers=None):
+    workers = max(1, min(profile_workers or PROFILE_WORKERS, len(profiles)))
+    positions = asyncio.Queue()
+    for position in range(workers):
+        positions.put_nowait(position)
+
+    async with AsyncEngine(scraper, media_downloader) as engine:
+        token_cache = AsyncTokenCache(engine)
+
+        async def run_profile(profile):
+            position = await positions.get()
+            try:
+                return await process_posts_async(engine, profile, media_type, manifest, token_cache, incremental, position)
+            except Exception as e:
+                log_debug(f"[ERRO] Falha ao processar perfil {profile}: {e}")
+                tqdm.write(f"[ERRO] Falha ao processar perfil {profile}: {e}")
+                return {"profile": profile, "error": str(e)}
+            finally:
+                positions.put_nowait(position)
+
+        try:
+            return list(await asyncio.gather(*(run_profile(profile) for profile in profiles)))
+        finally:
+            await token_cache.close()
+
+def run_profiles(scraper, media_downloader, profiles, media_type, manifest, incremental=None, profile_workers=None):
+    if aiohttp is None:
+        raise RuntimeError("O motor async precisa do pacote 'aiohttp' (pip install aiohttp)")
+    return asyncio.run(process_profiles_async(scraper, media_downloader, profiles, media_type, manifest, incremental, profile_workers))
@@ -0,0 +1,42 @@
+import json
+import os
+import time
+from source.log import log_debug
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+def cache_path(name):
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+def load_cache(name, ttl=None):
+    path = cache_path(name)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_debug(f"[AVISO] Cache inválido em {path}: {e}")
+        return None
+
+    if ttl is not None and time.time() - entry.get("saved_at", 0) > ttl:
+        log_debug(f"Cache expirado: {path}")
+        return None
+    return entry.get("data")
+
+def save_cache(name, data, private=False):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(name)
+    # Nome temporário por processo: workers na mesma pasta podem salvar o mesmo cache juntos
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # Caches com credenciais ficam legíveis apenas pelo usuário atual
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    with os.fdopen(os.open(tmp_path, flags, 0o600 if private else 0o644), 'w', encoding='utf-8') as f:
+        json.dump({"saved_at": time.time(), "data": data}, f)
+    os.replace(tmp_path, path)
+
+def clear_cache(name):
+    try:
+        os.remove(cache_path(name))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,138 @@
+import errno
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from source.log import log_debug
+from source.manifest import JOURNAL_MODE, file_checksum
+
+DEDUP = os.getenv("DEDUP", "True").lower() == "true"
+STORE_DIR = os.getenv("STORE_DIR", os.path.join(os.getenv("DOWNLOAD_DIR", "downloads"), ".store"))
+LINK_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EMLINK)
+
+def remote_key(response, total=None):
+    # Só ETags fortes identificam o conteúdo; o tamanho total evita colisões entre variantes
+    etag = response.headers.get("ETag")
+    if not etag or etag.startswith("W/"):
+        return None
+    return f"{etag}:{total}" if total is not None else etag
+
+class ContentStore:
+    # Cada conteúdo é guardado uma vez em objects/<sha256> e os nomes por perfil/data
+    # viram hardlinks para ele (ou cópias, se o sistema de arquivos não suportar).
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS remotes (remote_key TEXT PRIMARY KEY, sha256 TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, sha256 TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def lookup_remote(self, key):
+        if not key:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT sha256 FROM remotes WHERE remote_key = ?", (key,)).fetchone()
+        if row and os.path.exists(self.object_path(row[0])):
+            return row[0]
+        return None
+
+    def checksum_for(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT sha256 FROM files WHERE path = ?", (os.path.normpath(path),)).fetchone()
+        return row[0] if row else None
+
+    def linked_checksum(self, path):
+        # O digest do índice só vale se o arquivo no caminho ainda é o objeto do store; um
+        # arquivo regravado depois (saída nova do ffmpeg, por exemplo) tem outro inode
+        digest = self.checksum_for(path)
+        if not digest:
+            return None
+        try:
+            current = os.stat(path)
+            stored = os.stat(self.object_path(digest))
+        except OSError:
+            return None
+        if os.path.samestat(current, stored):
+            return digest
+        # Sem hardlink o nome é uma cópia (copy2 preserva o mtime)
+        if current.st_size == stored.st_size and current.st_mtime_ns == stored.st_mtime_ns:
+            return digest
+        return None
+
+    def link(self, digest, filename):
+        source = self.object_path(digest)
+        tmp_filename = f"{filename}.link"
+        # Um .link que sobrou de uma execução interrompida faria o os.link falhar
+        if os.path.lexists(tmp_filename):
+            os.remove(tmp_filename)
+        try:
+            os.link(source, tmp_filename)
+        except OSError as e:
+            # Cópia só quando o hardlink não é possível (outro disco, sem permissão ou limite
+            # de links); qualquer outro erro é real e sobe
+            if e.errno not in LINK_UNSUPPORTED:
+                raise
+            shutil.copy2(source, tmp_filename)
+        os.replace(tmp_filename, filename)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (path, sha256, updated_at) VALUES (?, ?, ?)",
+                (os.path.normpath(filename), digest, time.time())
+            )
+
+    def commit(self, source_filename, filename, digest=None, key=None):
+        # Move o arquivo recém-baixado para o store (ou descarta, se já existir) e liga o nome final
+        digest = digest or file_checksum(source_filename)
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            os.remove(source_filename)
+            log_debug("[DEDUP] Conteúdo repetido, reaproveitando %s para %s", digest[:12], filename)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(source_filename, object_path)
+        self.link(digest, filename)
+        if key:
+            with self.lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO remotes (remote_key, sha256) VALUES (?, ?)", (key, digest))
+        return digest
+
+    def adopt(self, filename):
+        # Para arquivos gerados localmente (saída do ffmpeg)
+        tmp_filename = f"{filename}.adopt"
+        os.replace(filename, tmp_filename)
+        return self.commit(tmp_filename, filename)
+
+    def discard(self, filename):
+        # Conteúdo corrompido: sai do índice e do store, para que um novo download com a
+        # mesma ETag não volte a ligar o nome ao objeto ruim
+        digest = self.checksum_for(filename)
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (os.path.normpath(filename),))
+            if digest:
+                self.conn.execute("DELETE FROM remotes WHERE sha256 = ?", (digest,))
+        if digest and os.path.exists(self.object_path(digest)):
+            os.remove(self.object_path(digest))
+        return digest
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+content_store = None
+content_store_lock = threading.Lock()
+
+def get_content_store():
+    global content_store
+    if not DEDUP:
+        return None
+    with content_store_lock:
+        if content_store is None:
+            content_store = ContentStore(STORE_DIR)
+        return content_store
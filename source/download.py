@@ -0,0 +1,229 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from source import metrics, network
+from source.dedup import remote_key
+from source.log import log_debug
+from source.network import RETRY_ATTEMPTS, TRANSIENT_ERRORS, retry_delay
+
+MAX_CHUNK_SIZE = int(os.getenv("MAX_CHUNK_KB", "1024")) * 1024
+MAX_BANDWIDTH_MBPS = float(os.getenv("MAX_BANDWIDTH_MBPS", "0"))
+PREALLOCATE = os.getenv("PREALLOCATE", "False").lower() == "true"
+FSYNC_MB = int(os.getenv("FSYNC_MB", "0"))
+CHECKPOINT_BYTES = (FSYNC_MB or 16) * 1024 * 1024
+PREALLOC_SUFFIX = ".alloc"
+
+class BandwidthLimiter:
+    # Token bucket global: todos os downloads, de todos os perfis, dividem o mesmo orçamento
+    def __init__(self, mbps=0):
+        self.lock = threading.Lock()
+        self.set_rate(mbps)
+
+    def set_rate(self, mbps):
+        with self.lock:
+            self.rate = mbps * 125000
+            self.allowance = self.rate
+            self.last = time.monotonic()
+
+    def reserve(self, nbytes):
+        # Desconta os bytes e devolve quanto esperar; o motor async espera sem bloquear o loop
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= nbytes
+            return -self.allowance / self.rate if self.allowance < 0 else 0
+
+    def consume(self, nbytes):
+        wait = self.reserve(nbytes)
+        if wait:
+            time.sleep(wait)
+
+bandwidth_limiter = BandwidthLimiter(MAX_BANDWIDTH_MBPS)
+
+def parse_content_range(content_range):
+    # "bytes 100-199/200" ou "bytes */200"
+    match = re.match(r"bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)", content_range or "")
+    if not match:
+        return None, None
+    start = int(match.group(1)) if match.group(1) is not None else None
+    total = int(match.group(2)) if match.group(2) != "*" else None
+    return start, total
+
+def expected_length(response, offset):
+    if response.status_code == 206:
+        return parse_content_range(response.headers.get("Content-Range"))[1]
+    # Com compressão o Content-Length não corresponde aos bytes gravados
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    content_length = response.headers.get("Content-Length")
+    return offset + int(content_length) if content_length and content_length.isdigit() else None
+
+def download_to_file(session, url, filename, headers=None, resume=True, store=None):
+    # Grava em `.part`, retoma com Range quando possível e só renomeia para o nome
+    # final depois de conferir o tamanho. Com `store`, o conteúdo é calculado durante o
+    # download e guardado uma única vez no ContentStore. Retorna (sucesso, status HTTP).
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    part_filename = f"{filename}.part"
+    if not resume:
+        for leftover in (part_filename, f"{part_filename}{PREALLOC_SUFFIX}"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        try:
+            success, status_code, retryable = download_once(session, url, filename, part_filename, headers, store)
+        except TRANSIENT_ERRORS as e:
+            # O network.send já esgotou as retentativas da requisição
+            log_debug(f"[ERRO] Falha de conexão baixando {url}: {e}")
+            return False, None
+        if success or not retryable or attempt == RETRY_ATTEMPTS:
+            return success, status_code
+        # O .part é mantido, então a próxima tentativa continua de onde parou
+        metrics.inc("resumes")
+        time.sleep(retry_delay(attempt))
+    return False, None
+
+def write_marker(marker, written):
+    temp = f"{marker}.tmp"
+    with open(temp, "w") as f:
+        f.write(str(written))
+    os.replace(temp, marker)
+
+def part_offset(part_filename):
+    # Um .part pré-alocado já tem o tamanho final; o marcador diz quantos bytes são reais
+    if not os.path.exists(part_filename):
+        return 0
+    marker = f"{part_filename}{PREALLOC_SUFFIX}"
+    if not os.path.exists(marker):
+        return os.path.getsize(part_filename)
+    try:
+        with open(marker) as f:
+            written = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        written = 0
+    with open(part_filename, "r+b") as f:
+        f.truncate(written)
+    os.remove(marker)
+    return written
+
+def preallocate(f, size):
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, size)
+        else:
+            f.truncate(size)
+    except OSError as e:
+        log_debug("[AVISO] Pré-alocação de %d bytes falhou: %s", size, e)
+
+def write_stream(response, part_filename, mode, expected=None, digest=None):
+    # Escritor comum dos downloads: grava a resposta no .part e devolve quantos bytes
+    # foram gravados. Com PREALLOCATE o arquivo é reservado pelo Content-Length e um
+    # marcador guarda o progresso, para que um .part cortado não pareça completo.
+    marker = f"{part_filename}{PREALLOC_SUFFIX}" if PREALLOCATE and mode == 'wb' and expected else None
+    written = 0
+    checkpoint = CHECKPOINT_BYTES
+    with open(part_filename, mode) as f:
+        if marker:
+            write_marker(marker, 0)
+            preallocate(f, expected)
+        try:
+            # O urllib3 monta um bytes novo por bloco de qualquer forma; blocos grandes só
+            # diminuem o número de iterações e de escritas
+            for chunk in response.iter_content(chunk_size=MAX_CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                bandwidth_limiter.consume(len(chunk))
+                if written >= checkpoint and (FSYNC_MB or marker):
+                    f.flush()
+                    if FSYNC_MB:
+                        os.fsync(f.fileno())
+                    if marker:
+                        write_marker(marker, written)
+                    checkpoint += CHECKPOINT_BYTES
+            if FSYNC_MB:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            metrics.inc("bytes", written)
+            if marker:
+                f.flush()
+                if written == expected:
+                    os.remove(marker)
+                else:
+                    write_marker(marker, written)
+    return written
+
+def finalize(part_filename, filename, store, digest=None, key=None):
+    if store:
+        store.commit(part_filename, filename, digest, key)
+    else:
+        os.replace(part_filename, filename)
+
+def download_once(session, url, filename, part_filename, headers, store=None):
+    offset = part_offset(part_filename)
+    request_headers = dict(headers or {})
+    if offset:
+        request_headers["Range"] = f"bytes={offset}-"
+
+    with network.stream(session, url, headers=request_headers) as response:
+        if response.status_code == 416 and offset:
+            _, total = parse_content_range(response.headers.get("Content-Range"))
+            if total == offset:
+                finalize(part_filename, filename, store)
+                log_debug(f"Arquivo parcial já estava completo: {filename}")
+                return True, 200, False
+            log_debug(f"[AVISO] Range recusado para {url}, reiniciando download")
+            os.remove(part_filename)
+            return False, response.status_code, True
+
+        if response.status_code == 206 and offset:
+            start, _ = parse_content_range(response.headers.get("Content-Range"))
+            if start != offset:
+                log_debug(f"[AVISO] Content-Range inesperado para {url}, reiniciando download")
+                os.remove(part_filename)
+                return False, response.status_code, True
+            mode = 'ab'
+            log_debug("Retomando download de %s a partir do byte %d", url, offset)
+        elif response.status_code == 200:
+            offset = 0
+            mode = 'wb'
+        else:
+            return False, response.status_code, False
+
+        expected = expected_length(response, offset)
+        key = remote_key(response, expected) if store else None
+        if mode == 'wb' and store:
+            known = store.lookup_remote(key)
+            if known:
+                log_debug("[DEDUP] %s já está no store (%s), pulando transferência", url, known[:12])
+                store.link(known, filename)
+                metrics.inc("dedup_skipped")
+                return True, 200, False
+
+        digest = None
+        if store:
+            digest = hashlib.sha256()
+            if mode == 'ab':
+                with open(part_filename, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+
+        try:
+            size = offset + write_stream(response, part_filename, mode, expected, digest)
+        except TRANSIENT_ERRORS as e:
+            # Conexão caiu no meio do corpo: o .part fica e a próxima tentativa retoma com Range
+            log_debug(f"[REDE] Conexão interrompida baixando {url}: {e}")
+            return False, response.status_code, True
+        if expected is not None and size != expected:
+            log_debug(f"[ERRO] Download incompleto de {url}: {size}/{expected} bytes, mantendo {part_filename}")
+            return False, response.status_code, True
+
+        finalize(part_filename, filename, store, digest.hexdigest() if digest is not None else None, key)
+        return True, 200, False
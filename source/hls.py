@@ -0,0 +1,293 @@
+import os
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+from source import metrics
+from source.log import log_debug
+
+# Modelo em memória das playlists HLS: a master vira uma lista de variantes e a de mídia
+# uma lista de segmentos, cada um com a própria chave/IV, byte range e marca de
+# descontinuidade. A playlist é lida uma vez e o resto do código trabalha sobre o modelo.
+
+KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", "1024"))
+
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+def parse_attributes(line):
+    return {name: value.strip('"') for name, value in ATTRIBUTE_RE.findall(line.split(":", 1)[-1])}
+
+def tag_value(line):
+    return line.split(":", 1)[1].strip() if ":" in line else ""
+
+class Variant:
+    def __init__(self, url, bandwidth=0, resolution=None, codecs=None):
+        self.url = url
+        self.bandwidth = bandwidth
+        self.resolution = resolution
+        self.codecs = codecs
+
+    @property
+    def pixels(self):
+        return self.resolution[0] * self.resolution[1] if self.resolution else 0
+
+class Key:
+    def __init__(self, method, uri=None, iv=None, keyformat=None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.keyformat = keyformat
+
+    def iv_for(self, sequence):
+        # Sem IV explícito, o padrão do HLS é o número de sequência do segmento
+        return self.iv if self.iv is not None else sequence.to_bytes(16, "big")
+
+class Segment:
+    def __init__(self, url, sequence, duration, key=None, byterange=None, discontinuity=False, init=None):
+        self.url = url
+        self.sequence = sequence
+        self.duration = duration
+        self.key = key
+        # (tamanho, início) em bytes, ou None quando o segmento é o arquivo inteiro
+        self.byterange = byterange
+        self.discontinuity = discontinuity
+        # Segmento de inicialização (EXT-X-MAP) em vigor, também um Segment
+        self.init = init
+
+class MasterPlaylist:
+    def __init__(self, url, variants):
+        self.url = url
+        self.variants = variants
+
+    def best_variant(self):
+        # Maior banda; em empate, maior resolução
+        if not self.variants:
+            return None
+        return max(self.variants, key=lambda v: (v.bandwidth, v.pixels))
+
+class MediaPlaylist:
+    def __init__(self, url, segments, target_duration=None, media_sequence=0, version=None, ended=False):
+        self.url = url
+        self.segments = segments
+        self.target_duration = target_duration
+        self.media_sequence = media_sequence
+        self.version = version
+        self.ended = ended
+
+    @property
+    def keys(self):
+        # Chaves distintas, na ordem em que aparecem
+        seen = OrderedDict()
+        for segment in self.segments:
+            if segment.key and segment.key.uri:
+                seen.setdefault(segment.key.uri, segment.key)
+        return list(seen.values())
+
+    @property
+    def encrypted(self):
+        return any(segment.key for segment in self.segments)
+
+    def unsupported_for_streaming(self):
+        # O remux pelo stdin do ffmpeg espera MPEG-TS contínuo em AES-128 ou sem cifra
+        for segment in self.segments:
+            if segment.key and not segment.key.uri:
+                return "chave sem URI"
+            if segment.key and segment.key.method != "AES-128":
+                return f"cifra {segment.key.method}"
+            if segment.init:
+                return "EXT-X-MAP"
+            if segment.discontinuity:
+                return "EXT-X-DISCONTINUITY"
+        return None
+
+def parse_resolution(value):
+    match = re.fullmatch(r"(\d+)x(\d+)", value or "")
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def parse_iv(value):
+    if not value:
+        return None
+    return int(value, 16).to_bytes(16, "big")
+
+def parse_byterange(value, previous_end):
+    length, _, offset = value.partition("@")
+    length = int(length)
+    # Sem @início, o range continua de onde o anterior (do mesmo recurso) terminou
+    return length, int(offset) if offset else previous_end
+
+def is_master(content):
+    return "#EXT-X-STREAM-INF" in content
+
+def parse_master(url, content):
+    variants = []
+    pending = None
+    for line in content.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            attributes = parse_attributes(line)
+            pending = Variant(
+                None,
+                bandwidth=int(attributes.get("BANDWIDTH") or 0),
+                resolution=parse_resolution(attributes.get("RESOLUTION")),
+                codecs=attributes.get("CODECS"),
+            )
+        elif line and not line.startswith("#") and pending:
+            pending.url = urllib.parse.urljoin(url, line)
+            variants.append(pending)
+            pending = None
+    return MasterPlaylist(url, variants)
+
+def parse_media(url, content):
+    segments = []
+    target_duration = None
+    media_sequence = 0
+    version = None
+    ended = False
+    sequence = 0
+    key = None
+    init = None
+    duration = None
+    byterange = None
+    discontinuity = False
+    range_ends = {}
+
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE"):
+            media_sequence = sequence = int(tag_value(line))
+        elif line.startswith("#EXT-X-TARGETDURATION"):
+            target_duration = int(float(tag_value(line)))
+        elif line.startswith("#EXT-X-VERSION"):
+            version = int(tag_value(line))
+        elif line.startswith("#EXT-X-KEY"):
+            attributes = parse_attributes(line)
+            method = attributes.get("METHOD", "NONE")
+            if method == "NONE":
+                key = None
+            else:
+                uri = attributes.get("URI")
+                key = Key(
+                    method,
+                    urllib.parse.urljoin(url, uri) if uri else None,
+                    parse_iv(attributes.get("IV")),
+                    attributes.get("KEYFORMAT"),
+                )
+        elif line.startswith("#EXT-X-MAP"):
+            attributes = parse_attributes(line)
+            map_url = urllib.parse.urljoin(url, attributes["URI"])
+            map_range = None
+            if attributes.get("BYTERANGE"):
+                map_range = parse_byterange(attributes["BYTERANGE"], 0)
+            init = Segment(map_url, None, 0, byterange=map_range)
+        elif line.startswith("#EXTINF"):
+            duration = float(tag_value(line).split(",", 1)[0] or 0)
+        elif line.startswith("#EXT-X-BYTERANGE"):
+            byterange = tag_value(line)
+        elif line.startswith("#EXT-X-DISCONTINUITY") and not line.startswith("#EXT-X-DISCONTINUITY-SEQUENCE"):
+            discontinuity = True
+        elif line.startswith("#EXT-X-ENDLIST"):
+            ended = True
+        elif not line.startswith("#"):
+            segment_url = urllib.parse.urljoin(url, line)
+            segment_range = None
+            if byterange:
+                segment_range = parse_byterange(byterange, range_ends.get(segment_url, 0))
+                range_ends[segment_url] = segment_range[1] + segment_range[0]
+            segments.append(Segment(segment_url, sequence, duration, key, segment_range, discontinuity, init))
+            sequence += 1
+            duration = None
+            byterange = None
+            discontinuity = False
+
+    return MediaPlaylist(url, segments, target_duration, media_sequence, version, ended)
+
+def render_local(playlist, segment_names, key_names, init_names=None):
+    # Reescreve a playlist apontando para os arquivos baixados na pasta temporária. Cada
+    # byte range já foi baixado como arquivo próprio, então a saída não usa EXT-X-BYTERANGE.
+    init_names = init_names or {}
+    lines = ["#EXTM3U"]
+    if playlist.version:
+        lines.append(f"#EXT-X-VERSION:{playlist.version}")
+    if playlist.target_duration is not None:
+        lines.append(f"#EXT-X-TARGETDURATION:{playlist.target_duration}")
+    lines.append(f"#EXT-X-MEDIA-SEQUENCE:{playlist.media_sequence}")
+
+    current_key = None
+    current_init = None
+    for segment, name in zip(playlist.segments, segment_names):
+        if segment.discontinuity:
+            lines.append("#EXT-X-DISCONTINUITY")
+        if segment.key is not current_key:
+            if segment.key is None:
+                lines.append("#EXT-X-KEY:METHOD=NONE")
+            else:
+                key_line = f'#EXT-X-KEY:METHOD={segment.key.method},URI="{key_names[segment.key.uri]}"'
+                if segment.key.iv is not None:
+                    key_line += f",IV=0x{segment.key.iv.hex()}"
+                lines.append(key_line)
+            current_key = segment.key
+        if segment.init is not current_init:
+            lines.append(f'#EXT-X-MAP:URI="{init_names[segment.init]}"')
+            current_init = segment.init
+        lines.append(f"#EXTINF:{segment.duration or 0:.3f},")
+        lines.append(name)
+    if playlist.ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+class KeyCache:
+    # Chaves AES por URI, compartilhadas por toda a execução. Pedidos simultâneos da mesma
+    # URI esperam o primeiro download em vez de repetir a requisição; falhas não ficam no cache.
+    def __init__(self, max_size=None):
+        self.max_size = max_size or KEY_CACHE_SIZE
+        self.keys = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, uri):
+        with self.lock:
+            data = self.keys.get(uri)
+            if data is not None:
+                self.keys.move_to_end(uri)
+            return data
+
+    def put(self, uri, data):
+        with self.lock:
+            self.keys[uri] = data
+            self.keys.move_to_end(uri)
+            while len(self.keys) > self.max_size:
+                self.keys.popitem(last=False)
+
+    def fetch(self, uri, loader):
+        with self.lock:
+            data = self.keys.get(uri)
+            if data is not None:
+                metrics.inc("key_cache_hits")
+                return data
+            event = self.pending.get(uri)
+            owner = event is None
+            if owner:
+                event = self.pending[uri] = threading.Event()
+        if not owner:
+            event.wait()
+            data = self.get(uri)
+            if data is not None:
+                metrics.inc("key_cache_hits")
+                return data
+            return self.fetch(uri, loader)
+
+        try:
+            data = loader(uri)
+            if data:
+                self.put(uri, data)
+            else:
+                log_debug(f"[HLS] Não foi possível baixar a chave: {uri}")
+            return data
+        finally:
+            with self.lock:
+                self.pending.pop(uri, None)
+            event.set()
+
+key_cache = KeyCache()
@@ -0,0 +1,68 @@
+import base64
+import binascii
+import json
+import os
+from functools import lru_cache
+
+IMAGE_FALLBACK_HEIGHTS = [int(h) for h in os.getenv("IMAGE_FALLBACK_HEIGHTS", "2160,1440,1080,720").split(",") if h.strip()]
+IMAGE_TOKEN_CACHE_SIZE = 4096
+TOO_LARGE_STATUS = 413
+
+# As imagens vêm de um CDN no formato https://host/<token>, onde o token é um JSON em
+# base64 url-safe ({"bucket", "key", "edits"}). Cada token distinto é decodificado e
+# reescrito uma única vez; as variantes ficam em cache pelo próprio token.
+
+def split_image_url(image_url):
+    if not image_url.startswith("https://"):
+        return None
+    slash = image_url.find("/", 8)
+    if slash < 0:
+        return None
+    end = len(image_url)
+    for sep in ("/", "?", "#"):
+        pos = image_url.find(sep, slash + 1)
+        if pos >= 0:
+            end = min(end, pos)
+    token = image_url[slash + 1:end]
+    if not token:
+        return None
+    return image_url[:slash + 1], token, image_url[end:]
+
+@lru_cache(maxsize=IMAGE_TOKEN_CACHE_SIZE)
+def decode_image_token(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+def encode_image_token(payload):
+    data = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+@lru_cache(maxsize=IMAGE_TOKEN_CACHE_SIZE)
+def image_token_variants(token):
+    payload = decode_image_token(token)
+    if payload is None:
+        return (token,)
+    variants = [encode_image_token(dict(payload, edits={}))]
+    for height in IMAGE_FALLBACK_HEIGHTS:
+        edits = {"resize": {"height": height, "fit": "inside", "withoutEnlargement": True}}
+        variants.append(encode_image_token(dict(payload, edits=edits)))
+    if token not in variants:
+        # A URL original da API continua como último recurso
+        variants.append(token)
+    return tuple(variants)
+
+def image_variants(image_url):
+    # Original sem edições primeiro, depois alturas menores para quando o CDN responde 413
+    parts = split_image_url(image_url)
+    if not parts:
+        return [(None, image_url)]
+    prefix, token, suffix = parts
+    heights = [None] + IMAGE_FALLBACK_HEIGHTS
+    urls = [prefix + variant + suffix for variant in image_token_variants(token)]
+    if len(urls) == 1:
+        return [(None, image_url)]
+    labels = heights + ["api"] * (len(urls) - len(heights))
+    return list(zip(labels, urls))
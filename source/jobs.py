@@ -0,0 +1,442 @@
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from tqdm import tqdm
+from source import metrics
+from source.log import log_debug
+from source.media import (
+    DOWNLOAD_DIR, IMAGE_WORKERS, VIDEO_WORKERS, HIGH_WATER_MARK_FORMAT, ConversionPool, DownloadProgress,
+    PageFetcher, download_image_task, download_video_task, format_post_date, load_media_counts, media_filename,
+    media_type_total, parse_post_date, skip_known_media,
+)
+from source.tokens import VideoTokenCache, video_file_id
+
+# Fila de jobs em SQLite para o modo distribuído: o coordenador lista os posts e enfileira
+# uma linha por mediaId; os workers (vários processos, em uma ou mais máquinas apontando
+# para a mesma pasta) pegam jobs com uma lease renovada por heartbeat. Lease vencida
+# significa worker morto, e o job volta para a fila.
+
+JOB_QUEUE = os.getenv("JOB_QUEUE", os.path.join(DOWNLOAD_DIR, "jobs.db"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+WORKER_IDLE_TIMEOUT = float(os.getenv("WORKER_IDLE_TIMEOUT", "60"))
+
+STATE_QUEUED = "queued"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+KIND_IMAGE = "image"
+KIND_VIDEO = "video"
+KIND_MP4 = "mp4"
+
+JOB_COLUMNS = ("media_id", "profile", "kind", "payload", "state", "worker", "lease_until", "attempts")
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def job_kind(file):
+    if file["type"] == "image":
+        return KIND_IMAGE
+    return KIND_MP4 if ".mp4" in file["url"].lower() else KIND_VIDEO
+
+class JobQueue:
+    def __init__(self, path=None):
+        self.path = path or JOB_QUEUE
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        # Transações explícitas (BEGIN IMMEDIATE) para que só um processo por vez pegue jobs.
+        # Sem WAL: o journal padrão também funciona com o arquivo numa pasta de rede (o manifesto
+        # e o índice do dedup seguem a mesma regra nos papéis coordinator e worker).
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    media_id TEXT PRIMARY KEY,
+                    profile TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, kind, enqueued_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_profile ON jobs (profile, state)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS queue_state (name TEXT PRIMARY KEY, value REAL)")
+        log_debug(f"Fila de jobs aberta: {self.path}")
+
+    def transaction(self, fn, *args):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def enqueue_many(self, jobs):
+        # jobs: (media_id, profile, kind, payload). Um mediaId já na fila ou em andamento não
+        # é duplicado; só jobs concluídos ou que falharam voltam para a fila.
+        def insert():
+            now = time.time()
+            added = 0
+            for media_id, profile, kind, payload in jobs:
+                cursor = self.conn.execute("""
+                    INSERT INTO jobs (media_id, profile, kind, payload, state, attempts, enqueued_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+                    ON CONFLICT(media_id) DO UPDATE SET
+                        profile = excluded.profile,
+                        kind = excluded.kind,
+                        payload = excluded.payload,
+                        state = excluded.state,
+                        worker = NULL,
+                        lease_until = NULL,
+                        attempts = 0,
+                        enqueued_at = excluded.enqueued_at,
+                        updated_at = excluded.updated_at
+                    WHERE jobs.state IN (?, ?)
+                """, (str(media_id), profile, kind, json.dumps(payload), STATE_QUEUED, now, now, STATE_DONE, STATE_FAILED))
+                added += cursor.rowcount
+            return added
+
+        return self.transaction(insert) if jobs else 0
+
+    def requeue_expired(self, now):
+        # Chamado dentro de uma transação. Jobs com lease vencida voltam para a fila, a não
+        # ser que já tenham esgotado as tentativas.
+        cursor = self.conn.execute("""
+            UPDATE jobs SET
+                state = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                worker = NULL, lease_until = NULL, updated_at = ?
+            WHERE state = ? AND lease_until < ?
+        """, (JOB_MAX_ATTEMPTS, STATE_FAILED, STATE_QUEUED, now, STATE_LEASED, now))
+        if cursor.rowcount:
+            metrics.inc("jobs_requeued", cursor.rowcount)
+            log_debug(f"[JOBS] {cursor.rowcount} job(s) com lease vencida devolvidos à fila")
+
+    def claim(self, worker, kinds):
+        def lease():
+            now = time.time()
+            self.requeue_expired(now)
+            placeholders = ",".join("?" * len(kinds))
+            row = self.conn.execute(
+                f"SELECT media_id FROM jobs WHERE state = ? AND kind IN ({placeholders}) ORDER BY enqueued_at LIMIT 1",
+                (STATE_QUEUED, *kinds)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("""
+                UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                WHERE media_id = ?
+            """, (STATE_LEASED, worker, now + JOB_LEASE_SECONDS, now, row[0]))
+            return self.conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE media_id = ?", (row[0],)
+            ).fetchone()
+
+        row = self.transaction(lease)
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def heartbeat(self, worker):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE worker = ? AND state = ?",
+                (now + JOB_LEASE_SECONDS, now, worker, STATE_LEASED)
+            )
+        return cursor.rowcount
+
+    def complete(self, media_id, worker, success):
+        # Só quem ainda tem a lease conclui o job; se ela venceu e outro worker pegou o
+        # mesmo mediaId, o resultado atrasado é descartado.
+        with self.lock:
+            cursor = self.conn.execute("""
+                UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, updated_at = ?
+                WHERE media_id = ? AND worker = ? AND state = ?
+            """, (STATE_DONE if success else STATE_FAILED, time.time(), str(media_id), worker, STATE_LEASED))
+        if not cursor.rowcount:
+            log_debug(f"[JOBS] Lease de {media_id} perdida por {worker}; resultado ignorado")
+        return bool(cursor.rowcount)
+
+    def pending(self, kinds=None, profiles=None):
+        query = "SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)"
+        params = [STATE_QUEUED, STATE_LEASED]
+        if kinds:
+            query += f" AND kind IN ({','.join('?' * len(kinds))})"
+            params += list(kinds)
+        if profiles:
+            query += f" AND profile IN ({','.join('?' * len(profiles))})"
+            params += list(profiles)
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def counts(self, profiles, since):
+        # Estado por perfil dos jobs pendentes e dos concluídos desde o início da rodada
+        placeholders = ",".join("?" * len(profiles))
+        with self.lock:
+            rows = self.conn.execute(f"""
+                SELECT profile, state, COUNT(*) FROM jobs
+                WHERE profile IN ({placeholders}) AND (state IN (?, ?) OR updated_at >= ?)
+                GROUP BY profile, state
+            """, (*profiles, STATE_QUEUED, STATE_LEASED, since)).fetchall()
+        counts = {profile: {} for profile in profiles}
+        for profile, state, count in rows:
+            counts[profile][state] = count
+        return counts
+
+    def set_state(self, name, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO queue_state (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (name, value)
+            )
+
+    def get_state(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM queue_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def coordinator_alive(self):
+        # O coordenador renova esse prazo enquanto ainda pode enfileirar jobs
+        self.set_state("coordinator_until", time.time() + JOB_LEASE_SECONDS)
+
+    def coordinator_done(self):
+        self.set_state("coordinator_until", 0)
+        self.set_state("coordinator_done_at", time.time())
+
+    def coordinator_active(self):
+        return (self.get_state("coordinator_until") or 0) > time.time()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class Heartbeat:
+    # Chama fn a cada interval segundos numa thread própria até stop()
+    def __init__(self, interval, fn, name="heartbeat"):
+        self.interval = interval
+        self.fn = fn
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.fn()
+            except Exception as e:
+                log_debug(f"[JOBS] Falha no heartbeat: {e}")
+
+    def start(self):
+        self.fn()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+def job_payload(file, filename):
+    return {"file": file, "filename": filename}
+
+def enqueue_profile(scraper, job_queue, manifest, profile_name, media_type, high_water_mark=None):
+    # A contagem só dimensiona a barra; se veio do cache, a releitura em segundo plano segue sozinha
+    counts, _ = load_media_counts(scraper, profile_name)
+    os.makedirs(f"{DOWNLOAD_DIR}/{profile_name}/fotos", exist_ok=True)
+    os.makedirs(f"{DOWNLOAD_DIR}/{profile_name}/videos", exist_ok=True)
+    wanted = {"image": media_type in ["1", "3"], "video": media_type in ["2", "3"]}
+
+    newest_post_date = None
+    enqueued = 0
+    pages = PageFetcher(scraper, profile_name, high_water_mark)
+    with tqdm(total=media_type_total(media_type, counts), desc=f"Enfileirando {profile_name}", unit="mídia") as pbar:
+        # Itens já baixados avançam a barra como no modo local; os enfileirados também
+        progress = DownloadProgress(pbar)
+        try:
+            for skip, items in pages:
+                jobs = []
+                for item in items:
+                    post_date = parse_post_date(item.get("postDate"))
+                    formatted_date = format_post_date(post_date)
+                    if post_date and (newest_post_date is None or post_date > newest_post_date):
+                        newest_post_date = post_date
+
+                    for file in item.get("files", []):
+                        file_type = file["type"]
+                        if file["isLocked"] or not wanted.get(file_type):
+                            continue
+                        filename = media_filename(profile_name, file_type, formatted_date, file["mediaId"])
+                        if skip_known_media(manifest, progress, file["mediaId"], profile_name, file_type, filename):
+                            continue
+                        jobs.append((file["mediaId"], profile_name, job_kind(file), job_payload(file, filename)))
+                        progress.advance()
+                enqueued += job_queue.enqueue_many(jobs)
+        finally:
+            pages.stop()
+
+    tqdm.write(f"[{profile_name}] {enqueued} jobs novos na fila")
+    return enqueued, newest_post_date
+
+def spawn_workers(count, queue_path):
+    # Workers locais em processos separados; no executável empacotado, o próprio binário
+    if getattr(sys, "frozen", False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")]
+    command += ["--role", "worker", "--queue", queue_path]
+    # As barras de progresso dos workers embaralhariam as do coordenador
+    env = dict(os.environ, TQDM_DISABLE="1")
+    return [subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL) for _ in range(count)]
+
+def wait_for_jobs(job_queue, profiles, started_at, pbar):
+    while True:
+        job_queue.coordinator_alive()
+        pending = job_queue.pending(profiles=profiles)
+        done = pbar.total - pending if pbar.total else 0
+        if done > pbar.n:
+            pbar.update(done - pbar.n)
+        if not pending:
+            return job_queue.counts(profiles, started_at)
+        time.sleep(JOB_POLL_INTERVAL)
+
+def run_coordinator(scraper, profiles, media_type, manifest, job_queue, incremental=None, workers=0):
+    # Enfileira os posts de todos os perfis e espera os workers esvaziarem a fila
+    started_at = time.time()
+    heartbeat = Heartbeat(JOB_LEASE_SECONDS / 3, job_queue.coordinator_alive, name="coordinator").start()
+    processes = []
+    marks = {}
+    try:
+        if workers:
+            processes = spawn_workers(workers, job_queue.path)
+        for profile in profiles:
+            high_water_mark = manifest.get_high_water_mark(profile, media_type) if incremental else None
+            if high_water_mark:
+                tqdm.write(f"[{profile}] [INCREMENTAL] Buscando apenas posts posteriores a {high_water_mark}")
+            try:
+                _, marks[profile] = enqueue_profile(scraper, job_queue, manifest, profile, media_type, high_water_mark)
+            except Exception as e:
+                log_debug(f"[ERRO] Falha ao enfileirar perfil {profile}: {e}")
+                tqdm.write(f"[ERRO] Falha ao enfileirar perfil {profile}: {e}")
+                marks[profile] = e
+
+        with tqdm(total=job_queue.pending(profiles=profiles), desc="Aguardando workers", unit="mídia") as pbar:
+            counts = wait_for_jobs(job_queue, profiles, started_at, pbar)
+    finally:
+        heartbeat.stop()
+        job_queue.coordinator_done()
+        for process in processes:
+            process.wait()
+
+    results = []
+    for profile in profiles:
+        downloaded = counts[profile].get(STATE_DONE, 0)
+        failed = counts[profile].get(STATE_FAILED, 0)
+        mark = marks.get(profile)
+        if isinstance(mark, Exception):
+            results.append({"profile": profile, "downloaded": downloaded, "failed": failed, "error": str(mark)})
+            continue
+        # Mesma regra do modo local: a marca incremental só avança sem falhas
+        if incremental and mark and failed == 0:
+            value = mark.strftime(HIGH_WATER_MARK_FORMAT)
+            previous = manifest.get_high_water_mark(profile, media_type)
+            if not previous or value > previous:
+                manifest.set_high_water_mark(profile, media_type, value)
+        tqdm.write(f"[RESUMO] {profile}: {downloaded} arquivos baixados pelos workers, {failed} falhas")
+        results.append({"profile": profile, "downloaded": downloaded, "failed": failed})
+    return results
+
+class JobProgress:
+    # Faz o papel do DownloadProgress para um único job: o fim da tarefa (inclusive de uma
+    # conversão que termina em outro processo) conclui o job na fila.
+    def __init__(self, job_queue, worker, job, totals):
+        self.job_queue = job_queue
+        self.worker = worker
+        self.job = job
+        self.totals = totals
+
+    def advance(self, downloaded=False, failed=False):
+        # Com a lease perdida o job voltou para a fila e quem o pegar conta o resultado
+        if self.job_queue.complete(self.job["media_id"], self.worker, downloaded):
+            self.totals.advance(downloaded, failed)
+
+def run_job(scraper, media_downloader, manifest, token_cache, conversion_pool, job_queue, worker, job, totals):
+    payload = job["payload"]
+    file = payload["file"]
+    progress = JobProgress(job_queue, worker, job, totals)
+    if job["kind"] == KIND_IMAGE:
+        download_image_task(scraper, manifest, job["profile"], file["mediaId"], file["url"], payload["filename"], progress)
+    else:
+        token_cache.prefetch([video_file_id(file["url"])])
+        download_video_task(scraper, media_downloader, manifest, token_cache, job["profile"], file, payload["filename"], progress, conversion_pool)
+
+def run_worker(scraper, media_downloader, manifest, job_queue, worker=None, image_workers=None, video_workers=None, idle_timeout=None):
+    worker = worker or default_worker_id()
+    idle_timeout = WORKER_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+    started_at = time.time()
+    token_cache = VideoTokenCache(scraper)
+    conversion_pool = ConversionPool()
+    heartbeat = Heartbeat(JOB_LEASE_SECONDS / 3, lambda: job_queue.heartbeat(worker), name=f"heartbeat-{worker}")
+    # Cada thread pega jobs de um tipo; os limites por tipo são os mesmos do modo local
+    slots = [(KIND_IMAGE,)] * (image_workers or IMAGE_WORKERS) + [(KIND_VIDEO, KIND_MP4)] * (video_workers or VIDEO_WORKERS)
+
+    def should_stop(kinds, idle_since):
+        if job_queue.pending(kinds) or job_queue.coordinator_active():
+            return False
+        # Sem coordenador nem jobs pendentes: encerra se o coordenador já terminou depois que
+        # este worker subiu, ou depois de esperar idle_timeout por um coordenador novo
+        done_at = job_queue.get_state("coordinator_done_at") or 0
+        return done_at >= started_at or time.time() - idle_since >= idle_timeout
+
+    def loop(kinds):
+        idle_since = time.time()
+        while True:
+            try:
+                job = job_queue.claim(worker, kinds)
+            except sqlite3.OperationalError as e:
+                log_debug(f"[JOBS] Fila ocupada, tentando de novo: {e}")
+                job = None
+            if job is None:
+                if should_stop(kinds, idle_since):
+                    return
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
+            log_debug("[JOBS] %s pegou %s (%s, tentativa %s)", worker, job["media_id"], job["kind"], job["attempts"])
+            try:
+                run_job(scraper, media_downloader, manifest, token_cache, conversion_pool, job_queue, worker, job, totals)
+            except Exception as e:
+                log_debug(f"[ERRO] Falha no job {job['media_id']}: {e}")
+                job_queue.complete(job["media_id"], worker, False)
+            idle_since = time.time()
+
+    tqdm.write(f"[WORKER] {worker} aguardando jobs em {job_queue.path}")
+    with tqdm(desc=f"Worker {worker}", unit="mídia") as pbar:
+        totals = DownloadProgress(pbar)
+        heartbeat.start()
+        threads = [threading.Thread(target=loop, args=(kinds,), name=f"job-{i}", daemon=True) for i, kinds in enumerate(slots)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            # Conversões ainda em andamento concluem seus jobs nos callbacks
+            conversion_pool.shutdown(wait=True)
+            token_cache.close()
+            heartbeat.stop()
+
+    tqdm.write(f"[RESUMO] {worker}: {totals.downloaded_count} arquivos baixados, {totals.failed_count} falhas")
+    return {"worker": worker, "downloaded": totals.downloaded_count, "failed": totals.failed_count}
@@ -0,0 +1,32 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+DEBUG = os.getenv("DEBUG", "False").lower() == "true"
+LOG_FILE = "debug.log"
+LOGGER_NAME = "privacy"
+
+logger = logging.getLogger(LOGGER_NAME)
+
+if DEBUG:
+    # A escrita no console e no arquivo fica numa thread própria; quem loga só enfileira
+    file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter('[DEBUG] %(message)s'))
+    console_handler.addFilter(logging.Filter(LOGGER_NAME))
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.DEBUG, handlers=[queue_handler])
+    listener.start()
+    atexit.register(listener.stop)
+
+def log_debug(msg, *args):
+    # Use log_debug("texto %s", valor) nos caminhos quentes: a mensagem só é montada com DEBUG ativo
+    if DEBUG:
+        logger.debug(msg, *args)
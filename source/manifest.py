@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from source.log import log_debug
+
+MANIFEST_FILENAME = "manifest.db"
+# O WAL depende de memória compartilhada (arquivo -shm) que só vale dentro de uma máquina.
+# No modo distribuído os bancos podem estar numa pasta de rede vista por vários hosts, então
+# o manifesto e o índice do dedup ficam no journal padrão (rollback), como a fila de jobs.
+SHARED_ROLES = ("coordinator", "worker")
+JOURNAL_MODE = "DELETE" if os.getenv("ROLE", "local").lower() in SHARED_ROLES else "WAL"
+
+STATE_PENDING = "pending"
+STATE_DOWNLOADED = "downloaded"
+STATE_FAILED = "failed"
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DownloadManifest:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        # No modo distribuído vários processos gravam no mesmo manifesto; quem encontra o
+        # banco travado espera em vez de falhar
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS media (
+                    media_id TEXT PRIMARY KEY,
+                    profile TEXT NOT NULL,
+                    media_type TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    size INTEGER,
+                    checksum TEXT,
+                    path TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS media_profile ON media (profile)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS profiles (
+                    profile TEXT NOT NULL,
+                    media_type TEXT NOT NULL,
+                    last_post_date TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (profile, media_type)
+                )
+            """)
+        log_debug(f"Manifesto aberto: {path}")
+
+    def get(self, media_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT media_id, profile, media_type, state, size, checksum, path, updated_at FROM media WHERE media_id = ?",
+                (str(media_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("media_id", "profile", "media_type", "state", "size", "checksum", "path", "updated_at")
+        return dict(zip(keys, row))
+
+    def is_downloaded(self, media_id):
+        entry = self.get(media_id)
+        return bool(entry and entry["state"] == STATE_DOWNLOADED and entry["path"] and os.path.exists(entry["path"]))
+
+    def _upsert(self, media_id, profile, media_type, state, path, size=None, checksum=None):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO media (media_id, profile, media_type, state, size, checksum, path, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(media_id) DO UPDATE SET
+                    profile = excluded.profile,
+                    media_type = excluded.media_type,
+                    state = excluded.state,
+                    size = excluded.size,
+                    checksum = excluded.checksum,
+                    path = excluded.path,
+                    updated_at = excluded.updated_at
+            """, (str(media_id), profile, media_type, state, size, checksum, path, time.time()))
+
+    def mark_pending(self, media_id, profile, media_type, path):
+        self._upsert(media_id, profile, media_type, STATE_PENDING, path)
+
+    def mark_failed(self, media_id, profile, media_type, path):
+        self._upsert(media_id, profile, media_type, STATE_FAILED, path)
+
+    def mark_downloaded(self, media_id, profile, media_type, path, checksum=None, compute_checksum=True):
+        # checksum é o hash já calculado durante o download; sem ele, o arquivo é relido, a
+        # não ser com compute_checksum=False (arquivos antigos registrados sem o conteúdo)
+        size = os.path.getsize(path)
+        if checksum is None and compute_checksum:
+            checksum = file_checksum(path)
+        self._upsert(media_id, profile, media_type, STATE_DOWNLOADED, path, size, checksum)
+
+    def get_high_water_mark(self, profile, media_type):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_post_date FROM profiles WHERE profile = ? AND media_type = ?",
+                (profile, media_type)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_high_water_mark(self, profile, media_type, last_post_date):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO profiles (profile, media_type, last_post_date, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(profile, media_type) DO UPDATE SET
+                    last_post_date = excluded.last_post_date,
+                    updated_at = excluded.updated_at
+            """, (profile, media_type, last_post_date, time.time()))
+
+    def media_ids_by_path(self, profile):
+        with self.lock:
+            rows = self.conn.execute("SELECT media_id, path FROM media WHERE profile = ? AND path IS NOT NULL", (profile,)).fetchall()
+        return {os.path.normpath(path): media_id for media_id, path in rows}
+
+    def high_water_marks(self, profile):
+        with self.lock:
+            rows = self.conn.execute("SELECT media_type, last_post_date FROM profiles WHERE profile = ?", (profile,)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
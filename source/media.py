@@ -1,335 +1,773 @@
 import os
-import re
 import urllib.parse
-import chardet
-import ffmpeg
 import shutil
-import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import wait as wait_all
 from datetime import datetime
 from tqdm import tqdm
-from source.scraper import log_debug
-
-DOWNLOAD_DIR = "downloads"
+from source import metrics, network
+from source import hls
+from source.dedup import get_content_store
+from source.download import bandwidth_limiter, download_to_file
+from source.log import log_debug
+from source.manifest import MANIFEST_FILENAME, DownloadManifest
+from source.stream import STREAM_REMUX, stream_hls_to_mp4
+from source.tokens import TOKEN_EXPIRED_STATUS, TokenHolder, VideoTokenCache, video_file_id
+
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "downloads")
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", os.getenv("WORKERS", "5")))
+SEGMENT_RETRIES = int(os.getenv("SEGMENT_RETRIES", "3"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", os.getenv("WORKERS", "5")))
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", "2"))
+CONVERSION_WORKERS = int(os.getenv("CONVERSION_WORKERS", str(os.cpu_count() or 1)))
+CONVERSION_QUEUE = int(os.getenv("CONVERSION_QUEUE", "0"))
+PAGE_SIZE = 50
+PAGE_PREFETCH = int(os.getenv("PAGE_PREFETCH", "4"))
+SYNC_MODE = os.getenv("SYNC_MODE", "full").lower()
+HIGH_WATER_MARK_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def content_headers(url, tokenContent):
+    uri = url.split("hls/", 1)[-1]
+    return {
+        "referer": "https://privacy.com.br/",
+        "Content": tokenContent,
+        'X-Content-Uri': uri
+    }
+
+def key_headers(url, tokenContent):
+    parsed_url = urllib.parse.urlparse(url)
+    uri = os.path.basename(parsed_url.path)
+
+    return {
+        "Content": tokenContent,
+        "X-Content-Uri": uri,
+        "referer": "https://privacy.com.br/",
+        "origin": "https://privacy.com.br",
+        "priority": "u=1, i",
+        "accept": "*/*",
+        "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
+        "sec-fetch-dest": "empty",
+        "sec-fetch-mode": "cors",
+        "sec-fetch-site": "same-site",
+        "sec-ch-ua": '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": '"Windows"',
+    }
+
+def best_variant_url(main_m3u8_url, main_m3u8_content):
+    variant = hls.parse_master(main_m3u8_url, main_m3u8_content).best_variant()
+    best_quality_url = variant.url if variant else None
+    log_debug("Melhor qualidade m3u8 selecionada: %s", best_quality_url)
+    return best_quality_url
+
+def segment_filename(index, url):
+    extension = os.path.splitext(urllib.parse.urlparse(url).path)[1] or ".ts"
+    return f"segment{index:05d}{extension}"
 
 class MediaDownloader:
-    def __init__(self, scraper):
+    def __init__(self, scraper, segment_workers=None, segment_retries=None):
         self.scraper = scraper
+        self.segment_workers = max(1, segment_workers or SEGMENT_WORKERS)
+        self.segment_retries = max(1, segment_retries or SEGMENT_RETRIES)
         log_debug("MediaDownloader instanciado")
 
     def download_file(self, url, filename, tokenContent, pbar=None):
-        uri = url.split("hls/", 1)[-1]
-        headers = {
-            "referer": "https://privacy.com.br/",
-            "Content": tokenContent,
-            'X-Content-Uri': uri
-        }
+        success, _ = self.fetch_file(url, filename, tokenContent, pbar)
+        return success
+
+    def content_headers(self, url, tokenContent):
+        return content_headers(url, tokenContent)
+
+    def fetch_file(self, url, filename, tokenContent, pbar=None):
+        headers = self.content_headers(url, tokenContent)
 
         try:
             os.makedirs(os.path.dirname(filename), exist_ok=True)
-            log_debug(f"Iniciando download de {url} para {filename}")
-            response = self.scraper.get(url, headers=headers, stream=True)
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                log_debug(f"Download concluído: {filename}")
+            log_debug("Iniciando download de %s para %s", url, filename)
+            success, status_code = download_to_file(self.scraper, url, filename, headers)
+            if success:
+                log_debug("Download concluído: %s", filename)
 
                 if pbar:
                     pbar.update(1)
                     
-                return True
+                return True, status_code
             else:
-                log_debug(f"[ERRO] Falha ao baixar {url}: Status {response.status_code}")
-                return False
+                log_debug(f"[ERRO] Falha ao baixar {url}: Status {status_code}")
+                return False, status_code
         except Exception as e:
             log_debug(f"[ERRO] Falha ao baixar {url}: {e}")
-            return False
-
-    def download_key_file(self, url, filename, tokenContent, pbar=None):
-        parsed_url = urllib.parse.urlparse(url)
-        uri = os.path.basename(parsed_url.path)
-
-        headers = {
-            "Content": tokenContent,
-            "X-Content-Uri": uri,
-            "referer": "https://privacy.com.br/",
-            "origin": "https://privacy.com.br",
-            "priority": "u=1, i",
-            "accept": "*/*",
-            "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
-            "sec-fetch-dest": "empty",
-            "sec-fetch-mode": "cors",
-            "sec-fetch-site": "same-site",
-            "sec-ch-ua": '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Windows"',
-        }
+            return False, None
 
+    def fetch_bytes(self, url, headers):
         try:
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-            log_debug(f"[KEY] Iniciando download de {url} para {filename}")
-            response = self.scraper.get(url, headers=headers, stream=True)
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                log_debug(f"[KEY] Download concluído: {filename}")
-                if pbar:
-                    pbar.update(1)
-                return True
-            else:
-                log_debug(f"[KEY] Falha ao baixar {url} — Status {response.status_code}")
-                return False
+            log_debug("Baixando em memória: %s", url)
+            response = network.request(self.scraper, "GET", url, headers=headers)
+            if response.status_code == 200 or (response.status_code == 206 and "Range" in headers):
+                bandwidth_limiter.consume(len(response.content))
+                metrics.inc("bytes", len(response.content))
+                return response.content, response.status_code
+            log_debug(f"[ERRO] Falha ao baixar {url}: Status {response.status_code}")
+            return None, response.status_code
         except Exception as e:
-            log_debug(f"[KEY] Erro ao baixar key {url}: {e}")
-            return False
+            log_debug(f"[ERRO] Falha ao baixar {url}: {e}")
+            return None, None
+
+    def fetch_text(self, url, tokenContent):
+        data, _ = self.fetch_bytes(url, self.content_headers(url, tokenContent))
+        return data.decode('utf-8', errors='replace') if data is not None else None
+
+    def retry_with_token(self, url, token, attempt_fn):
+        # Erros de conexão e status transitórios já são retentados no network (e a retomada
+        # do .part no download_to_file); aqui só se repete depois de renovar um token expirado
+        for attempt in range(1, self.segment_retries + 1):
+            token_content = token.content
+            result, status_code = attempt_fn(token_content)
+            if result:
+                return result
+            if status_code not in TOKEN_EXPIRED_STATUS or attempt == self.segment_retries:
+                return None
+            log_debug(f"[AVISO] Token expirado no segmento {url}, renovando ({attempt}/{self.segment_retries})")
+            token.refresh(token_content)
+        return None
+
+    def download_segment(self, url, filename, token, byterange=None):
+        if byterange:
+            # Byte ranges vêm em memória; o download_to_file usa o Range para retomar
+            data = self.fetch_segment(url, token, byterange)
+            if data is None:
+                return False
+            with open(filename, 'wb') as f:
+                f.write(data)
+            return True
+        with metrics.timer("segment"):
+            return bool(self.retry_with_token(url, token, lambda content: self.fetch_file(url, filename, content)))
+
+    def fetch_range(self, url, tokenContent, byterange=None):
+        headers = self.content_headers(url, tokenContent)
+        if not byterange:
+            return self.fetch_bytes(url, headers)
+        length, offset = byterange
+        headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+        data, status_code = self.fetch_bytes(url, headers)
+        if status_code == 200 and data is not None:
+            # Servidor sem suporte a Range devolveu o recurso inteiro
+            data = data[offset:offset + length]
+        return data, status_code
+
+    def fetch_segment(self, url, token, byterange=None):
+        with metrics.timer("segment"):
+            return self.retry_with_token(url, token, lambda content: self.fetch_range(url, content, byterange))
+
+    def key_headers(self, url, tokenContent):
+        return key_headers(url, tokenContent)
+
+    def fetch_key(self, url, tokenContent):
+        # Cache por URI para a execução inteira: vídeos e variantes que repetem a chave não a baixam de novo
+        def load(uri):
+            with metrics.timer("key"):
+                data, _ = self.fetch_bytes(uri, self.key_headers(uri, tokenContent))
+            return data
+
+        return hls.key_cache.fetch(url, load)
 
     def get_best_quality_m3u8(self, main_m3u8_url, main_m3u8_content):
-        lines = main_m3u8_content.split('\n')
-        best_quality_url = None
-        max_bandwidth = 0
-        current_bandwidth = 0
-
-        for line in lines:
-            if line.startswith('#EXT-X-STREAM-INF'):
-                bandwidth_match = re.search(r'BANDWIDTH=(\d+)', line)
-                if bandwidth_match:
-                    current_bandwidth = int(bandwidth_match.group(1))
-            elif line.strip() and not line.startswith('#'):
-                if current_bandwidth > max_bandwidth:
-                    max_bandwidth = current_bandwidth
-                    best_quality_url = urllib.parse.urljoin(main_m3u8_url, line.strip())
-
-        log_debug(f"Melhor qualidade m3u8 selecionada: {best_quality_url}")
-        return best_quality_url
-
-    def process_m3u8(self, m3u8_url, base_path, tokenContent):
+        return best_variant_url(main_m3u8_url, main_m3u8_content)
+
+    def fetch_playlist(self, url, tokenContent):
+        content = self.fetch_text(url, tokenContent)
+        if content is None:
+            log_debug(f"[ERRO] Falha ao baixar a playlist {url}")
+            return None
+        return hls.parse_media(url, content)
+
+    def process_m3u8(self, playlist, base_path, tokenContent, refresh_token=None):
+        # Baixa chaves e segmentos para a pasta temporária e grava a playlist reescrita
+        # para o ffmpeg; aceita o modelo já lido ou a URL da playlist de mídia.
+        token = TokenHolder(tokenContent, refresh_token)
+        if isinstance(playlist, str):
+            playlist = self.fetch_playlist(playlist, tokenContent)
+            if playlist is None:
+                return None
+        log_debug("Processando M3U8: %s", playlist.url)
+        if any(segment.key and not segment.key.uri for segment in playlist.segments):
+            log_debug(f"[ERRO] Playlist com chave sem URI: {playlist.url}")
+            return None
+        os.makedirs(base_path, exist_ok=True)
+
+        key_names = {}
+        for index, key in enumerate(playlist.keys):
+            key_bytes = self.fetch_key(key.uri, token.content)
+            if not key_bytes:
+                # Sem a chave o vídeo convertido sairia corrompido; falha o vídeo inteiro
+                log_debug(f"[ERRO] Não foi possível baixar a chave: {key.uri}")
+                return None
+            key_names[key.uri] = f"key{index}.key"
+            with open(os.path.join(base_path, key_names[key.uri]), 'wb') as f:
+                f.write(key_bytes)
+
+        init_names = {}
+        for segment in playlist.segments:
+            if segment.init and segment.init not in init_names:
+                init_names[segment.init] = f"init{len(init_names)}{os.path.splitext(urllib.parse.urlparse(segment.init.url).path)[1] or '.mp4'}"
+        segment_names = [segment_filename(index, segment.url) for index, segment in enumerate(playlist.segments)]
+        downloads = list(init_names.items()) + list(zip(playlist.segments, segment_names))
+
+        with ThreadPoolExecutor(max_workers=self.segment_workers) as executor:
+            futures = [
+                executor.submit(self.download_segment, segment.url, os.path.join(base_path, name), token, segment.byterange)
+                for segment, name in downloads
+            ]
+            failed = False
+            for (segment, _), future in zip(downloads, futures):
+                if not future.result():
+                    log_debug(f"[ERRO] Falha ao baixar segmento: {segment.url}")
+                    failed = True
+
+        if failed:
+            # Um segmento faltando deixaria um buraco silencioso no MP4; o vídeo fica como
+            # falho no manifesto e é tentado de novo na próxima execução.
+            return None
+
         m3u8_filename = os.path.join(base_path, "playlist.m3u8")
-        log_debug(f"Processando M3U8: {m3u8_url}")
-
-        if self.download_file(m3u8_url, m3u8_filename, tokenContent):
-            with open(m3u8_filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            lines = content.split('\n')
-            modified_content = []
-
-            for line in lines:
-                if line.startswith('#EXT-X-SESSION-KEY') or line.startswith('#EXT-X-KEY'):
-                    uri_match = re.search(r'URI="([^"]+)"', line)
-                    if uri_match:
-                        key_url = uri_match.group(1)
-                        parsed = urllib.parse.urlparse(key_url)
-                        original_key_name = os.path.basename(parsed.path)
-                        new_key_name = f"{original_key_name}.key"
-                        key_path = os.path.join(base_path, new_key_name)
-                        if self.download_key_file(key_url, key_path, tokenContent) and os.path.exists(key_path):
-                            new_line = line.replace(uri_match.group(0), f'URI="{new_key_name}"')
-                            modified_content.append(new_line)
-                        else:
-                            print(f"[AVISO] Não foi possível baixar ou salvar a chave: {key_url}")
-                            modified_content.append(line)
-                    else:
-                        modified_content.append(line)
-                elif line.strip() and not line.startswith('#'):
-                    segment_url = urllib.parse.urljoin(m3u8_url, line.strip())
-                    segment_filename = os.path.join(base_path, os.path.basename(segment_url))
-
-                    if self.download_file(segment_url, segment_filename, tokenContent):
-                        modified_content.append(os.path.basename(segment_filename))
-                    else:
-                        log_debug(f"[ERRO] Falha ao baixar segmento: {segment_url}")
-                        modified_content.append(line)
-                else:
-                    modified_content.append(line)
-
-            with open(m3u8_filename, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(modified_content))
-
-            return m3u8_filename
-        return None
+        with open(m3u8_filename, 'w', encoding='utf-8') as f:
+            f.write(hls.render_local(playlist, segment_names, key_names, init_names))
+        return m3u8_filename
 
     def convert_m3u8_to_mp4(self, input_file, output_file):
-        try:
-            if not os.path.exists(input_file):
-                raise FileNotFoundError(f"Arquivo não encontrado: {input_file}")
+        return convert_m3u8_to_mp4(input_file, output_file)
 
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    def clean_temp_files(self, base_path):
+        clean_temp_files(base_path)
 
-            try:
-                ffmpeg.input(input_file, allowed_extensions='ALL').output(
-                    output_file,
-                    vcodec='copy',
-                    acodec='copy',
-                    loglevel='error'
-                ).overwrite_output().run()
-                log_debug(f"Conversão rápida concluída: {output_file}")
-                return True
-            except ffmpeg.Error:
-                log_debug("[WARN] Conversão rápida falhou, tentando reencode...")
-
-                ffmpeg.input(input_file, allowed_extensions='ALL').output(
-                    output_file,
-                    vcodec='libx264',
-                    acodec='aac',
-                    preset='ultrafast',
-                    crf=23,
-                    loglevel='error'
-                ).overwrite_output().run()
-                log_debug(f"Reencode concluído: {output_file}")
-                return True
-        except Exception as e:
-            log_debug(f"[ERRO] Falha na conversão do vídeo: {e}")
-            return False
+def convert_m3u8_to_mp4(input_file, output_file):
+    import ffmpeg
+
+    part_file = f"{output_file}.part"
+    try:
+        if not os.path.exists(input_file):
+            raise FileNotFoundError(f"Arquivo não encontrado: {input_file}")
+
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-    def clean_temp_files(self, base_path):
         try:
-            shutil.rmtree(base_path)
-            log_debug(f"Pasta temporária removida: {base_path}")
-        except Exception as e:
-            log_debug(f"[ERRO] Falha ao remover arquivos temporários: {e}")
+            ffmpeg.input(input_file, allowed_extensions='ALL').output(
+                part_file,
+                format='mp4',
+                vcodec='copy',
+                acodec='copy',
+                loglevel='error'
+            ).overwrite_output().run()
+            os.replace(part_file, output_file)
+            log_debug("Conversão rápida concluída: %s", output_file)
+            return True
+        except ffmpeg.Error:
+            log_debug("[WARN] Conversão rápida falhou, tentando reencode...")
+
+            ffmpeg.input(input_file, allowed_extensions='ALL').output(
+                part_file,
+                format='mp4',
+                vcodec='libx264',
+                acodec='aac',
+                preset='ultrafast',
+                crf=23,
+                loglevel='error'
+            ).overwrite_output().run()
+            os.replace(part_file, output_file)
+            log_debug("Reencode concluído: %s", output_file)
+            return True
+    except Exception as e:
+        log_debug(f"[ERRO] Falha na conversão do vídeo: {e}")
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        return False
+
+def clean_temp_files(base_path):
+    try:
+        shutil.rmtree(base_path)
+        log_debug("Pasta temporária removida: %s", base_path)
+    except Exception as e:
+        log_debug(f"[ERRO] Falha ao remover arquivos temporários: {e}")
+
+def convert_and_clean(input_file, output_file, base_path):
+    # Executado nos processos do ConversionPool; precisa ser uma função de módulo
+    try:
+        return convert_m3u8_to_mp4(input_file, output_file)
+    finally:
+        clean_temp_files(base_path)
+
+def relay_result(source, target):
+    try:
+        result = source.result()
+    except BaseException as e:
+        target.set_exception(e)
+    else:
+        target.set_result(result)
+
+class ConversionPool:
+    def __init__(self, workers=None, queue_size=None):
+        workers = workers or CONVERSION_WORKERS
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        # Os callbacks de quem recebe o Future (registro no store, com o hash do MP4 inteiro,
+        # e no manifesto) rodam nestas threads, e não na thread que gerencia o pool de
+        # processos, que ficaria sem despachar as outras conversões enquanto isso
+        self.finishers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="conversoes")
+        # Cada conversão na fila mantém uma pasta _temp com todos os segmentos em disco. Com a
+        # fila cheia, o worker de vídeo espera aqui em vez de baixar o próximo vídeo.
+        self.semaphore = threading.BoundedSemaphore(queue_size or CONVERSION_QUEUE or workers * 2)
+
+    def submit(self, input_file, output_file, base_path):
+        log_debug("Conversão enfileirada: %s", output_file)
+        self.semaphore.acquire()
+        try:
+            converted = self.executor.submit(convert_and_clean, input_file, output_file, base_path)
+        except Exception:
+            self.semaphore.release()
+            raise
+        converted.add_done_callback(lambda _: self.semaphore.release())
+        if metrics.ENABLED:
+            # A conversão roda em outro processo; o tempo é medido daqui, incluindo a fila
+            started = time.perf_counter()
+            converted.add_done_callback(lambda _: metrics.observe("remux", time.perf_counter() - started))
+        future = Future()
+        future.set_running_or_notify_cancel()
+        converted.add_done_callback(lambda done: self.finishers.submit(relay_result, done, future))
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+        self.finishers.shutdown(wait=wait)
+
+class ConversionTracker:
+    # Visão de um ConversionPool compartilhado restrita às conversões de um perfil. O Future
+    # devolvido só termina depois dos callbacks de quem o recebeu (que registram o resultado
+    # no manifesto e no progresso), e wait() espera até lá.
+    def __init__(self, pool):
+        self.pool = pool
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def submit(self, input_file, output_file, base_path):
+        inner = self.pool.submit(input_file, output_file, base_path)
+        outer = Future()
+        outer.set_running_or_notify_cancel()
+        with self.condition:
+            self.pending += 1
+        inner.add_done_callback(lambda future: self.relay(future, outer))
+        return outer
+
+    def relay(self, inner, outer):
+        try:
+            relay_result(inner, outer)
+        finally:
+            with self.condition:
+                self.pending -= 1
+                self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+
+def load_video_playlist(media_downloader, file, token_content):
+    with metrics.timer("master_playlist"):
+        m3u8_content = media_downloader.fetch_text(file["url"], token_content)
+    if m3u8_content is None:
+        log_debug(f"[ERRO] Falha ao baixar o M3U8 para o vídeo {file['mediaId']}")
+        return None
+    if not hls.is_master(m3u8_content):
+        return hls.parse_media(file["url"], m3u8_content)
+    best_quality_url = media_downloader.get_best_quality_m3u8(file["url"], m3u8_content)
+    if not best_quality_url:
+        return None
+    return media_downloader.fetch_playlist(best_quality_url, token_content)
 
-def download_and_process_video(scraper, media_downloader, profile_name, file, token_content, output_filename=None):
+def download_and_process_video(scraper, media_downloader, profile_name, file, token_content, output_filename=None, refresh_token=None, conversion_pool=None, stream=None, playlist=None):
     base_path = os.path.join(DOWNLOAD_DIR, profile_name, "videos", f"{file['mediaId']}_temp")
 
     if output_filename is None:
         output_filename = os.path.join(DOWNLOAD_DIR, profile_name, "videos", f"{file['mediaId']}.mp4")
 
     if ".mp4" in file["url"].lower():
-        success = scraper.download_video_mp4_direct(file["url"], output_filename, token_content)
+        with metrics.timer("video_mp4"):
+            success = scraper.download_video_mp4_direct(file["url"], output_filename, token_content)
         return success
 
+    # A playlist de mídia é lida uma vez e serve tanto ao streaming quanto à pasta temporária
+    if playlist is None:
+        playlist = load_video_playlist(media_downloader, file, token_content)
+        if playlist is None:
+            return False
+
+    if STREAM_REMUX if stream is None else stream:
+        with metrics.timer("stream_remux"):
+            streamed = stream_hls_to_mp4(media_downloader, playlist, output_filename, token_content, refresh_token)
+        if streamed:
+            return True
+
+    # Fallback: segmentos e chaves em disco e conversão da playlist reescrita
+    success = False
     os.makedirs(base_path, exist_ok=True)
-    main_m3u8_filename = os.path.join(base_path, "main.m3u8")
-
-    if media_downloader.download_file(file["url"], main_m3u8_filename, token_content):
-        with open(main_m3u8_filename, 'rb') as f:
-            raw_data = f.read()
-        encoding = chardet.detect(raw_data)['encoding']
-        with open(main_m3u8_filename, 'r', encoding=encoding, errors='replace') as f:
-            m3u8_content = f.read()
-
-        best_quality_url = media_downloader.get_best_quality_m3u8(file["url"], m3u8_content)
-        if best_quality_url:
-            best_m3u8_filename = media_downloader.process_m3u8(best_quality_url, base_path, token_content)
-            if best_m3u8_filename and os.path.exists(best_m3u8_filename):
-                success = media_downloader.convert_m3u8_to_mp4(best_m3u8_filename, output_filename)
-                if not success:
-                    log_debug(f"[ERRO] Falha na conversão para vídeo {file['mediaId']}")
-    else:
-        log_debug(f"[ERRO] Falha ao baixar o M3U8 para o vídeo {file['mediaId']}")
+    best_m3u8_filename = media_downloader.process_m3u8(playlist, base_path, token_content, refresh_token)
+    if best_m3u8_filename and os.path.exists(best_m3u8_filename):
+        if conversion_pool:
+            # Devolve um Future: a conversão (e a limpeza da pasta) seguem em outro processo
+            return conversion_pool.submit(best_m3u8_filename, output_filename, base_path)
+        with metrics.timer("remux"):
+            success = media_downloader.convert_m3u8_to_mp4(best_m3u8_filename, output_filename)
+        if not success:
+            log_debug(f"[ERRO] Falha na conversão para vídeo {file['mediaId']}")
 
     media_downloader.clean_temp_files(base_path)
+    return success
 
-def process_posts(scraper, media_downloader, selected_profile_name, media_type):
-    from tqdm import tqdm
-    total, total_photos, total_videos = scraper.get_total_media_count(selected_profile_name)
-    print(f"Total de mídias: {total} (Fotos: {total_photos}, Vídeos: {total_videos})")
+def parse_post_date(post_date_raw):
+    try:
+        return datetime.strptime(post_date_raw, "%d/%m/%Y %H:%M:%S")
+    except Exception as e:
+        log_debug(f"[AVISO] Não foi possível interpretar a data '{post_date_raw}': {e}")
+        return None
 
-    os.makedirs(f"{DOWNLOAD_DIR}/{selected_profile_name}/fotos", exist_ok=True)
-    os.makedirs(f"{DOWNLOAD_DIR}/{selected_profile_name}/videos", exist_ok=True)
+def format_post_date(post_date):
+    return post_date.strftime("%Y-%m-%d_%H-%M-%S") if post_date else "unknown-date"
+
+def page_is_older_than(items, high_water_mark):
+    dates = [parse_post_date(item.get("postDate")) for item in items]
+    if not dates or None in dates:
+        return False
+    return all(d.strftime(HIGH_WATER_MARK_FORMAT) <= high_water_mark for d in dates)
 
-    downloaded_count = 0
-    progress_total = {
-        "1": total_photos,
-        "2": total_videos,
-        "3": total
-    }.get(media_type, total)
+class BoundedExecutor:
+    def __init__(self, max_workers, queue_size=None, name="pool"):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.semaphore = threading.BoundedSemaphore(queue_size or max_workers * 2)
+        self.gauge = f"queue_{name}"
 
-    skip = 0
-    with tqdm(total=progress_total, desc=f"Baixando mídias de {selected_profile_name}", unit="mídia") as pbar:
+    def submit(self, fn, *args, **kwargs):
+        self.semaphore.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.semaphore.release()
+            raise
+        metrics.gauge_add(self.gauge, 1)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        metrics.gauge_add(self.gauge, -1)
+        self.semaphore.release()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+class PageFetcher:
+    # Busca as páginas de posts numa thread própria, à frente dos downloads. A listagem
+    # termina na primeira página incompleta, sem depender do total (que pode vir do cache).
+    def __init__(self, scraper, profile_name, high_water_mark=None, prefetch=None):
+        self.scraper = scraper
+        self.profile_name = profile_name
+        self.high_water_mark = high_water_mark
+        self.queue = queue.Queue(maxsize=prefetch or PAGE_PREFETCH)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"pages-{profile_name}", daemon=True)
+
+    def run(self):
+        skip = 0
+        try:
+            while not self.stop_event.is_set():
+                with metrics.timer("listing"):
+                    posts = self.scraper.get_posts(self.profile_name, skip=skip)
+                items = posts.get("mosaicItems")
+                if not items:
+                    break
+                if self.high_water_mark and page_is_older_than(items, self.high_water_mark):
+                    log_debug(f"[INCREMENTAL] Página skip={skip} já sincronizada, encerrando listagem")
+                    break
+                self.put((skip, items))
+                skip += PAGE_SIZE
+                if len(items) < PAGE_SIZE:
+                    break
+        except Exception as e:
+            log_debug(f"[ERRO] Falha ao listar posts de {self.profile_name} (skip={skip}): {e}")
+            self.put(e)
+        finally:
+            self.put(None)
+
+    def put(self, value):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(value, timeout=0.5)
+                if isinstance(value, tuple):
+                    metrics.gauge_add("queue_pages", 1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        self.thread.start()
         while True:
-            posts = scraper.get_posts(selected_profile_name, skip=skip)
-            if not posts.get("mosaicItems"):
-                break
-
-            for item in posts["mosaicItems"]:
-                post_date_raw = item.get("postDate")
-                try:
-                    post_date = datetime.strptime(post_date_raw, "%d/%m/%Y %H:%M:%S")
-                    formatted_date = post_date.strftime("%Y-%m-%d_%H-%M-%S")
-                except Exception as e:
-                    log_debug(f"[AVISO] Não foi possível interpretar a data '{post_date_raw}': {e}")
-                    formatted_date = "unknown-date"
-
-                for file in item.get("files", []):
-                    if not file["isLocked"]:
-                        file_type = file["type"]
-                        file_url = file["url"]
-                        media_id = file["mediaId"]
-
-                        if file_type == "image" and media_type in ["1", "3"]:
-                            filename = f"{DOWNLOAD_DIR}/{selected_profile_name}/fotos/{formatted_date}_{media_id}.jpg"
-                            if not os.path.exists(filename):
-                                scraper.download_image_safe(file_url, filename)
-                                if os.path.exists(filename):
-                                    downloaded_count += 1
-                            pbar.update(1)
-
-                        elif file_type == "video" and media_type in ["2", "3"]:
-                            output_filename = f"{DOWNLOAD_DIR}/{selected_profile_name}/videos/{formatted_date}_{media_id}.mp4"
-                            temp_path = f"{DOWNLOAD_DIR}/{selected_profile_name}/videos/{media_id}_temp"
-
-                            if os.path.exists(temp_path):
-                                try:
-                                    shutil.rmtree(temp_path)
-                                    log_debug(f"[INFO] Pasta temporária removida: {temp_path}")
-                                except Exception as e:
-                                    log_debug(f"[ERRO] Não foi possível remover pasta temporária {temp_path}: {e}")
-
-                            if not os.path.exists(output_filename):
-                                file_id = file_url.split("/hls/")[0].split("/")[-1]
-                                payload = {'exp': 3600, 'file_id': file_id}
-                                token_url = "https://service.privacy.com.br/media/video/token"
-                                headers = {
-                                    "Content-Type": "application/json",
-                                    "referer": "https://privacy.com.br/",
-                                    "origin": "https://privacy.com.br",
-                                    "priority": "u=1, i",
-                                    "accept": "*/*",
-                                    "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
-                                    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
-                                    "sec-fetch-dest": "empty",
-                                    "sec-fetch-mode": "cors",
-                                    "sec-fetch-site": "same-site",
-                                    "sec-ch-ua": '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
-                                    "sec-ch-ua-mobile": "?0",
-                                    "sec-ch-ua-platform": '"Windows"',
-                                    "Authorization": f"Bearer {scraper.token_v2}"
-                                }
-
-                                payload_json = json.dumps(payload)
-                                headers_json = json.dumps(headers)
-
-                                token_response = scraper.page.evaluate(f'''
-                                    async () => {{
-                                        const response = await fetch("{token_url}", {{
-                                            method: "POST",
-                                            headers: {headers_json},
-                                            body: JSON.stringify({payload_json})
-                                        }});
-                                        return await response.text();
-                                    }}
-                                ''')
-
-                                try:
-                                    token_content = json.loads(token_response).get("content")
-                                    if token_content:
-                                        before = os.path.exists(output_filename)
-                                        success = download_and_process_video(scraper, media_downloader, selected_profile_name, file, token_content, output_filename=output_filename)
-                                        after = os.path.exists(output_filename)
-                                        if not before and after and success:
-                                            downloaded_count += 1
-                                except Exception as e:
-                                    log_debug(f"[ERRO] Falha ao extrair token de vídeo ({file['mediaId']}): {e}")
-                                    log_debug(f"Resposta: {token_response}")
-                            pbar.update(1)
-
-            skip += 50
-            if skip >= total:
-                break
-
-    print(f"\n[RESUMO] Total de arquivos novos baixados: {downloaded_count}/{progress_total}")
+            value = self.queue.get()
+            if value is None:
+                return
+            if isinstance(value, Exception):
+                raise value
+            metrics.gauge_add("queue_pages", -1)
+            yield value
+
+    def stop(self):
+        self.stop_event.set()
+
+class DownloadProgress:
+    def __init__(self, pbar):
+        self.pbar = pbar
+        self.downloaded_count = 0
+        self.failed_count = 0
+        self.lock = threading.Lock()
+
+    def advance(self, downloaded=False, failed=False):
+        with self.lock:
+            if downloaded:
+                self.downloaded_count += 1
+            if failed:
+                self.failed_count += 1
+            self.pbar.update(1)
+
+def download_image_task(scraper, manifest, profile_name, media_id, file_url, filename, progress):
+    downloaded = False
+    try:
+        with metrics.timer("image"):
+            scraper.download_image_safe(file_url, filename)
+        downloaded = os.path.exists(filename)
+    except Exception as e:
+        log_debug(f"[ERRO] Falha ao baixar imagem {filename}: {e}")
+    finally:
+        record_result(manifest, media_id, profile_name, "image", filename, downloaded)
+        progress.advance(downloaded, failed=not downloaded)
+
+def download_video_task(scraper, media_downloader, manifest, token_cache, profile_name, file, output_filename, progress, conversion_pool=None):
+    file_id = video_file_id(file["url"])
+
+    def finish(success):
+        downloaded = bool(success) and os.path.exists(output_filename)
+        if downloaded:
+            try:
+                store_output(output_filename)
+            except Exception as e:
+                log_debug(f"[DEDUP] Falha ao registrar {output_filename} no store: {e}")
+        if not downloaded:
+            token_cache.invalidate(file_id)
+        record_result(manifest, file["mediaId"], profile_name, "video", output_filename, downloaded)
+        progress.advance(downloaded, failed=not downloaded)
+
+    def finish_conversion(future):
+        try:
+            finish(future.result())
+        except Exception as e:
+            log_debug(f"[ERRO] Falha na conversão do vídeo {file['mediaId']}: {e}")
+            finish(False)
+
+    success = False
+    try:
+        token_content = token_cache.get(file_id)
+        if not token_content:
+            log_debug(f"[ERRO] Falha ao extrair token de vídeo ({file['mediaId']})")
+            return
+
+        temp_path = f"{DOWNLOAD_DIR}/{profile_name}/videos/{file['mediaId']}_temp"
+        if os.path.exists(temp_path):
+            try:
+                shutil.rmtree(temp_path)
+                log_debug(f"[INFO] Pasta temporária removida: {temp_path}")
+            except Exception as e:
+                log_debug(f"[ERRO] Não foi possível remover pasta temporária {temp_path}: {e}")
+
+        success = download_and_process_video(
+            scraper, media_downloader, profile_name, file, token_content,
+            output_filename=output_filename, refresh_token=lambda: token_cache.refresh(file_id),
+            conversion_pool=conversion_pool
+        )
+    except Exception as e:
+        log_debug(f"[ERRO] Falha ao baixar vídeo {file['mediaId']}: {e}")
+        success = False
+    finally:
+        if isinstance(success, Future):
+            # O worker fica livre para o próximo vídeo enquanto a conversão roda
+            success.add_done_callback(finish_conversion)
+        else:
+            finish(success)
+
+def store_output(filename):
+    # Vídeos gerados pelo ffmpeg entram no store depois de prontos; downloads diretos já
+    # passaram por ele durante a transferência.
+    store = get_content_store()
+    if not store:
+        return True
+    return store.linked_checksum(filename) or store.adopt(filename)
+
+def record_result(manifest, media_id, profile_name, file_type, filename, downloaded):
+    try:
+        if downloaded:
+            store = get_content_store()
+            checksum = store.linked_checksum(filename) if store else None
+            manifest.mark_downloaded(media_id, profile_name, file_type, filename, checksum=checksum)
+        else:
+            manifest.mark_failed(media_id, profile_name, file_type, filename)
+    except Exception as e:
+        log_debug(f"[ERRO] Falha ao atualizar manifesto para {media_id}: {e}")
+
+def skip_known_media(manifest, progress, media_id, profile_name, file_type, filename):
+    if manifest.is_downloaded(media_id):
+        progress.advance()
+        return True
+    if os.path.exists(filename):
+        # Arquivo baixado antes do manifesto existir: registra sem recalcular o checksum
+        manifest.mark_downloaded(media_id, profile_name, file_type, filename, compute_checksum=False)
+        progress.advance()
+        return True
+    manifest.mark_pending(media_id, profile_name, file_type, filename)
+    return False
+
+def media_filename(profile_name, file_type, formatted_date, media_id):
+    folder, extension = ("fotos", "jpg") if file_type == "image" else ("videos", "mp4")
+    return f"{DOWNLOAD_DIR}/{profile_name}/{folder}/{formatted_date}_{media_id}.{extension}"
+
+def media_type_total(media_type, counts):
+    total, total_photos, total_videos = counts
+    return {"1": total_photos, "2": total_videos, "3": total}.get(media_type, total)
+
+def load_media_counts(scraper, profile_name):
+    # Com contagens em cache a listagem começa na hora e a página do perfil é relida numa
+    # thread à parte; sem cache, a primeira leitura bloqueia como antes.
+    counts = scraper.cached_media_count(profile_name)
+    if counts is None:
+        return scraper.get_total_media_count(profile_name), None
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"counts-{profile_name}")
+    refresh = executor.submit(scraper.get_total_media_count, profile_name)
+    executor.shutdown(wait=False)
+    return counts, refresh
+
+def apply_refreshed_counts(pbar, media_type, refresh):
+    try:
+        counts = refresh.result()
+    except Exception as e:
+        log_debug(f"[AVISO] Falha ao atualizar contagens em segundo plano: {e}")
+        return
+    total = media_type_total(media_type, counts)
+    if total != pbar.total:
+        pbar.total = total
+        pbar.refresh()
+
+def open_manifest():
+    return DownloadManifest(os.path.join(DOWNLOAD_DIR, MANIFEST_FILENAME))
+
+def process_posts(scraper, media_downloader, selected_profile_name, media_type, image_pool=None, video_pool=None, manifest=None, incremental=None, token_cache=None, conversion_pool=None, position=None):
+    counts, refresh = load_media_counts(scraper, selected_profile_name)
+    total, total_photos, total_videos = counts
+    origin = " (cache, atualizando)" if refresh else ""
+    tqdm.write(f"[{selected_profile_name}] Total de mídias: {total} (Fotos: {total_photos}, Vídeos: {total_videos}){origin}")
+
+    os.makedirs(f"{DOWNLOAD_DIR}/{selected_profile_name}/fotos", exist_ok=True)
+    os.makedirs(f"{DOWNLOAD_DIR}/{selected_profile_name}/videos", exist_ok=True)
+
+    progress_total = media_type_total(media_type, counts)
+
+    owns_manifest = manifest is None
+    if owns_manifest:
+        manifest = open_manifest()
+
+    try:
+        if incremental is None:
+            incremental = SYNC_MODE == "incremental"
+        high_water_mark = manifest.get_high_water_mark(selected_profile_name, media_type) if incremental else None
+        if high_water_mark:
+            tqdm.write(f"[{selected_profile_name}] [INCREMENTAL] Buscando apenas posts posteriores a {high_water_mark}")
+        newest_post_date = None
+
+        owns_token_cache = token_cache is None
+        if owns_token_cache:
+            token_cache = VideoTokenCache(scraper)
+
+        owns_conversion_pool = conversion_pool is None
+        if owns_conversion_pool:
+            conversion_pool = ConversionPool()
+        conversions = ConversionTracker(conversion_pool)
+
+        # Pools compartilhados entre perfis são recebidos prontos; shutdown neles só aguarda
+        # as tarefas deste perfil.
+        image_pool = image_pool or BoundedExecutor(IMAGE_WORKERS, name="images")
+        video_pool = video_pool or BoundedExecutor(VIDEO_WORKERS, name="videos")
+
+        pages = PageFetcher(scraper, selected_profile_name, high_water_mark)
+        with tqdm(total=progress_total, desc=f"Baixando mídias de {selected_profile_name}", unit="mídia", position=position) as pbar:
+            progress = DownloadProgress(pbar)
+            if refresh:
+                refresh.add_done_callback(lambda future: apply_refreshed_counts(pbar, media_type, future))
+            try:
+                for skip, items in pages:
+                    for item in items:
+                        post_date = parse_post_date(item.get("postDate"))
+                        formatted_date = format_post_date(post_date)
+                        if post_date and (newest_post_date is None or post_date > newest_post_date):
+                            newest_post_date = post_date
+
+                        for file in item.get("files", []):
+                            if file["isLocked"]:
+                                continue
+
+                            file_type = file["type"]
+                            file_url = file["url"]
+                            media_id = file["mediaId"]
+
+                            if file_type == "image" and media_type in ["1", "3"]:
+                                filename = media_filename(selected_profile_name, file_type, formatted_date, media_id)
+                                if skip_known_media(manifest, progress, media_id, selected_profile_name, file_type, filename):
+                                    continue
+
+                                image_pool.submit(download_image_task, scraper, manifest, selected_profile_name, media_id, file_url, filename, progress)
+
+                            elif file_type == "video" and media_type in ["2", "3"]:
+                                output_filename = media_filename(selected_profile_name, file_type, formatted_date, media_id)
+                                if skip_known_media(manifest, progress, media_id, selected_profile_name, file_type, output_filename):
+                                    continue
+
+                                # A fila de vídeos é limitada, então o prefetch cobre só os próximos da fila
+                                token_cache.prefetch([video_file_id(file_url)])
+                                video_pool.submit(download_video_task, scraper, media_downloader, manifest, token_cache, selected_profile_name, file, output_filename, progress, conversions)
+            finally:
+                pages.stop()
+                image_pool.shutdown(wait=True)
+                video_pool.shutdown(wait=True)
+                # O download_video_task termina ao enfileirar a conversão; a barra, a marca
+                # incremental e o resumo dependem do resultado dela
+                conversions.wait()
+                if owns_conversion_pool:
+                    conversion_pool.shutdown(wait=True)
+                if owns_token_cache:
+                    token_cache.close()
+                if refresh:
+                    wait_all([refresh])
+                    apply_refreshed_counts(pbar, media_type, refresh)
+            progress_total = pbar.total
+
+        # Só avança a marca quando nada falhou, para que a próxima execução incremental
+        # ainda alcance os itens que precisam ser baixados de novo.
+        if newest_post_date and progress.failed_count == 0:
+            mark = newest_post_date.strftime(HIGH_WATER_MARK_FORMAT)
+            if not high_water_mark or mark > high_water_mark:
+                manifest.set_high_water_mark(selected_profile_name, media_type, mark)
+    finally:
+        if owns_manifest:
+            manifest.close()
+
+    tqdm.write(f"[RESUMO] {selected_profile_name}: {progress.downloaded_count}/{progress_total} arquivos novos baixados, {progress.failed_count} falhas")
+    return {
+        "profile": selected_profile_name,
+        "total": progress_total,
+        "downloaded": progress.downloaded_count,
+        "failed": progress.failed_count,
+    }
@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+METRICS = os.getenv("METRICS", "False").lower() == "true"
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10"))
+METRICS_PREFIX = "privacy"
+# Limites dos buckets em segundos, no estilo Prometheus
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Com as métricas desligadas, timer() devolve sempre o mesmo contexto vazio e as demais
+# funções retornam na primeira linha; os chamadores não precisam checar nada.
+ENABLED = METRICS or bool(METRICS_FILE)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Estimativa pelo limite superior do bucket, como histogram_quantile
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5) or 0, 6),
+            "p95": round(self.quantile(0.95) or 0, 6),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.counts)),
+        }
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.gauge_peaks = {}
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge_add(self, name, delta):
+        with self.lock:
+            value = self.gauges.get(name, 0) + delta
+            self.gauges[name] = value
+            if value > self.gauge_peaks.get(name, 0):
+                self.gauge_peaks[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_s": round(time.time() - self.started_at, 3),
+                "phases": {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(sorted(self.gauges.items())),
+                "gauge_peaks": dict(sorted(self.gauge_peaks.items())),
+            }
+
+registry = Registry()
+NULL_TIMER = nullcontext()
+
+class Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            registry.inc(f"{self.name}_errors")
+        return False
+
+def timer(name):
+    return Timer(name) if ENABLED else NULL_TIMER
+
+def observe(name, seconds):
+    if ENABLED:
+        registry.observe(name, seconds)
+
+def inc(name, value=1):
+    if ENABLED:
+        registry.inc(name, value)
+
+def gauge_add(name, delta):
+    if ENABLED:
+        registry.gauge_add(name, delta)
+
+def snapshot():
+    return registry.snapshot()
+
+def render_prometheus(snap):
+    lines = []
+    metric = f"{METRICS_PREFIX}_phase_seconds"
+    lines.append(f"# TYPE {metric} histogram")
+    for phase, h in snap["phases"].items():
+        cumulative = 0
+        for bound, count in h["buckets"].items():
+            cumulative += count
+            lines.append(f'{metric}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{phase="{phase}"}} {h["sum"]}')
+        lines.append(f'{metric}_count{{phase="{phase}"}} {h["count"]}')
+    for name, value in snap["counters"].items():
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+        lines.append(f"{METRICS_PREFIX}_{name}_total {value}")
+    for name, value in snap["gauges"].items():
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+        lines.append(f"{METRICS_PREFIX}_{name} {value}")
+        lines.append(f"{METRICS_PREFIX}_{name}_peak {snap['gauge_peaks'].get(name, value)}")
+    return "\n".join(lines) + "\n"
+
+def write_snapshot(path):
+    snap = snapshot()
+    if path.endswith(".prom"):
+        data = render_prometheus(snap)
+    else:
+        data = json.dumps(snap, indent=2)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp = f"{path}.tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(temp, path)
+
+def format_summary(snap=None):
+    snap = snap or snapshot()
+    lines = [f"[MÉTRICAS] Duração: {snap['uptime_s']:.1f}s"]
+    for phase, h in snap["phases"].items():
+        mean = h["sum"] / h["count"] if h["count"] else 0
+        lines.append(f"  {phase:<16} n={h['count']:<6} média={mean:.3f}s p50≤{h['p50']:.3f}s p95≤{h['p95']:.3f}s máx={h['max']:.3f}s")
+    counters = snap["counters"]
+    if "bytes" in counters:
+        mb = counters["bytes"] / (1024 * 1024)
+        lines.append(f"  transferido     {mb:.1f} MB ({mb / snap['uptime_s']:.2f} MB/s)" if snap["uptime_s"] else f"  transferido     {mb:.1f} MB")
+    for name, value in counters.items():
+        if name != "bytes":
+            lines.append(f"  {name:<16} {value}")
+    for name, peak in snap["gauge_peaks"].items():
+        lines.append(f"  {name:<16} pico={peak}")
+    return "\n".join(lines)
+
+class Exporter:
+    def __init__(self, path, interval=None):
+        self.path = path
+        self.interval = interval or METRICS_INTERVAL
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-exporter", daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                write_snapshot(self.path)
+            except OSError:
+                pass
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        write_snapshot(self.path)
+
+def start_exporter():
+    # Só exporta periodicamente se METRICS_FILE foi definido (.prom = texto Prometheus, senão JSON)
+    if not ENABLED or not METRICS_FILE:
+        return None
+    return Exporter(METRICS_FILE).start()
+
+def finish(exporter=None):
+    if not ENABLED:
+        return None
+    if exporter:
+        exporter.stop()
+    return format_summary()
@@ -0,0 +1,143 @@
+import os
+import random
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import requests
+from source import metrics
+from source.log import log_debug
+
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+HOST_CONCURRENCY = int(os.getenv("HOST_CONCURRENCY", "16"))
+# Sem timeout uma conexão parada prende a thread para sempre; o de leitura vale para cada
+# leitura do socket, então também corta um corpo que parou no meio
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", "30"))
+READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", "60"))
+
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+THROTTLE_STATUS = (429, 503)
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+class AdaptiveLimiter:
+    # Limite de requisições simultâneas por host em AIMD: cresce devagar a cada resposta
+    # boa e cai pela metade quando o servidor responde 429/503 ou a conexão cai.
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self):
+        # Versão sem espera, para o motor async, que aguarda a vaga no próprio loop
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def on_success(self):
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def on_throttle(self):
+        with self.condition:
+            self.limit = max(self.minimum, self.limit / 2)
+            log_debug(f"[REDE] Servidor pediu recuo, limite de concorrência reduzido para {int(self.limit)}")
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+def limiter_for(url):
+    host = urllib.parse.urlparse(url).netloc
+    with limiters_lock:
+        if host not in limiters:
+            limiters[host] = AdaptiveLimiter(HOST_CONCURRENCY)
+        return limiters[host]
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+def retry_delay(attempt, response=None):
+    if response is not None and response.status_code in THROTTLE_STATUS:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, RETRY_MAX_DELAY)
+    # Backoff exponencial com "full jitter"
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+def send(session, method, url, attempts=None, **kwargs):
+    # Faz a requisição com retentativas e devolve (resposta, limiter) com a vaga do host
+    # ainda ocupada; quem chama libera com limiter.release() depois de ler o corpo.
+    attempts = attempts or RETRY_ATTEMPTS
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    limiter = limiter_for(url)
+    for attempt in range(1, attempts + 1):
+        limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            limiter.release()
+            limiter.on_throttle()
+            if attempt == attempts:
+                raise
+            delay = retry_delay(attempt)
+            metrics.inc("retries")
+            log_debug("[REDE] %s em %s, tentativa %d/%d, aguardando %.1fs", e.__class__.__name__, url, attempt, attempts, delay)
+            time.sleep(delay)
+            continue
+
+        if response.status_code in THROTTLE_STATUS:
+            metrics.inc("throttled")
+            limiter.on_throttle()
+        elif response.status_code < 500:
+            limiter.on_success()
+
+        if response.status_code in RETRY_STATUS and attempt < attempts:
+            delay = retry_delay(attempt, response)
+            metrics.inc("retries")
+            log_debug("[REDE] Status %d em %s, tentativa %d/%d, aguardando %.1fs", response.status_code, url, attempt, attempts, delay)
+            response.close()
+            limiter.release()
+            time.sleep(delay)
+            continue
+        return response, limiter
+
+def request(session, method, url, **kwargs):
+    response, limiter = send(session, method, url, **kwargs)
+    limiter.release()
+    return response
+
+@contextmanager
+def stream(session, url, **kwargs):
+    response, limiter = send(session, "GET", url, stream=True, **kwargs)
+    try:
+        yield response
+    finally:
+        response.close()
+        limiter.release()
@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import wait as wait_all
+from tqdm import tqdm
+from source import metrics
+from source.log import log_debug
+from source.media import IMAGE_WORKERS, VIDEO_WORKERS, ConversionPool, process_posts
+from source.tokens import VideoTokenCache
+
+PROFILE_WORKERS = int(os.getenv("PROFILE_WORKERS", "3"))
+
+class FairExecutor:
+    # Pool de threads com uma fila por chave (perfil), atendidas em rodízio: um perfil
+    # grande não consegue ocupar os workers enquanto outros perfis têm itens na fila.
+    def __init__(self, max_workers, name="fair"):
+        self.max_workers = max_workers
+        self.name = name
+        self.queues = OrderedDict()
+        self.condition = threading.Condition()
+        self.is_shutdown = False
+        self.threads = [
+            threading.Thread(target=self.worker, name=f"{name}-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, fn, *args, **kwargs):
+        future = Future()
+        with self.condition:
+            if self.is_shutdown:
+                raise RuntimeError("FairExecutor já foi encerrado")
+            self.queues.setdefault(key, deque()).append((future, fn, args, kwargs))
+            self.condition.notify()
+        metrics.gauge_add(f"queue_{self.name}", 1)
+        return future
+
+    def next_task(self):
+        with self.condition:
+            while not self.queues:
+                if self.is_shutdown:
+                    return None
+                self.condition.wait()
+            key, tasks = next(iter(self.queues.items()))
+            task = tasks.popleft()
+            if tasks:
+                self.queues.move_to_end(key)
+            else:
+                del self.queues[key]
+            return task
+
+    def worker(self):
+        while True:
+            task = self.next_task()
+            if task is None:
+                return
+            metrics.gauge_add(f"queue_{self.name}", -1)
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def for_key(self, key, queue_size=None):
+        return FairExecutorView(self, key, queue_size or self.max_workers * 2)
+
+    def shutdown(self, wait=True):
+        with self.condition:
+            self.is_shutdown = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+class FairExecutorView:
+    # Mesma interface do BoundedExecutor, restrita às tarefas de uma chave
+    def __init__(self, executor, key, queue_size):
+        self.executor = executor
+        self.key = key
+        self.semaphore = threading.BoundedSemaphore(queue_size)
+        self.futures = set()
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        self.semaphore.acquire()
+        try:
+            future = self.executor.submit(self.key, fn, *args, **kwargs)
+        except Exception:
+            self.semaphore.release()
+            raise
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.futures.discard(future)
+        self.semaphore.release()
+
+    def shutdown(self, wait=True):
+        if wait:
+            with self.lock:
+                pending = list(self.futures)
+            wait_all(pending)
+
+def process_profiles(scraper, media_downloader, profiles, media_type, manifest, incremental=None, profile_workers=None):
+    image_pool = FairExecutor(IMAGE_WORKERS, "images")
+    video_pool = FairExecutor(VIDEO_WORKERS, "videos")
+    token_cache = VideoTokenCache(scraper)
+    conversion_pool = ConversionPool()
+    workers = max(1, min(profile_workers or PROFILE_WORKERS, len(profiles)))
+    # Cada perfil em andamento ocupa uma linha fixa de barra de progresso
+    positions = queue.Queue()
+    for position in range(workers):
+        positions.put(position)
+    results = []
+
+    def run_profile(profile):
+        position = positions.get()
+        try:
+            return process_posts(
+                scraper, media_downloader, profile, media_type,
+                image_pool=image_pool.for_key(profile), video_pool=video_pool.for_key(profile),
+                manifest=manifest, incremental=incremental, token_cache=token_cache,
+                conversion_pool=conversion_pool, position=position
+            )
+        finally:
+            positions.put(position)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_profile, profile): profile for profile in profiles}
+            for future in as_completed(futures):
+                profile = futures[future]
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    log_debug(f"[ERRO] Falha ao processar perfil {profile}: {e}")
+                    tqdm.write(f"[ERRO] Falha ao processar perfil {profile}: {e}")
+                    results.append({"profile": profile, "error": str(e)})
+    finally:
+        image_pool.shutdown(wait=True)
+        video_pool.shutdown(wait=True)
+        conversion_pool.shutdown(wait=True)
+        token_cache.close()
+
+    return results
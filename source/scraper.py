@@ -1,19 +1,22 @@
 import base64
-import re
+import codecs
 import os
 import platform
 import json
+import math
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from html.parser import HTMLParser
 import cloudscraper
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright
-from dotenv import load_dotenv
-import logging
-
-load_dotenv()
-
-DEBUG = os.getenv("DEBUG", "False").lower() == "true"
-LOG_FILE = "debug.log"
+from source import metrics, network
+from source.cache import clear_cache, load_cache, save_cache
+from source.dedup import get_content_store
+from source.download import download_to_file
+from source.images import TOO_LARGE_STATUS, image_variants
+from source.log import log_debug
 
 custom_headers = {
     "referer": "https://privacy.com.br/",
@@ -30,28 +33,124 @@ custom_headers = {
     "sec-ch-ua-platform": '"Windows"',
 }
 
-if DEBUG:
-    logging.basicConfig(filename=LOG_FILE, level=logging.DEBUG, format='[%(levelname)s] %(message)s')
+BASE_URL = os.getenv("PRIVACY_BASE_URL", "https://privacy.com.br").rstrip("/")
+SERVICE_URL = os.getenv("PRIVACY_SERVICE_URL", "https://service.privacy.com.br").rstrip("/")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HEADLESS = os.getenv("HEADLESS", "True").lower() == "true"
+SESSION_CACHE = "session"
+SESSION_EXPIRY_MARGIN = 300
+PAGE_LOAD_TIMEOUT = 30000
+PROFILES_CACHE = "profiles"
+PROFILES_CACHE_TTL = int(os.getenv("PROFILES_CACHE_TTL", "3600"))
+PROFILES_PAGE_SIZE = 30
+PROFILES_PAGE_WORKERS = 4
+MEDIA_COUNTS_CACHE = "media_counts"
+MEDIA_COUNTS_TTL = int(os.getenv("MEDIA_COUNTS_TTL", str(7 * 24 * 3600)))
+MEDIA_COUNTS_CHUNK_SIZE = 16 * 1024
+VIDEO_TOKEN_URL = f"{SERVICE_URL}/media/video/token"
 
-def log_debug(msg):
-    if DEBUG:
-        print(f"[DEBUG] {msg}")
-        logging.debug(msg)
+image_headers = {
+    "referer": "https://privacy.com.br/",
+    "origin": "https://privacy.com.br",
+    "priority": "u=1, i",
+    "accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
+    "sec-fetch-dest": "image",
+    "sec-fetch-mode": "no-cors",
+    "sec-fetch-site": "same-site",
+    "sec-ch-ua": '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+}
+
+def media_count_url(profile_name):
+    return f"{BASE_URL}/profile/{profile_name}/Mosaico"
+
+def posts_url(profile_name, skip=0):
+    unix_timestamp = int(time.time() * 1000)
+    return f"{BASE_URL}/Profile?handler=PartialPosts&skip={skip}&take=50&nomePerfil={profile_name}&filter=mosaico&_={unix_timestamp}"
+
+def parse_count(text):
+    return int(text.split()[0].replace('.', '').replace(',', '')) if text and text.strip() else 0
+
+class MediaCountParser(HTMLParser):
+    # Só acompanha os três links de filtro (total, fotos e vídeos); o resto da página é ignorado
+    def __init__(self, profile_name):
+        super().__init__()
+        self.hrefs = {f"/profile/{profile_name}/Fotos": "photos", f"/profile/{profile_name}/Videos": "videos"}
+        self.texts = {}
+        self.current = None
+
+    @property
+    def done(self):
+        return len(self.texts) == 3
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a" or self.current:
+            return
+        attrs = dict(attrs)
+        key = self.hrefs.get(attrs.get("href"))
+        if key is None and (attrs.get("class") or "").split() == ["filter-button", "selected"]:
+            key = "total"
+        if key and key not in self.texts:
+            self.current = key
+            self.texts[key] = ""
+
+    def handle_data(self, data):
+        if self.current:
+            self.texts[self.current] += data
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self.current = None
+
+def parse_media_counts(chunks, profile_name):
+    # Aceita o HTML inteiro ou pedaços dele; para de ler assim que os três contadores aparecem
+    parser = MediaCountParser(profile_name)
+    for chunk in [chunks] if isinstance(chunks, str) else chunks:
+        parser.feed(chunk)
+        if parser.done and not parser.current:
+            break
+    else:
+        parser.close()
+    total, photos, videos = (parse_count(parser.texts.get(key)) for key in ("total", "photos", "videos"))
+    log_debug(f"Contagens - Total: {total}, Fotos: {photos}, Vídeos: {videos}")
+    return total, photos, videos
 
-def strip_edits_from_image_url(image_url):
-    match = re.search(r"https:\/\/[^\/]+\/([^\/?]+)", image_url)
-    if not match:
-        return image_url
+def iter_text(response, chunk_size=MEDIA_COUNTS_CHUNK_SIZE):
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    for chunk in response.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
 
-    token = match.group(1)
-    padding = '=' * ((4 - len(token) % 4) % 4)
-    token_bytes = base64.urlsafe_b64decode(token + padding)
-    token_json = json.loads(token_bytes)
-    token_json['edits'] = {}
-    cleaned_token = base64.urlsafe_b64encode(json.dumps(token_json).encode()).decode().rstrip("=")
-    new_url = image_url.replace(token, cleaned_token)
-    return new_url
+class MediaCountCache:
+    # Contagens de mídia por perfil em disco, cada uma com o próprio horário, para que o
+    # download comece sem esperar a página do perfil
+    def __init__(self, ttl=None):
+        self.ttl = MEDIA_COUNTS_TTL if ttl is None else ttl
+        self.lock = threading.Lock()
+        self.entries = load_cache(MEDIA_COUNTS_CACHE) or {}
 
+    def get(self, profile_name):
+        entry = self.entries.get(profile_name)
+        if entry and time.time() - entry["saved_at"] <= self.ttl:
+            return tuple(entry["counts"])
+        return None
+
+    def put(self, profile_name, counts):
+        with self.lock:
+            self.entries[profile_name] = {"counts": list(counts), "saved_at": time.time()}
+            save_cache(MEDIA_COUNTS_CACHE, self.entries)
+
+def jwt_expiry(token):
+    try:
+        payload = token.split(".")[1]
+        padding = '=' * ((4 - len(payload) % 4) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload + padding)).get("exp")
+    except Exception:
+        return None
+
+@lru_cache(maxsize=None)
 def get_embedded_chromium_path():
     playwright_path = os.path.expanduser("~/.cache/ms-playwright") if os.name != 'nt' else os.path.join(os.environ['USERPROFILE'], 'AppData', 'Local', 'ms-playwright')
     if os.path.exists(playwright_path):
@@ -81,24 +180,87 @@ class PrivacyScraper:
         self.context = None
         self.page = None
         self.playwright = None
+        self.login_lock = threading.Lock()
+        self.media_counts = MediaCountCache()
         self.scraper = cloudscraper.create_scraper()
+        for adapter in self.scraper.adapters.values():
+            adapter.init_poolmanager(HTTP_POOL_SIZE, HTTP_POOL_SIZE)
         log_debug("PrivacyScraper instanciado")
 
     def login(self):
+        if self.restore_session():
+            return True
+        return self.browser_login()
+
+    def restore_session(self):
+        session = load_cache(SESSION_CACHE)
+        if not session:
+            return False
+        expires_at = session.get("expires_at")
+        if expires_at and expires_at - SESSION_EXPIRY_MARGIN < time.time():
+            log_debug("Sessão em cache expirada")
+            clear_cache(SESSION_CACHE)
+            return False
+
+        self.token_v1 = session.get("token_v1")
+        self.token_v2 = session.get("token_v2")
+        for cookie in session.get("cookies", []):
+            self.scraper.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+        if session.get("user_agent"):
+            self.scraper.headers["User-Agent"] = session["user_agent"]
+
+        url = f"{SERVICE_URL}/profile/UserFollowing?page=0&limit=1&nickName="
+        headers = {**custom_headers, "Authorization": f"Bearer {self.token_v2}"}
+        try:
+            response = network.request(self.scraper, "GET", url, headers=headers)
+            if response.status_code == 200:
+                log_debug("Sessão em cache reutilizada")
+                return True
+            log_debug(f"Sessão em cache recusada: status {response.status_code}")
+        except Exception as e:
+            log_debug(f"[ERRO] Falha ao validar sessão em cache: {e}")
+
+        clear_cache(SESSION_CACHE)
+        self.token_v1 = None
+        self.token_v2 = None
+        self.scraper.cookies.clear()
+        return False
+
+    def save_session(self, cookies):
+        expiries = [c["expires"] for c in cookies if c.get("expires", -1) > 0]
+        token_expiry = jwt_expiry(self.token_v2)
+        if token_expiry:
+            expiries.append(token_expiry)
+        save_cache(SESSION_CACHE, {
+            "token_v1": self.token_v1,
+            "token_v2": self.token_v2,
+            "cookies": cookies,
+            "user_agent": self.scraper.headers.get("User-Agent"),
+            "expires_at": min(expiries) if expiries else None,
+        }, private=True)
+        log_debug("Sessão salva em cache")
+
+    def browser_login(self):
+        # O Playwright só é importado quando o login precisa mesmo do navegador
+        from playwright.sync_api import sync_playwright
+
         log_debug("Iniciando login...")
         self.playwright = sync_playwright().start()
         path = get_embedded_chromium_path()
-        self.browser = self.playwright.chromium.launch(headless=False, executable_path=path)
-        self.context = self.browser.new_context()
+        self.browser = self.playwright.chromium.launch(headless=HEADLESS, executable_path=path)
+        self.context = self.browser.new_context(user_agent=custom_headers["user-agent"])
         self.page = self.context.new_page()
         log_debug("Navegador iniciado")
-        self.page.goto("https://privacy.com.br")
-        time.sleep(3)
+        self.page.goto(BASE_URL, wait_until="domcontentloaded", timeout=PAGE_LOAD_TIMEOUT)
+        try:
+            self.page.wait_for_load_state("networkidle", timeout=PAGE_LOAD_TIMEOUT)
+        except Exception as e:
+            log_debug(f"[AVISO] Página inicial não ficou ociosa a tempo: {e}")
         log_debug("Página inicial carregada")
 
         result = self.page.evaluate(f"""
             async () => {{
-                const response = await fetch("https://service.privacy.com.br/auth/login", {{
+                const response = await fetch("{SERVICE_URL}/auth/login", {{
                     method: "POST",
                     headers: {{ "Content-Type": "application/json" }},
                     body: JSON.stringify({{
@@ -121,22 +283,40 @@ class PrivacyScraper:
             log_debug("Tokens extraídos com sucesso")
         except Exception as e:
             log_debug(f"Erro ao extrair tokens: {str(e)}")
-            self.browser.close()
-            self.playwright.stop()
+            self.close_browser()
             return False
 
         if self.token_v1 and self.token_v2:
             log_debug("Login bem-sucedido")
             self.authorize_tokens()
+            self.export_browser_session()
+            self.close_browser()
             return True
         else:
             log_debug(f"Erro no login: tokens ausentes. {result}")
-            self.browser.close()
-            self.playwright.stop()
+            self.close_browser()
             return False
 
+    def export_browser_session(self):
+        # Depois do login, todas as chamadas seguem por HTTP direto com os cookies e o
+        # user-agent do navegador; o Playwright só volta a ser usado para renovar o login.
+        cookies = self.context.cookies()
+        for cookie in cookies:
+            self.scraper.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+        self.scraper.headers["User-Agent"] = self.page.evaluate("() => navigator.userAgent")
+        log_debug("Sessão do navegador exportada para o cliente HTTP")
+        self.save_session(cookies)
+
+    def refresh_login(self, expired_token):
+        with self.login_lock:
+            if self.token_v2 != expired_token:
+                return True
+            log_debug("Sessão expirada, refazendo login...")
+            clear_cache(SESSION_CACHE)
+            return self.browser_login()
+
     def authorize_tokens(self):
-        url = f"https://privacy.com.br/strangler/Authorize?TokenV1={self.token_v1}&TokenV2={self.token_v2}"
+        url = f"{BASE_URL}/strangler/Authorize?TokenV1={self.token_v1}&TokenV2={self.token_v2}"
         self.playwright_get(url)
         log_debug("Tokens autorizados")
 
@@ -157,96 +337,167 @@ class PrivacyScraper:
             }}
         """)
 
-    def get_profiles(self):
+    def api_request(self, method, url, extra_headers: dict = None, json_body=None):
+        token = self.token_v2
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Referer": "https://privacy.com.br/",
+            **(extra_headers or {})
+        }
+        log_debug("%s para: %s", method, url)
+        response = network.request(self.scraper, method, url, headers=headers, json=json_body)
+        if response.status_code in (401, 403) and self.refresh_login(token):
+            headers["Authorization"] = f"Bearer {self.token_v2}"
+            response = network.request(self.scraper, method, url, headers=headers, json=json_body)
+        return response.text
+
+    def api_get(self, url, extra_headers: dict = None):
+        return self.api_request("GET", url, extra_headers)
+
+    @contextmanager
+    def api_stream(self, url, extra_headers: dict = None):
+        # Como o api_get, mas entrega a resposta sem ler o corpo
+        token = self.token_v2
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Referer": "https://privacy.com.br/",
+            **(extra_headers or {})
+        }
+        log_debug("GET (stream) para: %s", url)
+        with network.stream(self.scraper, url, headers=headers) as response:
+            if response.status_code not in (401, 403) or not self.refresh_login(token):
+                yield response
+                return
+        headers["Authorization"] = f"Bearer {self.token_v2}"
+        with network.stream(self.scraper, url, headers=headers) as response:
+            yield response
+
+    def api_post(self, url, payload, extra_headers: dict = None):
+        return self.api_request("POST", url, extra_headers, json_body=payload)
+
+    def get_profiles_page(self, page):
+        url = f"{SERVICE_URL}/profile/UserFollowing?page={page}&limit={PROFILES_PAGE_SIZE}&nickName="
+        result = json.loads(self.api_get(url, custom_headers))
+        # A API devolve uma lista simples; se vier envelopada, usa o total informado
+        if isinstance(result, dict):
+            items = next((result[k] for k in ("data", "items", "profiles", "results") if isinstance(result.get(k), list)), [])
+            total = next((result[k] for k in ("total", "totalCount", "count") if isinstance(result.get(k), int)), None)
+        else:
+            items, total = result, None
+        return [p["profileName"] for p in items], total
+
+    def get_profiles(self, use_cache=True):
+        if use_cache:
+            cached = load_cache(PROFILES_CACHE, ttl=PROFILES_CACHE_TTL)
+            if cached and cached.get("email") == self.email:
+                log_debug(f"Perfis carregados do cache: {len(cached['profiles'])}")
+                return cached["profiles"]
+
         log_debug("Obtendo perfis...")
-        url = "https://service.privacy.com.br/profile/UserFollowing?page=0&limit=30&nickName="
-        result = self.playwright_get(url, custom_headers)
-        profiles = json.loads(result)
-        log_debug(f"Perfis obtidos: {[p['profileName'] for p in profiles]}")
-        return [profile["profileName"] for profile in profiles]
+        profiles, total = self.get_profiles_page(0)
+        if total is not None:
+            remaining = range(1, math.ceil(total / PROFILES_PAGE_SIZE))
+            with ThreadPoolExecutor(max_workers=PROFILES_PAGE_WORKERS) as executor:
+                for names, _ in executor.map(self.get_profiles_page, remaining):
+                    profiles.extend(names)
+        else:
+            # Sem total: busca lotes de páginas em paralelo até encontrar uma incompleta
+            page = 1
+            last_page_full = len(profiles) == PROFILES_PAGE_SIZE
+            with ThreadPoolExecutor(max_workers=PROFILES_PAGE_WORKERS) as executor:
+                while last_page_full:
+                    batch = range(page, page + PROFILES_PAGE_WORKERS)
+                    for names, _ in executor.map(self.get_profiles_page, batch):
+                        if not last_page_full:
+                            break
+                        profiles.extend(names)
+                        last_page_full = len(names) == PROFILES_PAGE_SIZE
+                    page += PROFILES_PAGE_WORKERS
+
+        profiles = list(dict.fromkeys(profiles))
+        log_debug(f"Perfis obtidos: {profiles}")
+        save_cache(PROFILES_CACHE, {"email": self.email, "profiles": profiles})
+        return profiles
 
     def get_total_media_count(self, profile_name):
         log_debug(f"Obtendo contagem de mídias para {profile_name}")
-        url = f"https://privacy.com.br/profile/{profile_name}/Mosaico"
-        result = self.playwright_get(url, custom_headers)
-        soup = BeautifulSoup(result, 'html.parser')
-        total_match = soup.find('a', class_='filter-button selected')
-        photos_match = soup.find('a', href=f"/profile/{profile_name}/Fotos")
-        videos_match = soup.find('a', href=f"/profile/{profile_name}/Videos")
-
-        def parse_number(text):
-            return int(text.split()[0].replace('.', '').replace(',', '')) if text else 0
-
-        total = parse_number(total_match.text if total_match else None)
-        photos = parse_number(photos_match.text if photos_match else None)
-        videos = parse_number(videos_match.text if videos_match else None)
-        log_debug(f"Contagens - Total: {total}, Fotos: {photos}, Vídeos: {videos}")
-        return total, photos, videos
+        with metrics.timer("media_count"):
+            with self.api_stream(media_count_url(profile_name), custom_headers) as response:
+                counts = parse_media_counts(iter_text(response), profile_name)
+        self.media_counts.put(profile_name, counts)
+        return counts
+
+    def cached_media_count(self, profile_name):
+        return self.media_counts.get(profile_name)
 
     def get_posts(self, profile_name, skip=0):
-        unix_timestamp = int(time.time() * 1000)
-        url = f"https://privacy.com.br/Profile?handler=PartialPosts&skip={skip}&take=50&nomePerfil={profile_name}&filter=mosaico&_={unix_timestamp}"
-        log_debug(f"Buscando posts para {profile_name}, skip={skip}")
-        result = self.playwright_get(url)
+        url = posts_url(profile_name, skip)
+        log_debug("Buscando posts para %s, skip=%d", profile_name, skip)
+        result = self.api_get(url)
         return json.loads(result)
 
+    def get_video_token(self, file_id, exp=3600):
+        payload = {'exp': exp, 'file_id': file_id}
+        log_debug("Solicitando token de vídeo para %s", file_id)
+        token_response = self.api_post(VIDEO_TOKEN_URL, payload, custom_headers)
+        try:
+            return json.loads(token_response).get("content")
+        except Exception as e:
+            log_debug(f"[ERRO] Resposta inválida ao solicitar token de vídeo ({file_id}): {e}")
+            log_debug(f"Resposta: {token_response}")
+            return None
+
     def download_image_safe(self, url, filename):
         try:
-            headers = {
-                "referer": "https://privacy.com.br/",
-                "origin": "https://privacy.com.br",
-                "priority": "u=1, i",
-                "accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
-                "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
-                "sec-fetch-dest": "image",
-                "sec-fetch-mode": "no-cors",
-                "sec-fetch-site": "same-site",
-                "sec-ch-ua": '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
-                "sec-ch-ua-mobile": "?0",
-                "sec-ch-ua-platform": '"Windows"',
-            }
-            
-            response = self.scraper.get(url, headers=headers, stream=True)
-            if response.status_code == 200:
-                os.makedirs(os.path.dirname(filename), exist_ok=True)
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                log_debug(f"[SAFE] Imagem salva: {filename}")
-                return True
-            elif response.status_code == 413:
-                log_debug(f"[SAFE] Erro 413 com altura {height}, tentando menor...")
-            else:
-                log_debug(f"[SAFE] Erro {response.status_code} ao baixar: {final_url}")
+            for index, (height, final_url) in enumerate(image_variants(url)):
+                # O .part só é retomado na primeira variante; ao trocar de variante ele é
+                # descartado, para não completar os bytes de uma com os de outra
+                success, status_code = download_to_file(
+                    self.scraper, final_url, filename, image_headers, resume=index == 0, store=get_content_store()
+                )
+                if success:
+                    log_debug("[SAFE] Imagem salva (%s): %s", height or "original", filename)
+                    return True
+                if status_code != TOO_LARGE_STATUS:
+                    # Só o 413 troca de variante; um .part parcial pertence à variante atual
+                    log_debug(f"[SAFE] Erro {status_code} ao baixar: {final_url}")
+                    break
+                metrics.inc("image_downsized")
+                log_debug("[SAFE] Erro 413 com altura %s, tentando menor...", height or "original")
         except Exception as e:
             log_debug(f"[SAFE] Erro ao baixar imagem com fallback: {e}")
         return False
 
 
     def download_video_mp4_direct(self, url, filename, token_content):
-        log_debug(f"Detectado link direto para MP4: {url}")
+        log_debug("Detectado link direto para MP4: %s", url)
         headers = {
             "referer": "https://privacy.com.br/",
             "Content": token_content
         }
         try:
             os.makedirs(os.path.dirname(filename), exist_ok=True)
-            response = self.scraper.get(url, headers=headers, stream=True)
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                log_debug(f"Download direto concluído: {filename}")
+            success, status_code = download_to_file(self.scraper, url, filename, headers, store=get_content_store())
+            if success:
+                log_debug("Download direto concluído: %s", filename)
                 return True
             else:
-                log_debug(f"[ERRO] Status {response.status_code} ao baixar mp4 direto: {url}")
+                log_debug(f"[ERRO] Status {status_code} ao baixar mp4 direto: {url}")
         except Exception as e:
             log_debug(f"[ERRO] Exceção ao baixar mp4 direto: {e}")
         return False
 
-    def close(self):
+    def close_browser(self):
         if self.browser:
             self.browser.close()
         if self.playwright:
             self.playwright.stop()
-        log_debug("Browser fechado")
\ No newline at end of file
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.playwright = None
+        log_debug("Browser fechado")
+
+    def close(self):
+        self.close_browser()
+        self.scraper.close()
@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from source.log import log_debug
+from source.tokens import TokenHolder
+
+STREAM_REMUX = os.getenv("STREAM_REMUX", "True").lower() == "true"
+STREAM_WINDOW = int(os.getenv("STREAM_WINDOW", "8"))
+
+@lru_cache(maxsize=None)
+def load_cipher():
+    # O cryptography só é importado quando aparece a primeira playlist criptografada
+    try:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    except ImportError:
+        return None
+    return Cipher, algorithms, modes
+
+def decrypt_segment(data, key_bytes, iv):
+    Cipher, algorithms, modes = load_cipher()
+    decryptor = Cipher(algorithms.AES(key_bytes), modes.CBC(iv)).decryptor()
+    plain = decryptor.update(data) + decryptor.finalize()
+    if not plain:
+        return plain
+    # Padding PKCS7 conferido: com chave ou IV errados ele não fecha, e o streaming cai
+    # para a pasta temporária em vez de mandar lixo para o ffmpeg
+    pad = plain[-1]
+    if not 1 <= pad <= 16 or plain[-pad:] != bytes([pad]) * pad:
+        raise ValueError("padding PKCS7 inválido (chave ou IV incorretos?)")
+    return plain[:-pad]
+
+def can_stream(playlist):
+    # Motivo para cair na pasta temporária, ou None quando o streaming dá conta da playlist
+    if not playlist.segments:
+        return "playlist sem segmentos"
+    reason = playlist.unsupported_for_streaming()
+    if reason:
+        return reason
+    if playlist.encrypted and load_cipher() is None:
+        return "pacote 'cryptography' ausente"
+    return None
+
+def remux_output(part_file):
+    import ffmpeg
+
+    # ffmpeg lendo MPEG-TS do stdin e copiando as trilhas para MP4, sem reencode
+    return (
+        ffmpeg
+        .input('pipe:', format='mpegts')
+        .output(part_file, format='mp4', vcodec='copy', acodec='copy', loglevel='error', **{'bsf:a': 'aac_adtstoasc'})
+        .overwrite_output()
+    )
+
+def stream_hls_to_mp4(media_downloader, playlist, output_filename, token_content, refresh_token=None):
+    reason = can_stream(playlist)
+    if reason:
+        log_debug(f"[STREAM] Playlist não suportada no modo streaming ({reason}): {playlist.url}")
+        return False
+
+    token = TokenHolder(token_content, refresh_token)
+    keys = {}
+    for key in playlist.keys:
+        key_bytes = media_downloader.fetch_key(key.uri, token.content)
+        if not key_bytes:
+            return False
+        keys[key.uri] = key_bytes
+
+    segments = playlist.segments
+    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+    part_file = f"{output_filename}.part"
+    process = remux_output(part_file).run_async(pipe_stdin=True)
+
+    def fetch(segment):
+        return media_downloader.fetch_segment(segment.url, token, segment.byterange)
+
+    # Segmentos são buscados em paralelo, mas escritos no stdin do ffmpeg em ordem;
+    # a janela limita quantos ficam em memória à frente do que já foi escrito.
+    window = max(STREAM_WINDOW, media_downloader.segment_workers)
+    success = False
+    with ThreadPoolExecutor(max_workers=media_downloader.segment_workers) as executor:
+        futures = {}
+        try:
+            for index in range(min(window, len(segments))):
+                futures[index] = executor.submit(fetch, segments[index])
+
+            for index, segment in enumerate(segments):
+                data = futures.pop(index).result()
+                next_index = index + window
+                if next_index < len(segments):
+                    futures[next_index] = executor.submit(fetch, segments[next_index])
+                if data is None:
+                    log_debug(f"[STREAM] Falha ao baixar segmento: {segment.url}")
+                    break
+                if segment.key:
+                    data = decrypt_segment(data, keys[segment.key.uri], segment.key.iv_for(segment.sequence))
+                process.stdin.write(data)
+            else:
+                success = True
+        except Exception as e:
+            log_debug(f"[STREAM] Erro durante o streaming de {playlist.url}: {e}")
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+    try:
+        process.stdin.close()
+    except Exception:
+        pass
+    if not success:
+        process.kill()
+    returncode = process.wait()
+
+    if success and returncode == 0:
+        os.replace(part_file, output_filename)
+        log_debug("[STREAM] Remux concluído: %s", output_filename)
+        return True
+
+    log_debug(f"[STREAM] Streaming falhou (ffmpeg={returncode}), usando pasta temporária")
+    if os.path.exists(part_file):
+        os.remove(part_file)
+    return False
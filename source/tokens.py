@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from source import metrics
+from source.cache import load_cache, save_cache
+from source.log import log_debug
+
+VIDEO_TOKEN_EXP = int(os.getenv("VIDEO_TOKEN_EXP", "3600"))
+VIDEO_TOKEN_MARGIN = 300
+TOKEN_WORKERS = int(os.getenv("TOKEN_WORKERS", "4"))
+TOKEN_CACHE = "video_tokens"
+TOKEN_EXPIRED_STATUS = (401, 403, 410)
+
+def load_tokens():
+    now = time.time()
+    cached = load_cache(TOKEN_CACHE) or {}
+    return {
+        file_id: (entry["content"], entry["expires_at"])
+        for file_id, entry in cached.items()
+        if entry.get("expires_at", 0) - VIDEO_TOKEN_MARGIN > now
+    }
+
+def save_tokens(tokens):
+    now = time.time()
+    data = {
+        file_id: {"content": content, "expires_at": expires_at}
+        for file_id, (content, expires_at) in tokens.items()
+        if expires_at - VIDEO_TOKEN_MARGIN > now
+    }
+    save_cache(TOKEN_CACHE, data, private=True)
+
+def video_file_id(file_url):
+    return file_url.split("/hls/")[0].split("/")[-1]
+
+class VideoTokenCache:
+    def __init__(self, scraper, exp=None, workers=None):
+        self.scraper = scraper
+        self.exp = exp or VIDEO_TOKEN_EXP
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers or TOKEN_WORKERS, thread_name_prefix="video-token")
+        self.tokens = load_tokens()
+        log_debug(f"Cache de tokens de vídeo carregado com {len(self.tokens)} entradas")
+
+    def _fetch(self, file_id):
+        requested_at = time.time()
+        content = None
+        try:
+            with metrics.timer("token"):
+                content = self.scraper.get_video_token(file_id, exp=self.exp)
+        finally:
+            # Com erro, o Future que falhou sai de pending e o próximo pedido tenta de novo
+            with self.lock:
+                self.pending.pop(file_id, None)
+                if content:
+                    self.tokens[file_id] = (content, requested_at + self.exp)
+        return content
+
+    def _future_for(self, file_id):
+        # Chamado com self.lock adquirido; compartilha a requisição entre quem pedir o mesmo file_id
+        future = self.pending.get(file_id)
+        if future is None:
+            future = self.executor.submit(self._fetch, file_id)
+            self.pending[file_id] = future
+        return future
+
+    def _cached(self, file_id):
+        entry = self.tokens.get(file_id)
+        if entry and entry[1] - VIDEO_TOKEN_MARGIN > time.time():
+            return entry[0]
+        return None
+
+    def get(self, file_id):
+        with self.lock:
+            content = self._cached(file_id)
+            if content:
+                return content
+            future = self._future_for(file_id)
+        return future.result()
+
+    def prefetch(self, file_ids):
+        with self.lock:
+            for file_id in file_ids:
+                if not self._cached(file_id):
+                    self._future_for(file_id)
+
+    def invalidate(self, file_id):
+        with self.lock:
+            self.tokens.pop(file_id, None)
+
+    def refresh(self, file_id):
+        metrics.inc("token_refreshes")
+        log_debug("Renovando token de vídeo para %s", file_id)
+        self.invalidate(file_id)
+        return self.get(file_id)
+
+    def save(self):
+        with self.lock:
+            tokens = dict(self.tokens)
+        save_tokens(tokens)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.save()
+
+class TokenHolder:
+    # Token compartilhado pelos segmentos de um vídeo; renovado uma única vez quando expira
+    def __init__(self, content, refresh=None):
+        self.content = content
+        self.refresh_fn = refresh
+        self.lock = threading.Lock()
+
+    def refresh(self, stale_content):
+        with self.lock:
+            if self.refresh_fn and self.content == stale_content:
+                content = self.refresh_fn()
+                if content:
+                    self.content = content
+            return self.content
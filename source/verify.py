@@ -0,0 +1,331 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from tqdm import tqdm
+from source.cache import load_cache, save_cache
+from source.dedup import get_content_store
+from source.download import PREALLOC_SUFFIX
+from source.log import log_debug
+from source.media import DOWNLOAD_DIR, HIGH_WATER_MARK_FORMAT, open_manifest
+
+# Verificação da biblioteca já baixada: cada arquivo de downloads/<perfil>/{fotos,videos}
+# é conferido sem decodificar a mídia (cabeçalho e final das imagens, estrutura de boxes
+# dos MP4). O resultado fica em cache por mtime e tamanho, então a próxima execução só
+# relê o que mudou. No modo reparo, os arquivos comprovadamente truncados são apagados e
+# voltam a ficar pendentes no manifesto; a próxima execução baixa só eles.
+
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", str(os.cpu_count() or 1)))
+VERIFY_CACHE = "verify"
+VERIFY_CHUNK_SIZE = 64
+MEDIA_FOLDERS = {"fotos": "image", "videos": "video"}
+MEDIA_EXTENSIONS = (".jpg", ".mp4")
+# Sobras de escritas interrompidas (download, dedup e conversão)
+LEFTOVER_SUFFIXES = (".link", ".adopt", ".tmp")
+TAIL_SIZE = 32
+SCAN_BLOCK_SIZE = 64 * 1024
+
+# Resultado de cada arquivo: None (íntegro) ou [tipo, motivo]. Só TRUNCATED é apagado no
+# --repair; INVALID (estrutura estranha, mas completa) e UNCHECKED (formato desconhecido
+# ou erro de leitura) só aparecem no relatório.
+TRUNCATED = "truncated"
+INVALID = "invalid"
+UNCHECKED = "unchecked"
+
+def jpeg_scan_start(f, size):
+    # Percorre os segmentos do cabeçalho (APPn, DQT, SOF...) até o SOS. Devolve onde começam
+    # os dados comprimidos, ou None se um segmento passa do fim do arquivo. Os EOI das
+    # miniaturas do EXIF ficam antes desse ponto e não contam.
+    offset = 2
+    while offset + 4 <= size:
+        f.seek(offset)
+        header = f.read(4)
+        if header[0] != 0xFF:
+            return offset
+        marker = header[1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            offset += 2
+            continue
+        end = offset + 2 + int.from_bytes(header[2:4], "big")
+        if end > size:
+            return None
+        if marker == 0xDA:
+            return end
+        offset = end
+    return None
+
+def find_last(f, needle, start, size):
+    # Procura de trás para frente, em blocos, a última ocorrência depois de `start`
+    position = size
+    while position > start:
+        block_start = max(start, position - SCAN_BLOCK_SIZE)
+        f.seek(block_start)
+        block = f.read(position - block_start + len(needle) - 1)
+        index = block.rfind(needle)
+        if index >= 0:
+            return block_start + index
+        position = block_start
+    return -1
+
+def check_jpeg(f, size):
+    # Motion photos e alguns APPn deixam dados depois do EOI; vale o último EOI depois
+    # do início dos dados comprimidos, que não podem conter FFD9 (o FF é escapado)
+    start = jpeg_scan_start(f, size)
+    if start is None:
+        return [TRUNCATED, "JPEG truncado no cabeçalho"]
+    if find_last(f, b"\xff\xd9", start, size) < 0:
+        return [TRUNCATED, "JPEG truncado (sem marcador EOI)"]
+    return None
+
+def check_image(path, size):
+    if size == 0:
+        return [TRUNCATED, "arquivo vazio"]
+    with open(path, 'rb') as f:
+        head = f.read(TAIL_SIZE)
+        if head.startswith(b"\xff\xd8\xff"):
+            return check_jpeg(f, size)
+        f.seek(max(0, size - TAIL_SIZE))
+        tail = f.read()
+
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return None if tail.endswith(b"IEND\xaeB`\x82") else [TRUNCATED, "PNG truncado (sem IEND)"]
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        declared = int.from_bytes(head[4:8], "little") + 8
+        return None if declared <= size else [TRUNCATED, f"WebP truncado ({size} de {declared} bytes)"]
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return None if tail.endswith(b"\x3b") else [TRUNCATED, "GIF truncado"]
+    if head[4:8] == b"ftyp":
+        # AVIF/HEIC usam a mesma estrutura de boxes do MP4
+        _, error = read_boxes(path, size)
+        return error
+    return [UNCHECKED, "formato de imagem desconhecido"]
+
+def read_boxes(path, size):
+    # Percorre só os boxes de primeiro nível, pulando o conteúdo; um arquivo cortado ou com
+    # o mdat não finalizado (remux interrompido) não fecha exatamente no tamanho do arquivo.
+    boxes = []
+    offset = 0
+    with open(path, 'rb') as f:
+        while offset < size:
+            f.seek(offset)
+            header = f.read(8)
+            if len(header) < 8:
+                return boxes, [TRUNCATED, f"cabeçalho de box truncado em {offset}"]
+            box_size = int.from_bytes(header[:4], "big")
+            box_type = header[4:8].decode("latin-1")
+            if box_size == 1:
+                large = f.read(8)
+                if len(large) < 8:
+                    return boxes, [TRUNCATED, f"box '{box_type}' truncado"]
+                box_size = int.from_bytes(large, "big")
+            elif box_size == 0:
+                box_size = size - offset
+            if box_size < 8:
+                return boxes, [INVALID, f"box '{box_type}' inválido em {offset}"]
+            if offset + box_size > size:
+                return boxes, [TRUNCATED, f"box '{box_type}' truncado ({size - offset} de {box_size} bytes)"]
+            boxes.append(box_type)
+            offset += box_size
+    return boxes, None
+
+def check_mp4(path, size):
+    if size == 0:
+        return [TRUNCATED, "arquivo vazio"]
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    # Sem ftyp no começo a estrutura de boxes não prova nada (pode ser outro formato)
+    if len(head) < 8 or head[4:8] != b"ftyp":
+        return [UNCHECKED, "formato de vídeo desconhecido"]
+    boxes, error = read_boxes(path, size)
+    if error:
+        return error
+    if "moov" not in boxes:
+        return [INVALID, "MP4 sem box moov"]
+    if "mdat" not in boxes and "moof" not in boxes:
+        return [INVALID, "MP4 sem dados de mídia"]
+    return None
+
+def check_file(task):
+    # Roda nos processos do pool; devolve (caminho, resultado) com None para arquivo íntegro
+    path, media_type, size = task
+    try:
+        if media_type == "image":
+            return path, check_image(path, size)
+        return path, check_mp4(path, size)
+    except OSError as e:
+        return path, [UNCHECKED, f"erro de leitura: {e}"]
+
+def profile_dirs(profiles=None):
+    if not os.path.isdir(DOWNLOAD_DIR):
+        return []
+    wanted = {p.lower() for p in profiles} if profiles else None
+    found = []
+    for name in sorted(os.listdir(DOWNLOAD_DIR), key=str.lower):
+        path = os.path.join(DOWNLOAD_DIR, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        if not any(os.path.isdir(os.path.join(path, folder)) for folder in MEDIA_FOLDERS):
+            continue
+        if wanted is None or name.lower() in wanted:
+            found.append(name)
+    return found
+
+def scan_profile(profile):
+    # Separa as mídias finais das sobras: pastas <mediaId>_temp, .part de arquivos que já
+    # existem e temporários do dedup. Um .part sem o arquivo final é um download a retomar.
+    media, orphans, partials = [], [], []
+    for folder, media_type in MEDIA_FOLDERS.items():
+        root = os.path.join(DOWNLOAD_DIR, profile, folder)
+        if not os.path.isdir(root):
+            continue
+        with os.scandir(root) as entries:
+            for entry in entries:
+                path = os.path.normpath(entry.path)
+                if entry.is_dir():
+                    if entry.name.endswith("_temp"):
+                        orphans.append(path)
+                    continue
+                if entry.name.endswith(PREALLOC_SUFFIX):
+                    continue
+                if entry.name.endswith(".part"):
+                    final = path[:-len(".part")]
+                    (orphans if os.path.exists(final) else partials).append(path)
+                elif entry.name.endswith(LEFTOVER_SUFFIXES):
+                    orphans.append(path)
+                elif entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                    stat = entry.stat()
+                    media.append((path, media_type, stat.st_size, stat.st_mtime_ns))
+    return sorted(media), sorted(orphans), sorted(partials)
+
+def post_date_from_filename(path):
+    try:
+        return datetime.strptime(os.path.basename(path)[:19], "%Y-%m-%d_%H-%M-%S")
+    except ValueError:
+        return None
+
+def media_id_from_filename(path):
+    return os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[-1]
+
+def remove_path(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+            if os.path.exists(f"{path}{PREALLOC_SUFFIX}"):
+                os.remove(f"{path}{PREALLOC_SUFFIX}")
+        return True
+    except OSError as e:
+        log_debug(f"[VERIFY] Não foi possível remover {path}: {e}")
+        return False
+
+def requeue_broken(manifest, profile, broken):
+    # O arquivo truncado sai do disco e do store (senão um novo download com a mesma ETag
+    # reaproveitaria o conteúdo ruim) e o mediaId volta a ficar pendente no manifesto.
+    # Os inválidos ficam onde estão: sem prova de corte, apagar poderia perder o original.
+    store = get_content_store()
+    ids = manifest.media_ids_by_path(profile)
+    dates = []
+    for item in broken:
+        if item["kind"] != TRUNCATED:
+            continue
+        path = item["path"]
+        item["media_id"] = ids.get(path) or media_id_from_filename(path)
+        if store:
+            store.discard(path)
+        if not remove_path(path):
+            continue
+        manifest.mark_failed(item["media_id"], profile, item["type"], path)
+        dates.append(post_date_from_filename(path))
+
+    # No modo incremental a listagem para na marca; ela recua para antes do post mais
+    # antigo que quebrou (ou é apagada, se algum não tem data), para que a próxima
+    # execução alcance esses itens de novo
+    if dates:
+        mark = None
+        if None not in dates:
+            mark = (min(dates) - timedelta(seconds=1)).strftime(HIGH_WATER_MARK_FORMAT)
+        for media_type, current in manifest.high_water_marks(profile).items():
+            if current and (mark is None or current > mark):
+                manifest.set_high_water_mark(profile, media_type, mark)
+    return len(dates)
+
+def verify_library(profiles=None, repair=False, workers=None):
+    cache = load_cache(VERIFY_CACHE) or {}
+    next_cache = {}
+    reports = []
+    scanned = {profile: scan_profile(profile) for profile in profile_dirs(profiles)}
+
+    # Só vão para o pool os arquivos novos ou alterados desde a última verificação
+    tasks = []
+    results = {}
+    for profile, (media, _, _) in scanned.items():
+        for path, media_type, size, mtime in media:
+            cached = cache.get(path)
+            # Entradas antigas guardavam só o motivo em texto; essas são verificadas de novo
+            if cached and cached[0] == mtime and cached[1] == size and not isinstance(cached[2], str):
+                results[path] = cached[2]
+                next_cache[path] = cached
+            else:
+                tasks.append((path, media_type, size))
+    cached_count = len(results)
+
+    if tasks:
+        mtimes = {path: mtime for media, _, _ in scanned.values() for path, _, _, mtime in media}
+        with ProcessPoolExecutor(max_workers=workers or VERIFY_WORKERS) as executor, \
+                tqdm(total=len(tasks), desc="Verificando arquivos", unit="arquivo") as pbar:
+            for (path, _, size), (_, reason) in zip(tasks, executor.map(check_file, tasks, chunksize=VERIFY_CHUNK_SIZE)):
+                results[path] = reason
+                next_cache[path] = [mtimes[path], size, reason]
+                pbar.update(1)
+
+    manifest = open_manifest() if repair else None
+    try:
+        for profile, (media, orphans, partials) in scanned.items():
+            broken, unchecked = [], []
+            for path, media_type, _, _ in media:
+                if not results[path]:
+                    continue
+                kind, reason = results[path]
+                item = {"path": path, "type": media_type, "media_id": media_id_from_filename(path), "kind": kind, "reason": reason}
+                (unchecked if kind == UNCHECKED else broken).append(item)
+            report = {
+                "profile": profile,
+                "checked": len(media),
+                "ok": len(media) - len(broken) - len(unchecked),
+                "broken": broken,
+                "unchecked": unchecked,
+                "orphans": orphans,
+                "partials": partials,
+            }
+            for item in broken:
+                tqdm.write(f"[VERIFY] {profile}: {item['path']} ({item['reason']})")
+            for item in unchecked:
+                log_debug(f"[VERIFY] {profile}: {item['path']} não verificado ({item['reason']})")
+            if repair:
+                report["requeued"] = requeue_broken(manifest, profile, broken)
+                report["removed_orphans"] = sum(remove_path(path) for path in orphans)
+                for item in broken:
+                    if item["kind"] == TRUNCATED:
+                        next_cache.pop(item["path"], None)
+            tqdm.write(
+                f"[RESUMO] {profile}: {report['ok']}/{report['checked']} arquivos íntegros, "
+                f"{len(broken)} quebrados, {len(unchecked)} não verificados, {len(orphans)} sobras, "
+                f"{len(partials)} downloads parciais"
+            )
+            reports.append(report)
+    finally:
+        if manifest:
+            manifest.close()
+
+    # Entradas de perfis fora desta verificação continuam valendo
+    checked_profiles = {os.path.normpath(os.path.join(DOWNLOAD_DIR, profile)) + os.sep for profile in scanned}
+    for path, entry in cache.items():
+        if path not in next_cache and not any(path.startswith(prefix) for prefix in checked_profiles):
+            next_cache[path] = entry
+    save_cache(VERIFY_CACHE, next_cache)
+
+    return {"profiles": reports, "checked": sum(r["checked"] for r in reports), "cached": cached_count}
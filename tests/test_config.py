@@ -0,0 +1,55 @@
+import json
+import os
+
+import pytest
+
+import main
+
+def write_config(tmp_path, config):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config), encoding="utf-8")
+    return str(path)
+
+@pytest.fixture
+def environment(monkeypatch):
+    # apply_environment grava direto no os.environ; cada teste usa uma cópia limpa
+    env = {}
+    monkeypatch.setattr(os, "environ", env)
+    monkeypatch.setattr("dotenv.load_dotenv", lambda *args, **kwargs: None)
+    return env
+
+def test_rejects_wrong_types(tmp_path, environment):
+    args = main.parse_args(["--config", write_config(tmp_path, {"profiles": ["a"], "image_workers": "many"})])
+    with pytest.raises(ValueError, match="image_workers"):
+        main.resolve_options(args)
+
+def test_rejects_bool_for_int(tmp_path, environment):
+    args = main.parse_args(["--config", write_config(tmp_path, {"profiles": ["a"], "video_workers": True})])
+    with pytest.raises(ValueError, match="video_workers"):
+        main.resolve_options(args)
+
+def test_rejects_unknown_keys(tmp_path, environment):
+    args = main.parse_args(["--config", write_config(tmp_path, {"profile": ["a"]})])
+    with pytest.raises(ValueError, match="profile"):
+        main.resolve_options(args)
+
+def test_accepts_documented_config(tmp_path, environment):
+    config = {
+        "profiles": ["perfil1", "perfil2"], "media-type": "videos", "mode": "incremental", "output": "/srv/privacy",
+        "engine": "sync", "image_workers": 8, "max_bandwidth_mbps": 20, "repair": False, "env": {"FSYNC_MB": 4},
+    }
+    options = main.resolve_options(main.parse_args(["--config", write_config(tmp_path, config)]))
+    assert options["profiles"] == ["perfil1", "perfil2"]
+    assert options["media_type"] == "2"
+
+@pytest.mark.parametrize("config", [{"profiles": ["a"], "image_workers": "many"}, {"profile": ["a"]}])
+def test_invalid_config_exits_with_error(tmp_path, environment, config):
+    assert main.main(["--config", write_config(tmp_path, config)]) == main.EXIT_ERROR
+
+def test_arguments_take_precedence_over_config_env(tmp_path, environment):
+    config = {"profiles": ["a"], "video_workers": 3, "env": {"IMAGE_WORKERS": "2", "VIDEO_WORKERS": "9", "FSYNC_MB": "4"}}
+    args = main.parse_args(["--config", write_config(tmp_path, config), "--image-workers", "8"])
+    main.apply_environment(main.resolve_options(args))
+    assert environment["IMAGE_WORKERS"] == "8"
+    assert environment["VIDEO_WORKERS"] == "3"
+    assert environment["FSYNC_MB"] == "4"
@@ -0,0 +1,69 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from source import network
+from source.download import download_to_file
+
+BODY = bytes(range(256)) * 64
+
+class StallingHandler(BaseHTTPRequestHandler):
+    # A primeira resposta manda metade do corpo e para de enviar; as seguintes vêm inteiras
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        if len(self.requests_seen) == 1:
+            self.wfile.write(BODY[:len(BODY) // 2])
+            self.wfile.flush()
+            time.sleep(3)
+            return
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stalling_server():
+    StallingHandler.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StallingHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/video.mp4"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def short_timeouts(monkeypatch):
+    monkeypatch.setattr(network, "READ_TIMEOUT", 0.3)
+    monkeypatch.setattr(network, "RETRY_BASE_DELAY", 0.01)
+
+def test_send_applies_default_timeout(monkeypatch):
+    seen = {}
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            seen.update(kwargs)
+            raise requests.ConnectionError("offline")
+
+    with pytest.raises(requests.ConnectionError):
+        network.send(Session(), "GET", "http://example.invalid/", attempts=1)
+    assert seen["timeout"] == (network.CONNECT_TIMEOUT, network.READ_TIMEOUT)
+
+def test_stalled_body_times_out_and_retries(stalling_server, short_timeouts, tmp_path):
+    filename = str(tmp_path / "video.mp4")
+    started = time.monotonic()
+    with requests.Session() as session:
+        success, status_code = download_to_file(session, stalling_server, filename)
+    assert success and status_code == 200
+    assert time.monotonic() - started < 3
+    assert len(StallingHandler.requests_seen) == 2
+    with open(filename, "rb") as f:
+        assert f.read() == BODY